@@ -0,0 +1,256 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, PIT_KEEP_ALIVE, SUGGEST_BACKEND, OPENSEARCH_TIMEOUT, HYBRID_DEADLINE
+)
+from database import create_async_db, search_row_to_hit, fulltext_query
+import facet_index
+import hybrid
+import local_index
+import metrics
+import opensearch_client as os_client
+import prefix_index
+import search_cache
+import spelling
+from schemas import SearchBatch
+
+router = APIRouter()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Клиенты создаются один раз на процесс и разделяются всеми запросами
+    app.state.async_os = os_client.create_async_client()
+    app.state.async_engine, app.state.async_session = create_async_db()
+    metrics.instrument_engine(app.state.async_engine)
+    yield
+    await app.state.async_os.close()
+    await app.state.async_engine.dispose()
+
+
+def get_async_os(request: Request):
+    return request.app.state.async_os
+
+
+async def get_async_db(request: Request):
+    async with request.app.state.async_session() as session:
+        yield session
+
+
+def _search(client, **kwargs):
+    return os_client.aguarded(client.search, request_timeout=OPENSEARCH_TIMEOUT, **kwargs)
+
+
+async def search_hits(client, q, category, min_price, max_price,
+                      cursor=None, page_size=DEFAULT_PAGE_SIZE, use_pit=False, fields=os_client.SOURCE_FIELDS):
+    state = os_client.decode_cursor(cursor) if cursor else {}
+    pit_id = state.get("pit")
+
+    if not cursor and not use_pit:
+        key = search_cache.make_key(q, category, min_price, max_price, page_size, fields)
+        body = os_client.build_search_body(q, category, min_price, max_price, page_size, fields=fields)
+        return await search_cache.results.aget_or_load(
+            key, lambda: _search(client, index=os_client.INDEX_NAME, body=body)
+        )
+
+    if use_pit and not pit_id:
+        pit_id = (await os_client.aguarded(
+            client.create_pit, index=os_client.INDEX_NAME, params={"keep_alive": PIT_KEEP_ALIVE}
+        ))["pit_id"]
+    body = os_client.build_search_body(q, category, min_price, max_price, page_size, state.get("sa"), pit_id, fields)
+    if pit_id:
+        results = await _search(client, body=body)
+        if len(results["hits"]["hits"]) < page_size:
+            await os_client.aguarded(client.delete_pit, body={"pit_id": [pit_id]})
+        return results
+    return await _search(client, index=os_client.INDEX_NAME, body=body)
+
+
+async def search_facets(client, q, category, min_price, max_price, facets, price_buckets):
+    if not facets:
+        return {}
+    if not q and facet_index.index.ready:
+        aggregations = facet_index.index.facets(category, min_price, max_price, facets, price_buckets)
+        if aggregations is not None:
+            return aggregations
+    key = search_cache.make_key(q, category, min_price, max_price, facets, price_buckets)
+    body = os_client.build_facets_body(q, category, min_price, max_price, facets, price_buckets)
+
+    async def load():
+        return (await _search(client, index=os_client.INDEX_NAME, body=body))["aggregations"]
+    return await search_cache.facets.aget_or_load(key, load)
+
+
+async def _timed(coro):
+    start = time.perf_counter()
+    result = await coro
+    return result, round((time.perf_counter() - start) * 1000, 2)
+
+
+def require_local_index():
+    if not local_index.index.ready:
+        raise HTTPException(status_code=503, detail="OpenSearch unavailable")
+
+
+@router.get("/search")
+async def search(
+    q: str | None = None,
+    category: str | None = None,
+    min_price: float | None = None,
+    max_price: float | None = None,
+    cursor: str | None = None,
+    page_size: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    pit: bool = False,
+    facets: str | None = None,
+    price_buckets: str | None = None,
+    fields: str | None = None,
+    client=Depends(get_async_os)
+):
+    try:
+        facet_names = os_client.parse_facets(facets)
+        buckets = os_client.parse_price_buckets(price_buckets)
+        source_fields = os_client.parse_fields(fields)
+        try:
+            # Хиты и фасеты - независимые запросы, выполняются параллельно
+            (results, hits_ms), (aggregations, aggs_ms) = await asyncio.gather(
+                _timed(search_hits(client, q, category, min_price, max_price, cursor, page_size, pit, source_fields)),
+                _timed(search_facets(client, q, category, min_price, max_price, facet_names, buckets))
+            )
+            engine = "opensearch"
+        except os_client.OpenSearchUnavailable:
+            require_local_index()
+            search_after = os_client.decode_cursor(cursor)["sa"] if cursor else None
+            start = time.perf_counter()
+            results = local_index.index.search(
+                q, category, min_price, max_price, page_size, search_after, source_fields
+            )
+            hits_ms = round((time.perf_counter() - start) * 1000, 2)
+            start = time.perf_counter()
+            aggregations = local_index.index.facets(q, category, min_price, max_price, facet_names, buckets)
+            aggs_ms = round((time.perf_counter() - start) * 1000, 2)
+            engine = "local"
+    except os_client.InvalidSearchParameter as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    data = os_client.format_search(results, page_size, aggregations)
+    data["timings"] = {"hits_ms": hits_ms, "aggs_ms": aggs_ms}
+    return os_client.json_response(data, engine)
+
+
+@router.post("/search/batch")
+async def search_batch(batch: SearchBatch, client=Depends(get_async_os)):
+    try:
+        specs = [{**spec.model_dump(), "fields": os_client.parse_fields(spec.fields)} for spec in batch.searches]
+    except os_client.InvalidSearchParameter as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    start = time.perf_counter()
+    try:
+        results = await os_client.aguarded(
+            client.msearch, body=os_client.build_msearch_body(specs), request_timeout=OPENSEARCH_TIMEOUT
+        )
+        engine = "opensearch"
+    except os_client.OpenSearchUnavailable:
+        require_local_index()
+        results = local_index.index.search_batch(specs)
+        engine = "local"
+    return os_client.json_response({
+        "results": os_client.format_msearch(results, specs),
+        "time_ms": round((time.perf_counter() - start) * 1000, 2)
+    }, engine)
+
+
+@router.get("/direct-search")
+async def direct_search(q: str, db: AsyncSession = Depends(get_async_db)):
+    # Время SQL попадает в фазу db через хуки движка (metrics.instrument_engine)
+    rows = await db.execute(text("SELECT * FROM search_products(:query)"), {"query": q})
+    with metrics.phase("serialization"):
+        hits = [search_row_to_hit(row) for row in rows]
+    return {"hits": hits, "time_ms": metrics.elapsed_ms("db", "serialization"), "count": len(hits)}
+
+
+async def _opensearch_hits(client, q, limit):
+    return os_client.format_hits(await search_hits(client, q, None, None, None, page_size=limit))["hits"]
+
+
+async def _postgres_hits(db, q, limit):
+    await db.execute(hybrid.STATEMENT_TIMEOUT_SQL, {"timeout": hybrid.statement_timeout(HYBRID_DEADLINE)})
+    rows = await db.execute(fulltext_query(q, limit))
+    return [search_row_to_hit(row) for row in rows]
+
+
+@router.get("/hybrid-search")
+async def hybrid_search(
+    q: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    client=Depends(get_async_os),
+    db: AsyncSession = Depends(get_async_db)
+):
+    start = time.perf_counter()
+    tasks = {
+        "opensearch": asyncio.ensure_future(_opensearch_hits(client, q, limit)),
+        "postgres": asyncio.ensure_future(_postgres_hits(db, q, limit)),
+    }
+    await asyncio.wait(tasks.values(), timeout=HYBRID_DEADLINE)
+    outcomes = {}
+    for engine, task in tasks.items():
+        if not task.done():
+            # Сессия БД закрывается вместе с запросом, поэтому запрос к Postgres отменяется;
+            # опоздавший поиск OpenSearch дорабатывает и прогревает кэш
+            if engine == "postgres":
+                task.cancel()
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            outcomes[engine] = ("timeout", None)
+        elif task.exception() is not None:
+            outcomes[engine] = ("error", None)
+        else:
+            outcomes[engine] = ("ok", task.result())
+    result = hybrid.collect(outcomes, limit, start)
+    if not any(status == "ok" for status in result["engines"].values()):
+        raise HTTPException(status_code=503, detail=result["engines"])
+    return result
+
+
+@router.get("/suggest")
+async def suggest(q: str, client=Depends(get_async_os)):
+    if SUGGEST_BACKEND == "trie" and prefix_index.index.ready:
+        return os_client.json_response({"suggestions": prefix_index.index.suggest(q)}, "trie")
+    try:
+        results = await _search(client, index=os_client.INDEX_NAME, body=os_client.build_suggest_body(q))
+    except os_client.OpenSearchUnavailable:
+        if not prefix_index.index.ready:
+            raise HTTPException(status_code=503, detail="OpenSearch unavailable")
+        return os_client.json_response({"suggestions": prefix_index.index.suggest(q)}, "trie")
+    return os_client.json_response(os_client.format_suggestions(results), "opensearch")
+
+
+@router.get("/fuzzy-search")
+async def fuzzy_search_endpoint(q: str, fields: str | None = None, client=Depends(get_async_os)):
+    try:
+        source_fields = os_client.parse_fields(fields)
+    except os_client.InvalidSearchParameter as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    corrected, confident = spelling.correct_query(q)
+    try:
+        fuzzy = not confident
+        if confident:
+            results = await _search(
+                client, index=os_client.INDEX_NAME,
+                body=os_client.build_fuzzy_body(corrected, source_fields, fuzziness=None)
+            )
+            fuzzy = not results["hits"]["hits"]
+        if fuzzy:
+            results = await _search(
+                client, index=os_client.INDEX_NAME, body=os_client.build_fuzzy_body(q, source_fields)
+            )
+        engine = "opensearch"
+    except os_client.OpenSearchUnavailable:
+        require_local_index()
+        results = local_index.index.search(corrected, fields=source_fields)
+        fuzzy = False
+        engine = "local"
+    return os_client.json_response(os_client.format_fuzzy(results, q, corrected, fuzzy), engine)
@@ -1,48 +1,406 @@
-import requests
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
 import time
-from concurrent.futures import ThreadPoolExecutor
-
-def test_endpoint(url, n_requests=100, n_workers=10):
-    times = []
-    
-    def make_request():
-        start = time.time()
-        try:
-            r = requests.get(url)
-            elapsed = time.time() - start
-            times.append(elapsed)
-            return r.status_code == 200
-        except:
-            return False
-    
-    start_total = time.time()
-    with ThreadPoolExecutor(max_workers=n_workers) as executor:
-        results = list(executor.map(lambda _: make_request(), range(n_requests)))
-    total_time = time.time() - start_total
-    
-    success = sum(results)
-    avg_time = sum(times) / len(times) if times else 0
-    
-    print(f"\nURL: {url}")
-    print(f"Total requests: {n_requests}")
-    print(f"Successful: {success}")
-    print(f"Failed: {n_requests - success}")
-    print(f"Total time: {total_time:.2f}s")
-    print(f"Requests/sec: {n_requests/total_time:.2f}")
-    print(f"Avg response time: {avg_time*1000:.2f}ms")
+from datetime import datetime
+
+import httpx
+
+BASE_URL = "http://127.0.0.1:8000"
+OPENSEARCH_URL = "http://127.0.0.1:9200"
+ENDPOINTS = {
+    "direct-search": "/direct-search",
+    "direct-search-orm": "/direct-search-orm",
+    "search": "/search",
+    "hybrid-search": "/hybrid-search",
+}
+TITLES = {
+    "direct-search": "SQL функция (direct-search)",
+    "direct-search-orm": "SQLAlchemy ORM (direct-search-orm)",
+    "search": "OpenSearch (search)",
+    "hybrid-search": "OpenSearch + SQL, RRF (hybrid-search)",
+}
+PERCENTILES = [50, 90, 99, 99.9]
+# Прежний запрос /direct-search-orm: tsvector считается для каждой строки.
+# plainto_tsquery вместо to_tsquery - иначе многословные запросы корпуса падают с ошибкой
+LEGACY_ORM_SQL = (
+    "SELECT id, name, description, price, category FROM products "
+    "WHERE to_tsvector(name || ' ' || description) @@ plainto_tsquery(:q)"
+)
+
+
+class LatencyHistogram:
+    # Гистограмма в стиле HDR: логарифмические диапазоны, внутри каждого
+    # 2^SUB_BUCKET_BITS линейных ячеек - точность ~3 значащих цифры при O(1) записи
+    SUB_BUCKET_BITS = 11
+
+    def __init__(self):
+        self.counts = {}
+        self.total = 0
+        self.sum_us = 0
+        self.max_us = 0
+
+    def _bucket(self, value_us):
+        shift = max(0, value_us.bit_length() - self.SUB_BUCKET_BITS)
+        return shift, value_us >> shift
+
+    def record(self, seconds):
+        value_us = max(1, int(seconds * 1_000_000))
+        bucket = self._bucket(value_us)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.total += 1
+        self.sum_us += value_us
+        self.max_us = max(self.max_us, value_us)
+
+    def percentile(self, p):
+        if not self.total:
+            return 0.0
+        target = max(1, round(self.total * p / 100))
+        seen = 0
+        for shift, sub in sorted(self.counts, key=lambda b: b[1] << b[0]):
+            seen += self.counts[(shift, sub)]
+            if seen >= target:
+                # Верхняя граница ячейки, но не больше фактического максимума
+                return min(((sub + 1) << shift) - 1, self.max_us) / 1000
+        return self.max_us / 1000
+
+    def summary(self):
+        return {
+            "mean": round(self.sum_us / self.total / 1000, 3) if self.total else 0.0,
+            **{f"p{str(p).replace('.', '')}": round(self.percentile(p), 3) for p in PERCENTILES},
+            "max": round(self.max_us / 1000, 3),
+        }
+
+
+def process_cpu_seconds(pid):
+    # utime + stime процесса сервера из /proc (Linux); воркеры uvicorn - отдельные pid
+    if pid is None:
+        return None
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        queries = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    if not queries:
+        raise SystemExit(f"Корпус запросов {path} пуст")
+    return queries
+
+
+async def run_endpoint(base_url, path, queries, concurrency, duration, warmup, timeout, params=None, server_pid=None):
+    histogram = LatencyHistogram()
+    errors = {}
+    status = {"requests": 0, "bytes": 0}
+    corpus = itertools.cycle(queries)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        async def worker(deadline, measure):
+            while time.perf_counter() < deadline:
+                query = next(corpus)
+                start = time.perf_counter()
+                try:
+                    response = await client.get(path, params={"q": query, **(params or {})})
+                    elapsed = time.perf_counter() - start
+                    error = None if response.status_code == 200 else f"HTTP {response.status_code}"
+                    size = len(response.content)
+                except httpx.HTTPError as e:
+                    elapsed = time.perf_counter() - start
+                    error, size = type(e).__name__, 0
+                if not measure:
+                    continue
+                status["requests"] += 1
+                if error:
+                    errors[error] = errors.get(error, 0) + 1
+                else:
+                    histogram.record(elapsed)
+                    status["bytes"] += size
+
+        # Прогрев: соединения открыты, кэши и JIT планировщика прогреты, замеры не пишутся
+        if warmup > 0:
+            deadline = time.perf_counter() + warmup
+            await asyncio.gather(*(worker(deadline, False) for _ in range(concurrency)))
+
+        cpu_before = process_cpu_seconds(server_pid)
+        start = time.perf_counter()
+        deadline = start + duration
+        await asyncio.gather(*(worker(deadline, True) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        cpu_after = process_cpu_seconds(server_pid)
+
+    ok = status["requests"] - sum(errors.values())
+    result = {
+        "path": path,
+        "requests": status["requests"],
+        "successful": ok,
+        "failed": sum(errors.values()),
+        "errors": errors,
+        "rps": round(status["requests"] / elapsed, 2),
+        "avg_bytes": round(status["bytes"] / ok) if ok else 0,
+        "latency_ms": histogram.summary(),
+    }
+    if server_pid is not None and status["requests"]:
+        result["cpu_ms_per_request"] = round((cpu_after - cpu_before) * 1000 / status["requests"], 3)
+    return result
+
+
+async def dataset_size(opensearch_url, timeout):
+    # Точное число товаров в индексе: total у /search ограничен 10000 (track_total_hits не задан)
+    async with httpx.AsyncClient(base_url=opensearch_url, timeout=timeout) as client:
+        response = await client.get("/products/_count")
+        response.raise_for_status()
+        return response.json()["count"]
+
+
+def resolve_dataset(args):
+    # --dataset NAME: корпус из datasets/NAME/queries.txt (см. generate_catalog.py)
+    from generate_catalog import DATASETS, DATASETS_DIR
+    if args.dataset not in DATASETS:
+        raise SystemExit(f"Неизвестный набор {args.dataset}: {', '.join(DATASETS)}")
+    args.corpus = args.corpus or os.path.join(DATASETS_DIR, args.dataset, "queries.txt")
+    return DATASETS[args.dataset]
+
+
+async def run(args):
+    expected = resolve_dataset(args) if args.dataset else None
+    args.corpus = args.corpus or "queries.txt"
+    queries = load_corpus(args.corpus)
+    params = dict(param.split("=", 1) for param in args.param)
+    documents = None
+    if expected:
+        documents = await dataset_size(args.opensearch_url, args.timeout)
+        if documents != expected:
+            print(f"Внимание: в индексе {documents} товаров, набор {args.dataset} - {expected}")
+    report = {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "base_url": args.base_url,
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "warmup_s": args.warmup,
+            "corpus": args.corpus,
+            "queries": len(queries),
+            "dataset": args.dataset,
+            "documents": documents,
+            "params": params,
+            "server_pid": args.server_pid,
+        },
+        "endpoints": {},
+    }
+    for name in args.endpoints.split(","):
+        path = ENDPOINTS.get(name, name)
+        print(f"=== {name} ({path}) ===")
+        result = await run_endpoint(
+            args.base_url, path, queries, args.concurrency, args.duration, args.warmup, args.timeout,
+            params, args.server_pid
+        )
+        report["endpoints"][name] = result
+        latency = result["latency_ms"]
+        print(f"Requests/sec: {result['rps']}, failed: {result['failed']} {result['errors'] or ''}")
+        print(f"p50 {latency['p50']}ms  p90 {latency['p90']}ms  p99 {latency['p99']}ms  p999 {latency['p999']}ms")
+        print(f"Bytes/response: {result['avg_bytes']}"
+              + (f", server CPU/request: {result['cpu_ms_per_request']}ms" if "cpu_ms_per_request" in result else ""))
+    return report
+
+
+def write_markdown(report, path):
+    meta = report["meta"]
+    lines = [
+        "# Результаты тестирования производительности поиска",
+        "",
+        "## Параметры тестирования",
+        f"- Дата: {meta['date']}",
+        f"- Длительность: {meta['duration_s']} с (прогрев {meta['warmup_s']} с)",
+        f"- Конкурентные соединения: {meta['concurrency']}",
+        f"- Корпус запросов: `{meta['corpus']}` ({meta['queries']} запросов)",
+    ]
+    if meta.get("dataset"):
+        lines.append(f"- Набор данных: {meta['dataset']} ({meta['documents']} товаров)")
+    if meta.get("params"):
+        lines.append(f"- Параметры запроса: `{'&'.join(f'{k}={v}' for k, v in meta['params'].items())}`")
+    lines += [
+        "- Инструмент: benchmark.py (httpx, keep-alive)",
+        "",
+        "## Результаты",
+        "",
+    ]
+    # Эндпоинты без единого успешного ответа - в конец списка
+    ranked = sorted(
+        report["endpoints"].items(),
+        key=lambda item: (item[1]["successful"] == 0, item[1]["latency_ms"]["p99"])
+    )
+    for number, (name, result) in enumerate(ranked, start=1):
+        latency = result["latency_ms"]
+        lines += [
+            f"### {number}. {TITLES.get(name, name)}",
+            "",
+            "```",
+            f"Requests per second:    {result['rps']:.2f} [#/sec]",
+            f"Time per request:       {latency['mean']:.3f} [ms] (mean)",
+            f"Failed requests:        {result['failed']}",
+            f"Bytes per response:     {result['avg_bytes']}",
+        ]
+        if "cpu_ms_per_request" in result:
+            lines.append(f"Server CPU per request: {result['cpu_ms_per_request']:.3f} [ms]")
+        lines += [
+            "```",
+            "",
+        ]
+        if result["errors"]:
+            lines += ["**Ошибки:**"] + [f"- {error}: {count}" for error, count in result["errors"].items()] + [""]
+        lines += [
+            "**Percentiles:**",
+            f"- 50%: {latency['p50']} ms",
+            f"- 90%: {latency['p90']} ms",
+            f"- 99%: {latency['p99']} ms",
+            f"- 99.9%: {latency['p999']} ms",
+            "",
+            "---",
+            "",
+        ]
+    lines += [
+        "## Сравнительная таблица",
+        "",
+        "| Метод | Requests/sec | Среднее время (ms) | p99 (ms) | p99.9 (ms) | Байт/ответ | CPU/запрос (ms) | Ошибки |",
+        "|-------|--------------|-------------------|----------|------------|------------|-----------------|--------|",
+    ]
+    for name, result in ranked:
+        latency = result["latency_ms"]
+        cpu = result.get("cpu_ms_per_request", "-")
+        lines.append(
+            f"| **{name}** | {result['rps']:.2f} | {latency['mean']:.1f} | {latency['p99']} | {latency['p999']} "
+            f"| {result['avg_bytes']} | {cpu} | {result['failed']} |"
+        )
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def _plan_nodes(plan):
+    yield plan["Node Type"], plan.get("Index Name")
+    for child in plan.get("Plans", []):
+        yield from _plan_nodes(child)
+
+
+def explain(queries, limit):
+    # EXPLAIN ANALYZE прежнего и текущего запроса /direct-search-orm на корпусе:
+    # видно, где полный проход по таблице (Seq Scan), а где GIN-индекс (Bitmap Index Scan)
+    from sqlalchemy import text
+    from database import engine, fulltext_query
+
+    legacy = text(LEGACY_ORM_SQL).compile(engine)
+    variants = {
+        "legacy": lambda q: (legacy, {"q": q}),
+        "search_vector": lambda q: (fulltext_query(q, limit).compile(engine), None),
+    }
+    report = {}
+    with engine.connect() as conn:
+        for name, build in variants.items():
+            times, scans = [], {}
+            for query in queries:
+                compiled, params = build(query)
+                plan = conn.exec_driver_sql(
+                    f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {compiled}", compiled.construct_params(params)
+                ).scalar()[0]
+                times.append(plan["Execution Time"])
+                for node, index in _plan_nodes(plan["Plan"]):
+                    if node.endswith("Scan"):
+                        label = f"{node} ({index})" if index else node
+                        scans[label] = scans.get(label, 0) + 1
+            times.sort()
+            report[name] = {
+                "queries": len(times),
+                "mean_ms": round(sum(times) / len(times), 3),
+                "p50_ms": round(times[len(times) // 2], 3),
+                "max_ms": round(times[-1], 3),
+                "scans": scans,
+            }
+            print(f"=== {name} ===")
+            print(f"mean {report[name]['mean_ms']}ms  p50 {report[name]['p50_ms']}ms  max {report[name]['max_ms']}ms")
+            for label, count in scans.items():
+                print(f"  {label}: {count}")
+    return report
+
+
+def diff(old, new, threshold):
+    # Регрессия: рост любого перцентиля или падение RPS больше чем на threshold
+    regressions = []
+    print(f"{'endpoint':<20}{'metric':<8}{'old':>12}{'new':>12}{'change':>10}")
+    for name, new_result in new["endpoints"].items():
+        old_result = old["endpoints"].get(name)
+        if old_result is None:
+            print(f"{name:<20}новый эндпоинт, сравнивать не с чем")
+            continue
+        metrics = [("rps", old_result["rps"], new_result["rps"], -1)]
+        for key in ["p50", "p90", "p99", "p999"]:
+            metrics.append((key, old_result["latency_ms"][key], new_result["latency_ms"][key], 1))
+        for key, label in [("avg_bytes", "bytes"), ("cpu_ms_per_request", "cpu_ms")]:
+            if key in old_result and key in new_result:
+                metrics.append((label, old_result[key], new_result[key], 1))
+        for metric, old_value, new_value, direction in metrics:
+            change = (new_value - old_value) / old_value if old_value else 0.0
+            flag = ""
+            if change * direction > threshold:
+                flag = "  REGRESSION"
+                regressions.append((name, metric, change))
+            print(f"{name:<20}{metric:<8}{old_value:>12}{new_value:>12}{change:>+10.1%}{flag}")
+    return regressions
+
 
 if __name__ == "__main__":
-    import sys
-    base_url = "http://127.0.0.1:8000"
-    query = sys.argv[1] if len(sys.argv) > 1 else "laptop"
-    
-    print(f"Testing with query: {query}")
-    
-    print("\n=== Testing direct-search (SQL function) ===")
-    test_endpoint(f"{base_url}/direct-search?q={query}")
-    
-    print("\n=== Testing direct-search-orm (SQLAlchemy) ===")
-    test_endpoint(f"{base_url}/direct-search-orm?q={query}")
-    
-    print("\n=== Testing search (OpenSearch) ===")
-    test_endpoint(f"{base_url}/search?q={query}")
+    parser = argparse.ArgumentParser(description="Нагрузочное сравнение эндпоинтов поиска")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="прогнать нагрузку")
+    run_parser.add_argument("--base-url", default=BASE_URL)
+    run_parser.add_argument("--opensearch-url", default=OPENSEARCH_URL,
+                            help="OpenSearch для проверки размера набора (--dataset)")
+    run_parser.add_argument("--endpoints", default="direct-search,direct-search-orm,search",
+                            help="имена из ENDPOINTS или пути, через запятую")
+    run_parser.add_argument("--concurrency", type=int, default=10)
+    run_parser.add_argument("--duration", type=float, default=30, help="секунд замера на эндпоинт")
+    run_parser.add_argument("--warmup", type=float, default=5, help="секунд прогрева на эндпоинт")
+    run_parser.add_argument("--timeout", type=float, default=10)
+    run_parser.add_argument("--corpus", help="файл с запросами, по одному в строке (по умолчанию queries.txt)")
+    run_parser.add_argument("--dataset", help="набор generate_catalog.py: корпус datasets/NAME/queries.txt "
+                                              "и проверка числа товаров в индексе")
+    run_parser.add_argument("--param", action="append", default=[], metavar="KEY=VALUE",
+                            help="дополнительный параметр запроса, например fields=id,name")
+    run_parser.add_argument("--server-pid", type=int, help="pid процесса сервера для замера CPU на запрос (Linux)")
+    run_parser.add_argument("--json", dest="json_path", help="сохранить результаты в JSON")
+    run_parser.add_argument("--markdown", help="сохранить отчёт в формате benchmark_results.md")
+
+    diff_parser = commands.add_parser("diff", help="сравнить два JSON-прогона")
+    diff_parser.add_argument("old")
+    diff_parser.add_argument("new")
+    diff_parser.add_argument("--threshold", type=float, default=0.1, help="допустимое ухудшение, доля")
+
+    explain_parser = commands.add_parser("explain", help="планы запроса /direct-search-orm: seq scan против GIN")
+    explain_parser.add_argument("--corpus", default="queries.txt")
+    explain_parser.add_argument("--limit", type=int, default=20)
+    explain_parser.add_argument("--json", dest="json_path", help="сохранить результаты в JSON")
+
+    args = parser.parse_args()
+    if args.command == "explain":
+        report = explain(load_corpus(args.corpus), args.limit)
+        if args.json_path:
+            with open(args.json_path, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+    elif args.command == "run":
+        report = asyncio.run(run(args))
+        if args.json_path:
+            with open(args.json_path, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+        if args.markdown:
+            write_markdown(report, args.markdown)
+    else:
+        with open(args.old, encoding="utf-8") as f:
+            old_report = json.load(f)
+        with open(args.new, encoding="utf-8") as f:
+            new_report = json.load(f)
+        if diff(old_report, new_report, args.threshold):
+            sys.exit(1)
@@ -0,0 +1,60 @@
+import os
+
+# sync  - обработчики def + блокирующие клиенты OpenSearch/SQLAlchemy (threadpool)
+# async - обработчики async def + AsyncOpenSearch и async-движок SQLAlchemy
+SEARCH_MODE = os.getenv("SEARCH_MODE", "sync")
+
+# Кэш результатов search_products. Кэш свой у каждого процесса: outbox_worker сбрасывает
+# только кэш процесса, который разобрал запись. При нескольких воркерах uvicorn остальные
+# увидят новый товар не позже чем через SEARCH_CACHE_TTL секунд
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "1000"))
+SEARCH_CACHE_MAX_BYTES = int(os.getenv("SEARCH_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "30"))
+
+# Фоновая индексация из таблицы search_outbox
+OUTBOX_WORKER_ENABLED = os.getenv("OUTBOX_WORKER_ENABLED", "1") == "1"
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "0.5"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10"))
+OUTBOX_RETRY_BACKOFF = float(os.getenv("OUTBOX_RETRY_BACKOFF", "1"))
+
+# Постраничная выдача /search (search_after + point-in-time)
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "20"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "100"))
+PIT_KEEP_ALIVE = os.getenv("PIT_KEEP_ALIVE", "1m")
+
+# Границы диапазонов цен для фасета price (можно переопределить параметром price_buckets)
+PRICE_BUCKETS = tuple(float(edge) for edge in os.getenv("PRICE_BUCKETS", "1000,5000").split(","))
+
+# Автодополнение: opensearch - completion suggester, trie - префиксное дерево в памяти процесса
+SUGGEST_BACKEND = os.getenv("SUGGEST_BACKEND", "opensearch")
+SUGGEST_SIZE = int(os.getenv("SUGGEST_SIZE", "5"))
+
+# Таймаут поисковых запросов к OpenSearch и параметры circuit breaker
+OPENSEARCH_TIMEOUT = float(os.getenv("OPENSEARCH_TIMEOUT", "2"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "10"))
+
+# Индексы в памяти процесса (резервный поиск, опечатки, фасеты) строятся из Postgres при старте
+# и обновляются только из outbox_worker после индексации в OpenSearch - согласованы с ним в конечном счёте.
+# У каждого процесса uvicorn свой экземпляр, а outbox между процессами делится (SKIP LOCKED), поэтому
+# при нескольких воркерах индексы расходятся: по умолчанию выключены, включать для одного воркера
+LOCAL_INDEX_ENABLED = os.getenv("LOCAL_INDEX_ENABLED", "0") == "1"
+
+# /hybrid-search: общий дедлайн на оба движка и константа k reciprocal rank fusion
+HYBRID_DEADLINE = float(os.getenv("HYBRID_DEADLINE", "0.3"))
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+
+# POST /search/batch: максимум поисков в одном _msearch
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "20"))
+
+# Исправление опечаток перед /fuzzy-search: словарь symmetric delete по словам товаров
+SPELLING_ENABLED = os.getenv("SPELLING_ENABLED", "0") == "1"
+SPELLING_MAX_EDIT_DISTANCE = int(os.getenv("SPELLING_MAX_EDIT_DISTANCE", "2"))
+
+# Потоковая выгрузка NDJSON: потолок строк на запрос и размер пачки (страница PIT / порция серверного курсора)
+EXPORT_MAX_ROWS = int(os.getenv("EXPORT_MAX_ROWS", "100000"))
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+
+# Фасеты без текстового запроса из памяти процесса: отсортированные цены по категориям
+FACET_INDEX_ENABLED = os.getenv("FACET_INDEX_ENABLED", "0") == "1"
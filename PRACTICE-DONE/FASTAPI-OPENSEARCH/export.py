@@ -0,0 +1,62 @@
+import orjson
+
+from config import EXPORT_CHUNK_SIZE, PIT_KEEP_ALIVE
+from database import SessionLocal, search_row_to_hit, fulltext_query
+import opensearch_client as os_client
+
+MEDIA_TYPE = "application/x-ndjson"
+
+
+# Генераторы отдают по одной порции NDJSON на пачку строк. StreamingResponse запрашивает
+# следующую порцию только после того, как предыдущая отправлена клиенту, поэтому медленный
+# клиент тормозит чтение из курсора, а в памяти держится не больше одной пачки
+
+
+def _ndjson(rows):
+    return b"".join(orjson.dumps(row) + b"\n" for row in rows)
+
+
+def postgres_rows(q, limit, chunk_size=EXPORT_CHUNK_SIZE):
+    # Своя сессия: зависимость get_db закрывается раньше, чем ответ дочитан.
+    # yield_per включает серверный курсор (stream_results) - строки приходят пачками.
+    # Без ранжирования: ORDER BY ts_rank_cd заставил бы Postgres оценить все совпадения до первой строки
+    db = SessionLocal()
+    try:
+        stmt = fulltext_query(q, limit, ranked=False).execution_options(yield_per=chunk_size)
+        for chunk in db.execute(stmt).partitions():
+            yield _ndjson(search_row_to_hit(row) for row in chunk)
+    finally:
+        db.close()
+
+
+def open_pit():
+    # Вызывается до начала ответа: недоступный кластер даёт 503, а не оборванный поток
+    return os_client.guarded(
+        os_client.client.create_pit, index=os_client.INDEX_NAME, params={"keep_alive": PIT_KEEP_ALIVE}
+    )["pit_id"]
+
+
+def opensearch_rows(pit_id, q, category=None, min_price=None, max_price=None,
+                    fields=os_client.SOURCE_FIELDS, limit=EXPORT_CHUNK_SIZE, chunk_size=EXPORT_CHUNK_SIZE):
+    # Снимок PIT + search_after: выгрузка не видит изменений индекса и не съезжает между страницами
+    sent, search_after = 0, None
+    try:
+        while sent < limit:
+            body = os_client.build_search_body(q, category, min_price, max_price,
+                                               search_after=search_after, pit_id=pit_id, fields=fields)
+            body["size"] = min(chunk_size, limit - sent)
+            results = os_client._search(body=body)
+            pit_id = results.get("pit_id", pit_id)
+            hits = results["hits"]["hits"]
+            if not hits:
+                break
+            sent += len(hits)
+            search_after = hits[-1]["sort"]
+            yield _ndjson(hit["_source"] for hit in hits)
+            if len(hits) < body["size"]:
+                break
+    finally:
+        try:
+            os_client.guarded(os_client.client.delete_pit, body={"pit_id": [pit_id]})
+        except os_client.OpenSearchUnavailable:
+            pass  # снимок сам истечёт через PIT_KEEP_ALIVE
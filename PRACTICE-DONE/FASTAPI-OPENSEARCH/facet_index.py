@@ -0,0 +1,89 @@
+import threading
+from bisect import bisect_right
+
+from sqlalchemy import select
+
+from config import PRICE_BUCKETS
+from database import SessionLocal, Product
+from opensearch_client import price_range_buckets
+
+# Столько же категорий, сколько по умолчанию возвращает terms-агрегация OpenSearch
+CATEGORY_FACET_SIZE = 10
+
+
+# Фасеты для запросов без текста: по каждой категории - гистограмма цен с границами PRICE_BUCKETS.
+# Ответ считается за O(категорий * бакетов), память не зависит от числа товаров в категории.
+# Гистограмма не делится на произвольные диапазоны, поэтому запросы с min_price/max_price
+# или своими price_buckets facets() не обслуживает (None) - их считает агрегация OpenSearch
+class FacetIndex:
+    def __init__(self, edges=PRICE_BUCKETS):
+        self.edges = tuple(edges)
+        self.histograms = {}  # category -> [число товаров в бакете]
+        self.docs = {}  # product_id -> (category, номер бакета), для обновления товара
+        self.ready = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, product):
+        # Бакет [low, high) как в range-агрегации: цена на границе попадает в верхний бакет
+        doc = (product.category, bisect_right(self.edges, product.price))
+        with self._lock:
+            old = self.docs.get(product.id)
+            if old == doc:
+                return
+            if old is not None:
+                histogram = self.histograms[old[0]]
+                histogram[old[1]] -= 1
+                if not any(histogram):
+                    del self.histograms[old[0]]
+            self.histograms.setdefault(doc[0], [0] * (len(self.edges) + 1))[doc[1]] += 1
+            self.docs[product.id] = doc
+
+    def facets(self, category=None, min_price=None, max_price=None,
+               facets=("categories", "price"), price_buckets=PRICE_BUCKETS):
+        # Тот же формат, что у агрегаций build_facets_body; None - запрос не считается по гистограмме
+        if not facets:
+            return {}
+        if min_price or max_price or ("price" in facets and tuple(price_buckets) != self.edges):
+            return None
+        with self._lock:
+            selected = [
+                (name, histogram) for name, histogram in self.histograms.items()
+                if not category or name == category
+            ]
+            aggregations = {}
+            if "categories" in facets:
+                top = sorted(((name, sum(histogram)) for name, histogram in selected), key=lambda c: (-c[1], c[0]))
+                aggregations["categories"] = {"buckets": [
+                    {"key": key, "doc_count": count} for key, count in top[:CATEGORY_FACET_SIZE]
+                ]}
+            if "price" in facets:
+                totals = [0] * (len(self.edges) + 1)
+                for _, histogram in selected:
+                    totals = [total + count for total, count in zip(totals, histogram)]
+                aggregations["price_ranges"] = price_range_buckets(
+                    self.edges, lambda low, high: totals[0 if low is None else bisect_right(self.edges, low)]
+                )
+        return aggregations
+
+    def build(self, chunk_size=1000):
+        db = SessionLocal()
+        try:
+            stmt = select(Product.id, Product.category, Product.price).execution_options(yield_per=chunk_size)
+            for chunk in db.execute(stmt).partitions():
+                for row in chunk:
+                    self.add(row)
+        finally:
+            db.close()
+        self.ready = True
+
+
+index = FacetIndex()
+
+
+def start_build():
+    thread = threading.Thread(target=index.build, daemon=True)
+    thread.start()
+    return thread
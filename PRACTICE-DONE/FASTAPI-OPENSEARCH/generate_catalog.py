@@ -0,0 +1,248 @@
+import argparse
+import io
+import itertools
+import os
+import random
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from sqlalchemy import text
+
+from database import Base, engine
+import opensearch_client as os_client
+
+DATASETS = {"xs": 10_000, "s": 100_000, "m": 1_000_000, "l": 10_000_000}
+DATASETS_DIR = "datasets"
+CHUNK_SIZE = 5000
+# Единица детерминированной генерации: набор для seed не зависит от --chunk-size
+BLOCK_SIZE = 1000
+CONCURRENCY = 4
+QUERIES = 2000
+# Корпус запросов строится по случайным блокам: распределения в блоках одинаковы
+QUERY_BLOCKS = 20
+# Показатель степени закона Ципфа: при s ~ 1 первая категория встречается вдвое чаще второй
+ZIPF_S = 1.1
+
+GeneratedProduct = namedtuple("GeneratedProduct", "id name description price category popularity")
+
+# Категория -> (виды товаров, бренды, медиана цены, разброс цены)
+CATEGORIES = {
+    "Смартфоны": (["Смартфон"], ["Samsung", "Apple", "Xiaomi", "HONOR", "realme", "Google", "OnePlus"], 30000, 0.7),
+    "Аксессуары": (["Чехол", "Кабель", "Зарядное устройство", "Клавиатура", "Мышь", "Power bank"],
+                   ["Logitech", "Baseus", "Anker", "Ugreen", "Xiaomi", "Defender"], 2000, 0.9),
+    "Наушники": (["Наушники", "Гарнитура"], ["Sony", "JBL", "Apple", "Sennheiser", "Marshall", "Huawei"], 8000, 0.9),
+    "Ноутбуки": (["Ноутбук", "Ультрабук"], ["ASUS", "Lenovo", "Apple", "HP", "Acer", "MSI", "Huawei"], 80000, 0.5),
+    "Бытовая техника": (["Пылесос", "Чайник", "Микроволновая печь", "Кофемашина", "Утюг"],
+                        ["Bosch", "Philips", "Redmond", "Tefal", "Dyson", "Polaris"], 9000, 0.8),
+    "Умный дом": (["Умная колонка", "Робот-пылесос", "Умная лампа", "Датчик движения"],
+                  ["Яндекс", "Xiaomi", "Aqara", "Sber", "TP-Link"], 6000, 0.9),
+    "Планшеты": (["Планшет"], ["Apple", "Samsung", "Lenovo", "Xiaomi", "HUAWEI"], 35000, 0.6),
+    "Мониторы": (["Монитор"], ["LG", "Samsung", "Dell", "AOC", "Philips", "ASUS"], 25000, 0.6),
+    "Умные часы": (["Умные часы", "Фитнес-браслет"], ["Apple", "Samsung", "Garmin", "Amazfit", "Huawei"], 12000, 0.8),
+    "Телевизоры": (["Телевизор"], ["Samsung", "LG", "Sony", "TCL", "Hisense", "Haier"], 45000, 0.6),
+    "Фото и видео": (["Фотоаппарат", "Экшн-камера", "Объектив"], ["Canon", "Nikon", "Sony", "GoPro", "Fujifilm"],
+                     60000, 0.7),
+    "Игры": (["Игровая консоль", "Геймпад", "Игровое кресло"], ["Sony", "Microsoft", "Nintendo", "Valve"], 20000, 0.9),
+}
+SERIES = ["Pro", "Max", "Lite", "Ultra", "Air", "Plus", "Mini", "Neo", "S", "X", "Note", "Edge", "Go", "Prime"]
+DESCRIPTION_WORDS = (
+    "беспроводной, быстрый, компактный, лёгкий, мощный, тихий, надёжный, игровой, профессиональный, "
+    "экран, дисплей, батарея, аккумулятор, быстрая зарядка, камера, память, процессор, корпус, звук, "
+    "шумоподавление, Bluetooth, Wi-Fi, USB-C, AMOLED, OLED, 4K, HDR, NFC, GPS, Android, iOS, Windows, "
+    "для дома, для офиса, для путешествий, для спорта, с подсветкой, с гарантией, "
+    "алюминиевый, водонепроницаемый, энергоэффективный, эргономичный, стильный, новинка, хит продаж"
+).split(", ")
+
+
+def zipf_weights(n, s=ZIPF_S):
+    return list(itertools.accumulate(1 / rank ** s for rank in range(1, n + 1)))
+
+
+CATEGORY_NAMES = list(CATEGORIES)
+CATEGORY_WEIGHTS = zipf_weights(len(CATEGORY_NAMES))
+BRAND_WEIGHTS = {category: zipf_weights(len(brands)) for category, (_, brands, _, _) in CATEGORIES.items()}
+TYPE_WEIGHTS = {category: zipf_weights(len(kinds)) for category, (kinds, _, _, _) in CATEGORIES.items()}
+WORD_WEIGHTS = zipf_weights(len(DESCRIPTION_WORDS))
+POPULARITY_WEIGHTS = zipf_weights(100)
+
+
+def generate_block(seed, block):
+    # Свой генератор на каждый блок: результат не зависит от порядка и параллельности обработки
+    rng = random.Random(f"{seed}:{block}")
+    products = []
+    first_id = block * BLOCK_SIZE + 1
+    for product_id in range(first_id, first_id + BLOCK_SIZE):
+        category = rng.choices(CATEGORY_NAMES, cum_weights=CATEGORY_WEIGHTS)[0]
+        kinds, brands, median_price, spread = CATEGORIES[category]
+        kind = rng.choices(kinds, cum_weights=TYPE_WEIGHTS[category])[0]
+        brand = rng.choices(brands, cum_weights=BRAND_WEIGHTS[category])[0]
+        model = f"{rng.choice(SERIES)} {rng.randint(1, 99)}" if rng.random() < 0.7 else str(rng.randint(100, 9999))
+        words = rng.choices(DESCRIPTION_WORDS, cum_weights=WORD_WEIGHTS, k=rng.randint(6, 18))
+        # Цены вида 12990: логнормальное распределение вокруг медианы категории
+        price = max(99, round(rng.lognormvariate(0, spread) * median_price, -2) - 10)
+        products.append(GeneratedProduct(
+            id=product_id,
+            name=f"{kind} {brand} {model}",
+            description=" ".join(words).capitalize(),
+            price=float(price),
+            category=category,
+            # Большинство товаров почти не покупают, единицы - хиты
+            popularity=rng.choices(range(1, 101), cum_weights=POPULARITY_WEIGHTS)[0]
+        ))
+    return products
+
+
+def generate_products(seed, first_id, count):
+    # Товары с эталонными id first_id .. first_id + count - 1
+    products = []
+    for block in range((first_id - 1) // BLOCK_SIZE, (first_id + count - 2) // BLOCK_SIZE + 1):
+        products += generate_block(seed, block)
+    offset = (first_id - 1) % BLOCK_SIZE
+    return products[offset:offset + count]
+
+
+def add_typo(word, rng):
+    if len(word) < 4:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    kind = rng.randrange(4)
+    if kind == 0:
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]  # перестановка соседних
+    if kind == 1:
+        return word[:i] + word[i + 1:]  # пропуск
+    if kind == 2:
+        return word[:i] + word[i] + word[i:]  # удвоение
+    return word[:i] + rng.choice("аеиоуыэяюrtyuio") + word[i + 1:]  # замена
+
+
+def generate_queries(seed, count, total, typo_rate):
+    # Корпус запросов из названий и слов описаний сгенерированных товаров.
+    # typo_rate - доля запросов с одной опечаткой (для /fuzzy-search)
+    rng = random.Random(f"{seed}:queries")
+    blocks = -(-total // BLOCK_SIZE)
+    sample = []
+    for block in rng.sample(range(blocks), min(QUERY_BLOCKS, blocks)):
+        sample += [p for p in generate_block(seed, block) if p.id <= total]
+    queries, typos = [], 0
+    for _ in range(count):
+        product = rng.choice(sample)
+        words = product.name.split()
+        query = " ".join(words[:rng.randint(1, len(words))])
+        if rng.random() < 0.3:
+            query = rng.choice(product.description.lower().split())
+        if rng.random() < typo_rate:
+            words = query.split()
+            i = rng.randrange(len(words))
+            typo = add_typo(words[i], rng)
+            if typo != words[i]:
+                words[i] = typo
+                typos += 1
+            query = " ".join(words)
+        queries.append(query)
+    return queries, typos
+
+
+def _tsv(value):
+    return str(value).replace("\\", "\\\\").replace("\t", " ").replace("\n", " ")
+
+
+def copy_chunk(products):
+    # COPY быстрее INSERT на порядок: одна команда, данные идут потоком без разбора SQL
+    data = io.StringIO("".join(
+        "\t".join(_tsv(getattr(p, field)) for field in GeneratedProduct._fields) + "\n" for p in products
+    ))
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.copy_expert(f"COPY products ({', '.join(GeneratedProduct._fields)}) FROM STDIN", data)
+        connection.commit()
+    finally:
+        connection.close()
+    return len(products)
+
+
+def load(dataset=None, count=None, seed=42, typo_rate=0.1, chunk_size=CHUNK_SIZE, concurrency=CONCURRENCY,
+         truncate=False, opensearch=True, verbose=True):
+    total = count or DATASETS[dataset]
+    name = dataset or f"n{total}"
+    log = print if verbose else lambda *args: None
+    start = time.time()
+
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        if truncate:
+            conn.execute(text("TRUNCATE products RESTART IDENTITY"))
+        first_id = conn.execute(text("SELECT coalesce(max(id), 0) FROM products")).scalar() + 1
+    if opensearch:
+        if truncate:
+            # Иначе в индексе остаются документы прошлого набора и бенчмарк идёт по смеси данных
+            os_client.drop_index()
+        os_client.create_index()
+    if first_id != 1:
+        # Без --truncate генерация продолжает id, но набор уже не совпадает с эталонным для seed
+        log(f"В таблице уже есть товары, генерация начнётся с id {first_id}")
+
+    stats = {"dataset": name, "seed": seed, "products": 0, "indexed": 0, "index_errors": 0}
+    with ThreadPoolExecutor(max_workers=concurrency * 2) as executor:
+        in_flight = set()
+
+        def collect(done):
+            for future in done:
+                kind, result = future.result()
+                if kind == "copy":
+                    stats["products"] += result
+                else:
+                    stats["indexed"] += result[0]
+                    stats["index_errors"] += len(result[1])
+
+        for number in range(-(-total // chunk_size)):
+            size = min(chunk_size, total - number * chunk_size)
+            # Эталонные id считаются от 1, фактические сдвигаются на first_id - 1
+            products = [p._replace(id=p.id + first_id - 1)
+                        for p in generate_products(seed, number * chunk_size + 1, size)]
+            if len(in_flight) >= concurrency * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            # Postgres и OpenSearch заливаются параллельно из одной сгенерированной пачки
+            in_flight.add(executor.submit(lambda p=products: ("copy", copy_chunk(p))))
+            if opensearch:
+                in_flight.add(executor.submit(lambda p=products: ("bulk", os_client.bulk_index_products(p))))
+            if verbose and (number + 1) % 20 == 0:
+                log(f"Сгенерировано {(number + 1) * chunk_size} из {total}")
+        collect(in_flight)
+
+    with engine.begin() as conn:
+        conn.execute(text("SELECT setval(pg_get_serial_sequence('products', 'id'), (SELECT max(id) FROM products))"))
+        conn.execute(text("ANALYZE products"))
+
+    queries, typos = generate_queries(seed, min(QUERIES, total), total, typo_rate)
+    directory = os.path.join(DATASETS_DIR, name)
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "queries.txt"), "w", encoding="utf-8") as f:
+        f.write(f"# dataset={name} products={total} seed={seed} typo_rate={typo_rate}\n")
+        f.write("\n".join(queries) + "\n")
+
+    stats.update({"queries": len(queries), "typos": typos, "time_s": round(time.time() - start, 2)})
+    log(f"Загружено товаров: {stats['products']}, в OpenSearch: {stats['indexed']} "
+        f"(ошибок {stats['index_errors']}) за {stats['time_s']}s")
+    log(f"Корпус запросов: {directory}/queries.txt ({len(queries)}, с опечатками {typos})")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Генерация синтетического каталога для нагрузочных тестов")
+    size = parser.add_mutually_exclusive_group(required=True)
+    size.add_argument("--dataset", choices=DATASETS, help=", ".join(f"{k}={v}" for k, v in DATASETS.items()))
+    size.add_argument("--count", type=int, help="произвольное число товаров")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--typo-rate", type=float, default=0.1, help="доля запросов корпуса с опечаткой")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--truncate", action="store_true", help="очистить таблицу products и пересоздать индекс OpenSearch перед загрузкой")
+    parser.add_argument("--no-opensearch", action="store_true",
+                        help="только Postgres; индекс потом строится через reindex.py --rebuild")
+    args = parser.parse_args()
+
+    load(args.dataset, args.count, args.seed, args.typo_rate, args.chunk_size, args.concurrency,
+         args.truncate, not args.no_opensearch)
@@ -0,0 +1,101 @@
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextvars import copy_context
+
+from sqlalchemy import text
+
+from config import HYBRID_DEADLINE, HYBRID_RRF_K
+from database import SessionLocal, search_row_to_hit, fulltext_query
+import opensearch_client as os_client
+
+HIT_FIELDS = ("id", "name", "description", "price", "category")
+# Дедлайн переносится в Postgres: опоздавший запрос прерывается сервером и освобождает поток и соединение
+STATEMENT_TIMEOUT_SQL = text("SELECT set_config('statement_timeout', :timeout, true)")
+
+# Пул на уровне модуля: опоздавший запрос дорабатывает в фоне и не держит обработчик.
+# Слотов столько же, сколько потоков: задача не встаёт в очередь пула, а при занятом пуле
+# движок сразу получает статус timeout, не дожидаясь дедлайна
+MAX_IN_FLIGHT = 16
+executor = ThreadPoolExecutor(max_workers=MAX_IN_FLIGHT, thread_name_prefix="hybrid")
+_slots = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+
+
+def fuse(rankings, limit, k=HYBRID_RRF_K):
+    # Reciprocal rank fusion: score = сумма 1 / (k + rank) по движкам, где товар найден.
+    # Баллы движков несравнимы (BM25 и ts_rank), поэтому учитываются только позиции
+    fused = {}
+    for engine, hits in rankings.items():
+        for rank, hit in enumerate(hits, start=1):
+            entry = fused.setdefault(hit["id"], {
+                **{field: hit.get(field) for field in HIT_FIELDS}, "score": 0.0, "ranks": {}
+            })
+            entry["score"] += 1 / (k + rank)
+            entry["ranks"][engine] = rank
+    hits = sorted(fused.values(), key=lambda hit: (-hit["score"], hit["id"]))[:limit]
+    for hit in hits:
+        hit["score"] = round(hit["score"], 6)
+    return hits
+
+
+def opensearch_hits(q, limit):
+    return os_client.format_hits(os_client.search_products(q, page_size=limit))["hits"]
+
+
+def statement_timeout(deadline):
+    # statement_timeout в миллисекундах; SET LOCAL-семантика (is_local=true) - до конца транзакции
+    return str(max(1, math.ceil(deadline * 1000)))
+
+
+def postgres_hits(q, limit, deadline=None):
+    # Ранжированный запрос /direct-search-orm: порядок строк - ранг ts_rank_cd, а не произвольный
+    db = SessionLocal()
+    try:
+        if deadline:
+            db.execute(STATEMENT_TIMEOUT_SQL, {"timeout": statement_timeout(deadline)})
+        return [search_row_to_hit(row) for row in db.execute(fulltext_query(q, limit))]
+    finally:
+        db.close()
+
+
+def _submit(call, *args):
+    if not _slots.acquire(blocking=False):
+        return None
+    # copy_context: фазы db/opensearch из потоков пула попадают в метрики этого запроса
+    future = executor.submit(copy_context().run, call, *args)
+    future.add_done_callback(lambda _: _slots.release())
+    return future
+
+
+def collect(outcomes, limit, start):
+    # outcomes: engine -> ("ok", hits) | (статус, None)
+    rankings = {engine: hits for engine, (status, hits) in outcomes.items() if status == "ok"}
+    return {
+        "hits": fuse(rankings, limit),
+        "engines": {engine: status for engine, (status, _) in outcomes.items()},
+        "partial": len(rankings) < len(outcomes),
+        "time_ms": round((time.perf_counter() - start) * 1000, 2)
+    }
+
+
+def search(q, limit, deadline=None):
+    start = time.perf_counter()
+    deadline = deadline or HYBRID_DEADLINE
+    futures = {
+        "opensearch": _submit(opensearch_hits, q, limit),
+        "postgres": _submit(postgres_hits, q, limit, deadline),
+    }
+    wait([future for future in futures.values() if future is not None], timeout=deadline)
+    outcomes = {}
+    for engine, future in futures.items():
+        if future is None:
+            outcomes[engine] = ("timeout", None)
+        elif not future.done():
+            future.cancel()
+            outcomes[engine] = ("timeout", None)
+        elif future.exception() is not None:
+            outcomes[engine] = ("error", None)
+        else:
+            outcomes[engine] = ("ok", future.result())
+    return collect(outcomes, limit, start)
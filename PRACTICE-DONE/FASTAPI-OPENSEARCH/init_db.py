@@ -1,16 +1,15 @@
 from database import Base, engine, SessionLocal, Product
 import opensearch_client as os_client
+from reindex import reindex
 
 def init():
     Base.metadata.create_all(bind=engine)
-    os_client.create_index()
+    missing = os_client.create_index()
+    if missing:
+        print(f"Маппинг индекса устарел (нет полей: {', '.join(missing)}): выполните python reindex.py --rebuild")
     
     db = SessionLocal()
     
-    # Индексируем все товары в OpenSearch
-    for product in db.query(Product).all():
-        os_client.index_product(product)
-    
     if db.query(Product).count() == 0:
         products = [
             Product(name="iPhone 15 Pro", description="Смартфон Apple с чипом A17 Pro, 256 ГБ", price=119990, category="Смартфоны", popularity=100),
@@ -40,13 +39,13 @@ def init():
             Product(name="Картина", description="Горе от ума", price=1000, category="Test", popularity=20),
         ]
         
-        for product in products:
-            db.add(product)
-            db.commit()
-            db.refresh(product)
-            os_client.index_product(product)
+        db.add_all(products)
+        db.commit()
     
     db.close()
+    
+    # Индексируем все товары в OpenSearch потоково, пачками через bulk API
+    reindex()
     print("База данных инициализирована!")
 
 if __name__ == "__main__":
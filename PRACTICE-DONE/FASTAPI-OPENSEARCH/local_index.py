@@ -0,0 +1,185 @@
+import math
+import re
+import threading
+from array import array
+
+from sqlalchemy import select
+
+from config import DEFAULT_PAGE_SIZE, PRICE_BUCKETS
+from database import SessionLocal, Product
+from opensearch_client import SOURCE_FIELDS, price_range_buckets
+
+TOKEN_RE = re.compile(r"\w+")
+# Те же веса полей, что и в multi_match: name^3, description
+FIELD_BOOSTS = (3.0, 1.0)
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower()) if text else []
+
+
+def _term_counts(tokens):
+    counts = {}
+    for token in tokens:
+        counts[token] = counts.get(token, 0) + 1
+    return counts
+
+
+# Инвертированный индекс по name/description в памяти процесса - резерв на время
+# недоступности OpenSearch. Постинги хранятся в array: id товара (uint32) и tf (uint16)
+class LocalIndex:
+    def __init__(self):
+        self.postings = ({}, {})  # по полю: term -> (array ids, array tfs)
+        self.lengths = {}  # product_id -> (длина name, длина description)
+        self.total_lengths = [0, 0]
+        self.docs = {}  # product_id -> (name, description, price, category, popularity)
+        self.ready = False
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.docs)
+
+    def _unindex(self, product_id):
+        name, description = self.docs[product_id][:2]
+        for field, text in enumerate((name, description)):
+            for term in set(tokenize(text)):
+                ids, tfs = self.postings[field][term]
+                position = ids.index(product_id)
+                del ids[position]
+                del tfs[position]
+                if not ids:
+                    del self.postings[field][term]
+            self.total_lengths[field] -= self.lengths[product_id][field]
+
+    def add(self, product):
+        doc = (product.name, product.description or "", product.price, product.category, product.popularity or 0)
+        with self._lock:
+            if self.docs.get(product.id) == doc:
+                return
+            if product.id in self.docs:
+                self._unindex(product.id)
+            lengths = []
+            for field, text in enumerate(doc[:2]):
+                tokens = tokenize(text)
+                for term, tf in _term_counts(tokens).items():
+                    ids, tfs = self.postings[field].setdefault(term, (array("I"), array("H")))
+                    ids.append(product.id)
+                    tfs.append(min(tf, 65535))
+                lengths.append(len(tokens))
+                self.total_lengths[field] += len(tokens)
+            self.lengths[product.id] = tuple(lengths)
+            self.docs[product.id] = doc
+
+    def _score(self, terms):
+        n = len(self.docs)
+        field_scores = ({}, {})
+        for field in (0, 1):
+            avg_length = self.total_lengths[field] / n if n else 0
+            for term in terms:
+                posting = self.postings[field].get(term)
+                if posting is None:
+                    continue
+                ids, tfs = posting
+                idf = math.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5))
+                scores = field_scores[field]
+                for product_id, tf in zip(ids, tfs):
+                    length = self.lengths[product_id][field]
+                    norm = 1 - B + B * length / avg_length if avg_length else 1
+                    scores[product_id] = scores.get(product_id, 0.0) + idf * tf * (K1 + 1) / (tf + K1 * norm)
+        # best_fields: балл документа - лучшее из полей с учётом буста
+        result = {}
+        for field, scores in enumerate(field_scores):
+            for product_id, score in scores.items():
+                result[product_id] = max(result.get(product_id, 0.0), score * FIELD_BOOSTS[field])
+        return result
+
+    def _matches(self, query, category, min_price, max_price):
+        terms = tokenize(query)
+        scored = self._score(terms) if terms else dict.fromkeys(self.docs, 1.0)
+        matches = []
+        for product_id, score in scored.items():
+            _, _, price, doc_category, _ = self.docs[product_id]
+            if category and doc_category != category:
+                continue
+            if min_price and price < min_price:
+                continue
+            if max_price and price > max_price:
+                continue
+            matches.append((score, product_id))
+        return matches
+
+    def _hit(self, score, product_id, fields):
+        # docs хранит поля в порядке SOURCE_FIELDS без id
+        source = dict(zip(SOURCE_FIELDS, (product_id, *self.docs[product_id])))
+        return {
+            "_id": str(product_id),
+            "_score": score,
+            "_source": {field: source[field] for field in fields},
+            "sort": [score, product_id]
+        }
+
+    def search(self, query, category=None, min_price=None, max_price=None,
+               page_size=DEFAULT_PAGE_SIZE, search_after=None, fields=SOURCE_FIELDS):
+        # Ответ в формате OpenSearch, чтобы работали те же format_search и курсоры
+        with self._lock:
+            matches = self._matches(query, category, min_price, max_price)
+            matches.sort(key=lambda m: (-m[0], m[1]))
+            if search_after:
+                after_score, after_id = search_after
+                matches = [m for m in matches if (-m[0], m[1]) > (-after_score, after_id)]
+            hits = [self._hit(score, product_id, fields) for score, product_id in matches[:page_size]]
+            return {"hits": {"hits": hits, "total": {"value": len(matches)}}}
+
+    def search_batch(self, specs):
+        # Ответ в формате _msearch
+        return {"responses": [
+            self.search(spec["q"], spec["category"], spec["min_price"], spec["max_price"], spec["page_size"],
+                        fields=spec["fields"])
+            for spec in specs
+        ]}
+
+    def facets(self, query, category=None, min_price=None, max_price=None,
+               facets=("categories", "price"), price_buckets=PRICE_BUCKETS):
+        if not facets:
+            return {}
+        with self._lock:
+            matches = self._matches(query, category, min_price, max_price)
+            categories = {}
+            prices = []
+            for _, product_id in matches:
+                _, _, price, doc_category, _ = self.docs[product_id]
+                categories[doc_category] = categories.get(doc_category, 0) + 1
+                prices.append(price)
+        aggregations = {}
+        if "categories" in facets:
+            top = sorted(categories.items(), key=lambda c: (-c[1], c[0]))[:10]
+            aggregations["categories"] = {"buckets": [{"key": key, "doc_count": count} for key, count in top]}
+        if "price" in facets:
+            aggregations["price_ranges"] = price_range_buckets(price_buckets, lambda low, high: sum(
+                1 for price in prices if (low is None or price >= low) and (high is None or price < high)
+            ))
+        return aggregations
+
+    def build(self, chunk_size=1000):
+        db = SessionLocal()
+        try:
+            stmt = select(
+                Product.id, Product.name, Product.description, Product.price, Product.category, Product.popularity
+            ).execution_options(yield_per=chunk_size)
+            for chunk in db.execute(stmt).partitions():
+                for row in chunk:
+                    self.add(row)
+        finally:
+            db.close()
+        self.ready = True
+
+
+index = LocalIndex()
+
+
+def start_build():
+    thread = threading.Thread(target=index.build, daemon=True)
+    thread.start()
+    return thread
@@ -1,19 +1,94 @@
-from fastapi import FastAPI, Depends, HTTPException
+import logging
+import time
+from contextlib import asynccontextmanager, AsyncExitStack
+from fastapi import FastAPI, Depends, HTTPException, Query
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import text
-from database import get_db, Product
-from schemas import ProductCreate, ProductResponse
+from sqlalchemy.exc import SQLAlchemyError
+from database import engine, get_db, Product, SearchOutbox, search_row_to_hit, fulltext_query, has_search_index, SEARCH_VECTOR_INDEX
+from schemas import ProductCreate, ProductResponse, SearchBatch
+from config import (
+    SEARCH_MODE, OUTBOX_WORKER_ENABLED, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, SUGGEST_BACKEND, LOCAL_INDEX_ENABLED,
+    SPELLING_ENABLED, EXPORT_MAX_ROWS, FACET_INDEX_ENABLED
+)
 import opensearch_client as os_client
+import async_search
+import export
+import facet_index
+import hybrid
+import local_index
+import metrics
+import outbox_worker
+import prefix_index
+import search_cache
+import spelling
 
-app = FastAPI(title="Product Search API")
+logger = logging.getLogger(__name__)
+
+def check_search_index():
+    # Без GIN-индекса /direct-search-orm работает, но каждый запрос - полный проход по таблице
+    try:
+        if not has_search_index():
+            logger.warning("Индекс %s не найден: выполните migrations/001_products_search_vector.sql", SEARCH_VECTOR_INDEX)
+    except SQLAlchemyError as e:
+        logger.warning("Не удалось проверить индекс %s: %s", SEARCH_VECTOR_INDEX, e)
+
+def check_search_mapping():
+    # Индекс старой схемы (без suggest/content_hash) отвечает 4xx - предупреждаем при старте
+    try:
+        missing = os_client.check_mapping()
+        if missing:
+            logger.warning("В маппинге индекса %s нет полей %s: выполните python reindex.py --rebuild",
+                           os_client.INDEX_NAME, ", ".join(missing))
+    except Exception as e:
+        logger.warning("Не удалось проверить маппинг индекса %s: %s", os_client.INDEX_NAME, e)
+
+@asynccontextmanager
+async def lifespan(app):
+    check_search_index()
+    check_search_mapping()
+    async with AsyncExitStack() as stack:
+        if SEARCH_MODE == "async":
+            await stack.enter_async_context(async_search.lifespan(app))
+        if OUTBOX_WORKER_ENABLED:
+            stack.callback(outbox_worker.start())
+        if SUGGEST_BACKEND == "trie":
+            prefix_index.start_build()
+        if LOCAL_INDEX_ENABLED:
+            local_index.start_build()
+        if SPELLING_ENABLED:
+            spelling.start_build()
+        if FACET_INDEX_ENABLED:
+            facet_index.start_build()
+        yield
+
+app = FastAPI(title="Product Search API", lifespan=lifespan, default_response_class=ORJSONResponse)
+metrics.install(app)
+metrics.instrument_engine(engine)
+
+@app.exception_handler(os_client.OpenSearchRequestError)
+def opensearch_request_error(request, exc):
+    # 4xx OpenSearch: при устаревшем маппинге - 409 с подсказкой, иначе 400 вместо необработанной 500
+    if os_client.stale_mapping_fields:
+        detail = (f"Search index mapping is out of date (missing: {', '.join(os_client.stale_mapping_fields)}), "
+                  "reindex required")
+        return ORJSONResponse({"detail": detail}, status_code=409)
+    return ORJSONResponse({"detail": f"OpenSearch rejected the request: {exc.error}"}, status_code=400)
+
+if SEARCH_MODE == "async":
+    # Маршруты роутера регистрируются раньше sync-обработчиков ниже и перекрывают их
+    app.include_router(async_search.router)
 
 @app.post("/products", response_model=ProductResponse)
 def create_product(product: ProductCreate, db: Session = Depends(get_db)):
     db_product = Product(**product.model_dump())
     db.add(db_product)
+    db.flush()
+    # Индексацию выполнит outbox_worker; запись в outbox коммитится вместе с товаром
+    db.add(SearchOutbox(product_id=db_product.id))
     db.commit()
     db.refresh(db_product)
-    os_client.index_product(db_product)
     return db_product
 
 @app.get("/products/{product_id}", response_model=ProductResponse)
@@ -23,73 +98,207 @@ def get_product(product_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Product not found")
     return product
 
+def _timed(call, *args, **kwargs):
+    start = time.perf_counter()
+    result = call(*args, **kwargs)
+    return result, round((time.perf_counter() - start) * 1000, 2)
+
+def search_facets(q, category, min_price, max_price, facet_names, buckets):
+    # Без текстового запроса фасеты зависят только от фильтров - считаем в памяти, без агрегации
+    if not q and facet_index.index.ready:
+        aggregations = facet_index.index.facets(category, min_price, max_price, facet_names, buckets)
+        if aggregations is not None:
+            return aggregations
+    return os_client.search_facets(q, category, min_price, max_price, facet_names, buckets)
+
+def require_local_index():
+    if not local_index.index.ready:
+        raise HTTPException(status_code=503, detail="OpenSearch unavailable")
+
 @app.get("/search")
 def search(
     q: str | None = None,
     category: str | None = None,
     min_price: float | None = None,
-    max_price: float | None = None
+    max_price: float | None = None,
+    cursor: str | None = None,
+    page_size: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    pit: bool = False,
+    facets: str | None = None,
+    price_buckets: str | None = None,
+    fields: str | None = None
 ):
-    results = os_client.search_products(q, category, min_price, max_price)
+    try:
+        facet_names = os_client.parse_facets(facets)
+        buckets = os_client.parse_price_buckets(price_buckets)
+        source_fields = os_client.parse_fields(fields)
+        try:
+            results, hits_ms = _timed(
+                os_client.search_products, q, category, min_price, max_price,
+                cursor=cursor, page_size=page_size, use_pit=pit, fields=source_fields
+            )
+            aggregations, aggs_ms = _timed(
+                search_facets, q, category, min_price, max_price, facet_names, buckets
+            )
+            engine = "opensearch"
+        except os_client.OpenSearchUnavailable:
+            require_local_index()
+            search_after = os_client.decode_cursor(cursor)["sa"] if cursor else None
+            results, hits_ms = _timed(
+                local_index.index.search, q, category, min_price, max_price, page_size, search_after, source_fields
+            )
+            aggregations, aggs_ms = _timed(
+                local_index.index.facets, q, category, min_price, max_price, facet_names, buckets
+            )
+            engine = "local"
+    except os_client.InvalidSearchParameter as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    data = os_client.format_search(results, page_size, aggregations)
+    data["timings"] = {"hits_ms": hits_ms, "aggs_ms": aggs_ms}
+    return os_client.json_response(data, engine)
+
+def parse_batch(batch):
+    try:
+        return [{**spec.model_dump(), "fields": os_client.parse_fields(spec.fields)} for spec in batch.searches]
+    except os_client.InvalidSearchParameter as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/search/batch")
+def search_batch(batch: SearchBatch):
+    specs = parse_batch(batch)
+    start = time.perf_counter()
+    try:
+        results = os_client.search_batch(specs)
+        engine = "opensearch"
+    except os_client.OpenSearchUnavailable:
+        require_local_index()
+        results = local_index.index.search_batch(specs)
+        engine = "local"
+    return os_client.json_response({
+        "results": os_client.format_msearch(results, specs),
+        "time_ms": round((time.perf_counter() - start) * 1000, 2)
+    }, engine)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    engines = {"sync": engine}
+    if hasattr(app.state, "async_engine"):
+        engines["async"] = app.state.async_engine
+    return PlainTextResponse(
+        metrics.expose(engines, None if SEARCH_MODE == "async" else os_client.client),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+@app.get("/search/export")
+def search_export(
+    q: str | None = None,
+    category: str | None = None,
+    min_price: float | None = None,
+    max_price: float | None = None,
+    fields: str | None = None,
+    limit: int = Query(EXPORT_MAX_ROWS, ge=1, le=EXPORT_MAX_ROWS)
+):
+    try:
+        source_fields = os_client.parse_fields(fields)
+        pit_id = export.open_pit()
+    except os_client.InvalidSearchParameter as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except os_client.OpenSearchUnavailable:
+        raise HTTPException(status_code=503, detail="OpenSearch unavailable")
+    rows = export.opensearch_rows(pit_id, q, category, min_price, max_price, source_fields, limit)
+    return StreamingResponse(rows, media_type=export.MEDIA_TYPE, headers={"X-Search-Engine": "opensearch"})
+
+@app.get("/search/cache-stats")
+def search_cache_stats():
+    return {"results": search_cache.results.stats(), "facets": search_cache.facets.stats()}
+
+@app.get("/search/health")
+def search_health():
     return {
-        "hits": [hit["_source"] for hit in results["hits"]["hits"]],
-        "total": results["hits"]["total"]["value"],
-        "aggregations": results.get("aggregations", {})
+        "opensearch": os_client.breaker.state,
+        "local_index": {"ready": local_index.index.ready, "documents": len(local_index.index)}
     }
 
 @app.get("/search-simple")
-def search_simple(q: str):
+def search_simple(q: str, fields: str | None = None):
     try:
-        results = os_client.search_products(q, None, None, None)
-        return {"hits": [hit["_source"] for hit in results["hits"]["hits"]]}
-    except:
-        raise HTTPException(status_code=503, detail="OpenSearch unavailable")
+        source_fields = os_client.parse_fields(fields)
+    except os_client.InvalidSearchParameter as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        results = os_client.search_products(q, None, None, None, fields=source_fields)
+        engine = "opensearch"
+    except os_client.OpenSearchUnavailable:
+        require_local_index()
+        results = local_index.index.search(q, fields=source_fields)
+        engine = "local"
+    return os_client.json_response(os_client.format_hits(results), engine)
 
 @app.get("/direct-search")
 def direct_search(q: str, db: Session = Depends(get_db)):
-    import time
-    start = time.time()
+    # Время SQL попадает в фазу db через хуки движка (metrics.instrument_engine)
     rows = db.execute(text("SELECT * FROM search_products(:query)"), {"query": q})
-    hits = []
-    for row in rows:
-        hits.append({
-            "id": row[0],
-            "name": row[1],
-            "description": row[2],
-            "price": row[3],
-            "category": row[4]
-        })
-    elapsed = time.time() - start
-    return {"hits": hits, "time_ms": round(elapsed * 1000, 2), "count": len(hits)}
+    with metrics.phase("serialization"):
+        hits = [search_row_to_hit(row) for row in rows]
+    return {"hits": hits, "time_ms": metrics.elapsed_ms("db", "serialization"), "count": len(hits)}
 
 @app.get("/direct-search-orm")
-def direct_search_orm(q: str, db: Session = Depends(get_db)):
-    import time
-    from sqlalchemy import func
-    start = time.time()
-    products = db.query(Product).filter(
-        func.to_tsvector(Product.name + ' ' + Product.description).op('@@')(func.to_tsquery(q))
-    ).all()
-    hits = []
-    for p in products:
-        hits.append({
-            "id": p.id,
-            "name": p.name,
-            "description": p.description,
-            "price": p.price,
-            "category": p.category
-        })
-    elapsed = time.time() - start
-    return {"hits": hits, "time_ms": round(elapsed * 1000, 2), "count": len(hits)}
+def direct_search_orm(
+    q: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db)
+):
+    rows = db.execute(fulltext_query(q, limit))
+    with metrics.phase("serialization"):
+        hits = [search_row_to_hit(row) for row in rows]
+    return {"hits": hits, "time_ms": metrics.elapsed_ms("db", "serialization"), "count": len(hits)}
     
 
+@app.get("/direct-search/export")
+def direct_search_export(q: str, limit: int = Query(EXPORT_MAX_ROWS, ge=1, le=EXPORT_MAX_ROWS)):
+    # NDJSON через серверный курсор: память не растёт с размером выдачи, первая строка уходит сразу
+    return StreamingResponse(export.postgres_rows(q, limit), media_type=export.MEDIA_TYPE,
+                             headers={"X-Search-Engine": "postgres"})
+
+@app.get("/hybrid-search")
+def hybrid_search(q: str, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)):
+    result = hybrid.search(q, limit)
+    if not any(status == "ok" for status in result["engines"].values()):
+        raise HTTPException(status_code=503, detail=result["engines"])
+    return result
+
 @app.get("/suggest")
 def suggest(q: str):
-    results = os_client.suggest_products(q)
-    suggestions = [hit["_source"]["name"] for hit in results["hits"]["hits"]]
-    return {"suggestions": suggestions}
+    if SUGGEST_BACKEND == "trie" and prefix_index.index.ready:
+        return os_client.json_response({"suggestions": prefix_index.index.suggest(q)}, "trie")
+    try:
+        results = os_client.suggest_products(q)
+    except os_client.OpenSearchUnavailable:
+        if not prefix_index.index.ready:
+            raise HTTPException(status_code=503, detail="OpenSearch unavailable")
+        return os_client.json_response({"suggestions": prefix_index.index.suggest(q)}, "trie")
+    return os_client.json_response(os_client.format_suggestions(results), "opensearch")
 
 @app.get("/fuzzy-search")
-def fuzzy_search_endpoint(q: str):
-    results = os_client.fuzzy_search(q)
-    return {"hits": [hit["_source"] for hit in results["hits"]["hits"]]}
+def fuzzy_search_endpoint(q: str, fields: str | None = None):
+    try:
+        source_fields = os_client.parse_fields(fields)
+    except os_client.InvalidSearchParameter as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    corrected, confident = spelling.correct_query(q)
+    try:
+        fuzzy = not confident
+        if confident:
+            # Запрос исправлен по словарю - достаточно точного multi_match без раскрытия вариантов
+            results = os_client.fuzzy_search(corrected, source_fields, fuzziness=None)
+            fuzzy = not results["hits"]["hits"]
+        if fuzzy:
+            results = os_client.fuzzy_search(q, source_fields)
+        engine = "opensearch"
+    except os_client.OpenSearchUnavailable:
+        # Резервный индекс ищет без опечаток - лучше точная выдача, чем 503
+        require_local_index()
+        results = local_index.index.search(corrected, fields=source_fields)
+        fuzzy = False
+        engine = "local"
+    return os_client.json_response(os_client.format_fuzzy(results, q, corrected, fuzzy), engine)
@@ -0,0 +1,167 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+# Фазы текущего запроса: phase -> секунды. Словарь создаёт middleware; хуки только дописывают в него,
+# поэтому время из threadpool (sync-обработчики) и из дочерних задач asyncio попадает в тот же запрос
+_phases = ContextVar("phases", default=None)
+
+PHASES = ("db", "opensearch", "serialization")
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def add(name, seconds):
+    phases = _phases.get()
+    if phases is not None:
+        phases[name] = phases.get(name, 0.0) + seconds
+
+
+def elapsed_ms(*names):
+    # Время фаз текущего запроса в мс - те же значения, что уйдут в Server-Timing
+    phases = _phases.get() or {}
+    return round(sum(phases.get(name, 0.0) for name in names) * 1000, 2)
+
+
+@contextmanager
+def phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(name, time.perf_counter() - start)
+
+
+class Histogram:
+    # Гистограмма в формате Prometheus: накопительные бакеты, _sum и _count по набору меток
+    def __init__(self, name, help, labels, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # значения меток -> [счётчики бакетов..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.setdefault(labels, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for labels, values in sorted(series.items()):
+            label_text = ",".join(f'{key}="{value}"' for key, value in zip(self.labels, labels))
+            for bound, count in zip(self.buckets, values):
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {values[-1]}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {values[-2]:.6f}")
+            lines.append(f"{self.name}_count{{{label_text}}} {values[-1]}")
+        return lines
+
+
+request_duration = Histogram(
+    "search_request_duration_seconds", "Полное время обработки запроса", ("endpoint", "backend")
+)
+phase_duration = Histogram(
+    "search_phase_duration_seconds", "Время запроса по фазам", ("endpoint", "backend", "phase")
+)
+
+
+def instrument_engine(engine):
+    # Время SQL-запросов в фазу db; для AsyncEngine события вешаются на его sync_engine
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        add("db", time.perf_counter() - conn.info["query_start"].pop())
+
+
+def install(app):
+    @app.middleware("http")
+    async def server_timing(request, call_next):
+        phases = {}
+        token = _phases.set(phases)
+        start = time.perf_counter()
+        try:
+            response = await call_next(request)
+        finally:
+            _phases.reset(token)
+        total = time.perf_counter() - start
+        route = request.scope.get("route")
+        endpoint = route.path if route is not None else "unmatched"
+        backend = response.headers.get("X-Search-Engine", "none")
+        request_duration.observe(total, endpoint, backend)
+        for name in PHASES:
+            if name in phases:
+                phase_duration.observe(phases[name], endpoint, backend, name)
+        response.headers["Server-Timing"] = ", ".join(
+            [f"{name};dur={phases[name] * 1000:.2f}" for name in PHASES if name in phases]
+            + [f"total;dur={total * 1000:.2f}"]
+        )
+        return response
+
+
+def _gauge(lines, name, help, samples, kind="gauge"):
+    lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        label_text = ",".join(f'{key}="{value}"' for key, value in labels.items())
+        lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+
+def pool_stats(engines, opensearch_client):
+    # engines: имя -> Engine/AsyncEngine. Пул SQLAlchemy (QueuePool) и пулы urllib3 sync-транспорта OpenSearch;
+    # opensearch_client=None - пулы OpenSearch не описываются (в async-режиме sync-клиент не используется)
+    stats = {"sqlalchemy": {}, "opensearch": {}}
+    for name, engine in engines.items():
+        pool = getattr(engine, "sync_engine", engine).pool
+        if hasattr(pool, "checkedout"):
+            stats["sqlalchemy"][name] = {
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                "overflow": pool.overflow()
+            }
+    if opensearch_client is None:
+        return stats
+    connection_pool = opensearch_client.transport.connection_pool
+    connections = getattr(connection_pool, "connections", None) or [connection_pool.connection]
+    for connection in connections:
+        pool = getattr(connection, "pool", None)
+        if pool is None:
+            continue
+        stats["opensearch"][connection.host] = {
+            "in_use": pool.pool.maxsize - pool.pool.qsize() if pool.pool is not None else 0,
+            "max_size": pool.pool.maxsize if pool.pool is not None else 0,
+            "connections_created": pool.num_connections,
+            "requests": pool.num_requests
+        }
+    return stats
+
+
+def expose(engines, opensearch_client):
+    lines = request_duration.expose() + phase_duration.expose()
+    stats = pool_stats(engines, opensearch_client)
+    for key in ("size", "checked_out", "checked_in", "overflow"):
+        _gauge(lines, f"sqlalchemy_pool_{key}", f"QueuePool: {key}",
+               [({"engine": name}, values[key]) for name, values in stats["sqlalchemy"].items()])
+    if stats["opensearch"]:
+        for key in ("in_use", "max_size"):
+            _gauge(lines, f"opensearch_pool_{key}", f"urllib3 пул транспорта OpenSearch: {key}",
+                   [({"host": host}, values[key]) for host, values in stats["opensearch"].items()])
+        # Накопительные значения - counter с суффиксом _total, чтобы работали rate()/increase()
+        for key in ("connections_created", "requests"):
+            _gauge(lines, f"opensearch_pool_{key}_total", f"urllib3 пул транспорта OpenSearch: {key}",
+                   [({"host": host}, values[key]) for host, values in stats["opensearch"].items()], "counter")
+    return "\n".join(lines) + "\n"
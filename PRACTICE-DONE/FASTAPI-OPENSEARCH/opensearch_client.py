@@ -1,14 +1,120 @@
+import base64
+import json
+import threading
+import time
+
+from fastapi.responses import ORJSONResponse
 from opensearchpy import OpenSearch
+from opensearchpy.exceptions import TransportError
+from config import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, PIT_KEEP_ALIVE, PRICE_BUCKETS, SUGGEST_SIZE,
+    OPENSEARCH_TIMEOUT, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT
+)
+from database import content_hash
+from prefix_index import suggest_inputs
+import metrics
+import search_cache
+
+OPENSEARCH_HOSTS = [{'host': 'localhost', 'port': 9200}]
 
 client = OpenSearch(
-    hosts=[{'host': 'localhost', 'port': 9200}],
+    hosts=OPENSEARCH_HOSTS,
     http_auth=None,
     use_ssl=False,
     verify_certs=False
 )
 
+# Алиас для чтения и записи. Данные лежат в версионных индексах products_v1, products_v2, ...:
+# новая версия строится рядом со старой и подменяет её атомарным переключением алиаса
 INDEX_NAME = "products"
 
+class OpenSearchUnavailable(Exception):
+    pass
+
+# 4xx от OpenSearch: кластер доступен, но отклонил запрос (например, поле отсутствует в маппинге)
+class OpenSearchRequestError(Exception):
+    def __init__(self, status_code, error, info=None):
+        super().__init__(f"{status_code} {error}")
+        self.status_code = status_code
+        self.error = error
+        self.info = info
+
+# Поля INDEX_MAPPING, которых нет в маппинге индекса за алиасом (заполняется check_mapping)
+stale_mapping_fields = []
+
+# Circuit breaker: после серии сбоев запросы к кластеру не отправляются reset_timeout секунд
+# и сразу уходят в резервный движок; затем пропускается один пробный запрос (half-open)
+class CircuitBreaker:
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+breaker = CircuitBreaker()
+
+def _is_outage(error):
+    # Сетевые ошибки (status_code "N/A") и 5xx - признак недоступности; 4xx - ошибка запроса
+    return not isinstance(error.status_code, int) or error.status_code >= 500
+
+def guarded(call, *args, **kwargs):
+    if not breaker.allow():
+        raise OpenSearchUnavailable("circuit breaker is open")
+    try:
+        with metrics.phase("opensearch"):
+            result = call(*args, **kwargs)
+    except TransportError as e:
+        if _is_outage(e):
+            breaker.record_failure()
+            raise OpenSearchUnavailable(str(e)) from e
+        raise OpenSearchRequestError(e.status_code, e.error, e.info) from e
+    breaker.record_success()
+    return result
+
+async def aguarded(call, *args, **kwargs):
+    if not breaker.allow():
+        raise OpenSearchUnavailable("circuit breaker is open")
+    try:
+        with metrics.phase("opensearch"):
+            result = await call(*args, **kwargs)
+    except TransportError as e:
+        if _is_outage(e):
+            breaker.record_failure()
+            raise OpenSearchUnavailable(str(e)) from e
+        raise OpenSearchRequestError(e.status_code, e.error, e.info) from e
+    breaker.record_success()
+    return result
+
+def _search(**kwargs):
+    return guarded(client.search, request_timeout=OPENSEARCH_TIMEOUT, **kwargs)
+
 INDEX_MAPPING = {
     "mappings": {
         "properties": {
@@ -23,27 +129,175 @@ INDEX_MAPPING = {
             "description": {"type": "text"},  # Полнотекстовый поиск по описанию
             "price": {"type": "float"},  # Числовое поле для фильтрации и сортировки
             "category": {"type": "keyword"},  # Точное совпадение для фильтров
-            "popularity": {"type": "integer"}  # Числовое поле для ранжирования
+            "popularity": {"type": "integer"},  # Числовое поле для ранжирования
+            "suggest": {"type": "completion"},  # Автодополнение с весом popularity
+            "content_hash": {"type": "integer"}  # Контрольная сумма для сверки с Postgres
         }
     }
 }
 
+def index_version_name(version):
+    return f"{INDEX_NAME}_v{version}"
+
+def alias_indices():
+    if not client.indices.exists_alias(name=INDEX_NAME):
+        return []
+    return sorted(client.indices.get_alias(name=INDEX_NAME))
+
+def next_index_version():
+    versions = [0]
+    for name in client.indices.get(index=f"{INDEX_NAME}_v*"):
+        suffix = name[len(INDEX_NAME) + 2:]
+        if suffix.isdigit():
+            versions.append(int(suffix))
+    return max(versions) + 1
+
+def create_versioned_index(version, settings=None, aliased=False):
+    name = index_version_name(version)
+    body = {**INDEX_MAPPING, "settings": settings or {}}
+    if aliased:
+        body["aliases"] = {INDEX_NAME: {}}
+    client.indices.create(index=name, body=body)
+    return name
+
+def _missing_fields(expected, actual, prefix=""):
+    missing = []
+    for name, spec in expected.items():
+        current = actual.get(name)
+        if current is None or current.get("type", "object") != spec.get("type", "object"):
+            missing.append(prefix + name)
+        else:
+            missing += _missing_fields(spec.get("fields", {}), current.get("fields", {}), f"{prefix}{name}.")
+    return missing
+
+def mapping_missing_fields():
+    # Индекс, созданный до появления полей (suggest, content_hash), отвечает 4xx на запросы к ним
+    missing = set()
+    for index in client.indices.get_mapping(index=INDEX_NAME).values():
+        properties = index["mappings"].get("properties", {})
+        missing.update(_missing_fields(INDEX_MAPPING["mappings"]["properties"], properties))
+    return sorted(missing)
+
+def check_mapping():
+    global stale_mapping_fields
+    stale_mapping_fields = mapping_missing_fields()
+    return stale_mapping_fields
+
 def create_index():
+    # exists() истинно и для алиаса, и для конкретного индекса products старой схемы.
+    # Возвращает поля, которых не хватает существующему индексу: нужна python reindex.py --rebuild
     if not client.indices.exists(index=INDEX_NAME):
-        client.indices.create(index=INDEX_NAME, body=INDEX_MAPPING)
+        create_versioned_index(1, aliased=True)
+        return []
+    return check_mapping()
 
-def index_product(product):
-    doc = {
+def drop_index():
+    # Все версии за алиасом (или индекс products старой схемы) - для полной перезагрузки каталога
+    indices = alias_indices() or ([INDEX_NAME] if client.indices.exists(index=INDEX_NAME) else [])
+    for index in indices:
+        client.indices.delete(index=index)
+    return indices
+
+def swap_alias(new_index):
+    # Все действия выполняются одним вызовом _aliases - атомарно, поиск не видит пустого промежутка
+    old = [index for index in alias_indices() if index != new_index]
+    actions = [{"add": {"index": new_index, "alias": INDEX_NAME}}]
+    actions += [{"remove": {"index": index, "alias": INDEX_NAME}} for index in old]
+    if not old and client.indices.exists(index=INDEX_NAME) and not client.indices.exists_alias(name=INDEX_NAME):
+        # Старая схема: products - конкретный индекс. Он удаляется в том же вызове, что создаёт алиас
+        actions.append({"remove_index": {"index": INDEX_NAME}})
+    client.indices.update_aliases(body={"actions": actions})
+    return old
+
+def product_doc(product):
+    return {
         "id": product.id,
         "name": product.name,
         "description": product.description,
         "price": product.price,
         "category": product.category,
-        "popularity": product.popularity
+        "popularity": product.popularity,
+        "suggest": {
+            "input": suggest_inputs(product.name),
+            "weight": max(0, product.popularity or 0)
+        },
+        "content_hash": content_hash(product)
     }
-    client.index(index=INDEX_NAME, id=product.id, body=doc)
 
-def search_products(query, category=None, min_price=None, max_price=None):
+def index_product(product):
+    client.index(index=INDEX_NAME, id=product.id, body=product_doc(product))
+
+def bulk_index_products(products, index=INDEX_NAME, refresh=None):
+    # Один _bulk запрос на всю пачку вместо HTTP-запроса на каждый товар.
+    # refresh="wait_for": ответ приходит после refresh, и документы уже видны поиску
+    body = []
+    for product in products:
+        body.append({"index": {"_index": index, "_id": product.id}})
+        body.append(product_doc(product))
+    if not body:
+        return 0, []
+
+    params = {"refresh": refresh} if refresh else {}
+    response = client.bulk(body=body, **params)
+    errors = []
+    if response.get("errors"):
+        for item in response["items"]:
+            result = item["index"]
+            if result.get("error"):
+                errors.append({"id": result["_id"], "error": result["error"]})
+    return len(body) // 2 - len(errors), errors
+
+def bulk_delete_products(product_ids, index=INDEX_NAME):
+    body = [{"delete": {"_index": index, "_id": product_id}} for product_id in product_ids]
+    if not body:
+        return 0
+    response = client.bulk(body=body)
+    return sum(1 for item in response["items"] if item["delete"].get("result") == "deleted")
+
+def create_async_client():
+    # Импорт внутри функции: AsyncOpenSearch доступен только при установленном aiohttp
+    from opensearchpy import AsyncOpenSearch
+    return AsyncOpenSearch(
+        hosts=OPENSEARCH_HOSTS,
+        http_auth=None,
+        use_ssl=False,
+        verify_certs=False
+    )
+
+# Стабильная сортировка для search_after: при равном score порядок задаёт id
+SEARCH_SORT = [{"_score": "desc"}, {"id": "asc"}]
+# Поля товара, которые отдаются клиенту; suggest и content_hash - служебные
+SOURCE_FIELDS = ("id", "name", "description", "price", "category", "popularity")
+
+class InvalidSearchParameter(ValueError):
+    pass
+
+class InvalidCursor(InvalidSearchParameter):
+    pass
+
+def encode_cursor(search_after, pit_id=None):
+    state = {"sa": search_after}
+    if pit_id:
+        state["pit"] = pit_id
+    return base64.urlsafe_b64encode(json.dumps(state).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        # Курсор приходит от клиента: всё, что не совпадает с SEARCH_SORT ([_score, id]),
+        # отклоняется здесь, а не превращается в 4xx OpenSearch
+        search_after = state.get("sa")
+        if not isinstance(search_after, list) or len(search_after) != len(SEARCH_SORT):
+            raise ValueError("search_after must be a list of two numbers")
+        if not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in search_after):
+            raise ValueError("search_after must be a list of two numbers")
+        if "pit" in state and not isinstance(state["pit"], str):
+            raise ValueError("pit must be a string")
+        return state
+    except (ValueError, AttributeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {e}")
+
+def build_query(query, category=None, min_price=None, max_price=None):
     must = []
     filters = []
     
@@ -67,51 +321,219 @@ def search_products(query, category=None, min_price=None, max_price=None):
             range_filter["range"]["price"]["lte"] = max_price
         filters.append(range_filter)
     
-    body = {
-        "query": {
-            "bool": {
-                "must": must if must else [{"match_all": {}}],
-                "filter": filters
-            }
-        },
-        "aggs": {
-            "categories": {"terms": {"field": "category"}},
-            "price_ranges": {
-                "range": {
-                    "field": "price",
-                    "ranges": [
-                        {"to": 1000},
-                        {"from": 1000, "to": 5000},
-                        {"from": 5000}
-                    ]
-                }
-            }
+    return {
+        "bool": {
+            "must": must if must else [{"match_all": {}}],
+            "filter": filters
         }
     }
-    
-    return client.search(index=INDEX_NAME, body=body)
 
-def suggest_products(prefix):
+def parse_fields(fields):
+    # "name,price" -> ("id", "name", "price"): id есть всегда, порядок нормализуется для ключа кэша
+    if not fields:
+        return SOURCE_FIELDS
+    names = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = names - set(SOURCE_FIELDS)
+    if unknown:
+        raise InvalidSearchParameter(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return tuple(name for name in SOURCE_FIELDS if name in names or name == "id")
+
+def build_search_body(query, category=None, min_price=None, max_price=None,
+                      page_size=DEFAULT_PAGE_SIZE, search_after=None, pit_id=None, fields=SOURCE_FIELDS):
     body = {
-        "query": {
-            "match_phrase_prefix": {
-                "name": prefix
-            }
-        },
-        "_source": ["name"],
-        "size": 5
+        "query": build_query(query, category, min_price, max_price),
+        "size": min(page_size, MAX_PAGE_SIZE),
+        "sort": SEARCH_SORT,
+        # Фильтрация _source на стороне кластера: длинные описания не идут по сети, если не нужны
+        "_source": list(fields)
     }
-    return client.search(index=INDEX_NAME, body=body)
+    if search_after:
+        body["search_after"] = search_after
+    if pit_id:
+        # С PIT индекс задаётся снимком, а не путём запроса
+        body["pit"] = {"id": pit_id, "keep_alive": PIT_KEEP_ALIVE}
+    return body
 
-def fuzzy_search(query):
-    body = {
-        "query": {
-            "multi_match": {
-                "query": query,
-                "fields": ["name^3", "description"],
-                "fuzziness": "AUTO"
+def search_products(query, category=None, min_price=None, max_price=None,
+                    cursor=None, page_size=DEFAULT_PAGE_SIZE, use_pit=False, fields=SOURCE_FIELDS):
+    page_size = min(page_size, MAX_PAGE_SIZE)
+    state = decode_cursor(cursor) if cursor else {}
+    pit_id = state.get("pit")
+
+    if not cursor and not use_pit:
+        # Кэшируется только первая страница: глубокие страницы запрашиваются редко
+        key = search_cache.make_key(query, category, min_price, max_price, page_size, fields)
+        body = build_search_body(query, category, min_price, max_price, page_size, fields=fields)
+        return search_cache.results.get_or_load(key, lambda: _search(index=INDEX_NAME, body=body))
+
+    if use_pit and not pit_id:
+        pit_id = guarded(client.create_pit, index=INDEX_NAME, params={"keep_alive": PIT_KEEP_ALIVE})["pit_id"]
+    body = build_search_body(query, category, min_price, max_price, page_size, state.get("sa"), pit_id, fields)
+    if pit_id:
+        results = _search(body=body)
+        if len(results["hits"]["hits"]) < page_size:
+            guarded(client.delete_pit, body={"pit_id": [pit_id]})
+    else:
+        results = _search(index=INDEX_NAME, body=body)
+    return results
+
+def build_msearch_body(specs):
+    # NDJSON _msearch: строка заголовка и строка тела на каждый поиск
+    body = []
+    for spec in specs:
+        body.append({"index": INDEX_NAME})
+        body.append(build_search_body(
+            spec["q"], spec["category"], spec["min_price"], spec["max_price"], spec["page_size"],
+            fields=spec["fields"]
+        ))
+    return body
+
+def search_batch(specs):
+    # Один запрос к кластеру на всю пачку; ответы приходят в том же порядке
+    return guarded(client.msearch, body=build_msearch_body(specs), request_timeout=OPENSEARCH_TIMEOUT)
+
+def format_msearch(response, specs):
+    results = []
+    for spec, item in zip(specs, response["responses"]):
+        if "error" in item:
+            error = item["error"]
+            results.append({
+                "error": error.get("reason", error.get("type")) if isinstance(error, dict) else str(error),
+                "status": item.get("status", 500)
+            })
+        else:
+            results.append(format_search(item, spec["page_size"]))
+    return results
+
+FACETS = ("categories", "price")
+
+def parse_facets(facets):
+    # "categories,price" -> ("categories", "price"); порядок нормализуется для ключа кэша
+    if not facets:
+        return ()
+    names = {name.strip() for name in facets.split(",") if name.strip()}
+    unknown = names - set(FACETS)
+    if unknown:
+        raise InvalidSearchParameter(f"Unknown facets: {', '.join(sorted(unknown))}")
+    return tuple(name for name in FACETS if name in names)
+
+def parse_price_buckets(price_buckets):
+    if not price_buckets:
+        return PRICE_BUCKETS
+    try:
+        edges = tuple(sorted({float(edge) for edge in price_buckets.split(",") if edge.strip()}))
+    except ValueError:
+        raise InvalidSearchParameter("price_buckets must be a comma-separated list of numbers")
+    if not edges:
+        raise InvalidSearchParameter("price_buckets must not be empty")
+    return edges
+
+def price_ranges(edges):
+    ranges = [{"to": edges[0]}]
+    ranges += [{"from": low, "to": high} for low, high in zip(edges, edges[1:])]
+    ranges.append({"from": edges[-1]})
+    return ranges
+
+def price_range_buckets(price_buckets, count):
+    # Бакеты в формате ответа range-агрегации для фасетов из памяти; count(low, high) - число цен в [low, high)
+    buckets = []
+    edges = [None, *price_buckets, None]
+    for low, high in zip(edges, edges[1:]):
+        bucket = {"key": f"{'*' if low is None else low}-{'*' if high is None else high}"}
+        if low is not None:
+            bucket["from"] = low
+        if high is not None:
+            bucket["to"] = high
+        bucket["doc_count"] = count(low, high)
+        buckets.append(bucket)
+    return {"buckets": buckets}
+
+def build_facets_body(query, category=None, min_price=None, max_price=None,
+                      facets=FACETS, price_buckets=PRICE_BUCKETS):
+    aggs = {}
+    if "categories" in facets:
+        aggs["categories"] = {"terms": {"field": "category"}}
+    if "price" in facets:
+        aggs["price_ranges"] = {"range": {"field": "price", "ranges": price_ranges(price_buckets)}}
+    return {
+        "query": build_query(query, category, min_price, max_price),
+        "size": 0,
+        "aggs": aggs
+    }
+
+def search_facets(query, category=None, min_price=None, max_price=None,
+                  facets=FACETS, price_buckets=PRICE_BUCKETS):
+    if not facets:
+        return {}
+    # Фасеты не зависят от страницы выдачи и кэшируются отдельно от хитов
+    key = search_cache.make_key(query, category, min_price, max_price, facets, price_buckets)
+    body = build_facets_body(query, category, min_price, max_price, facets, price_buckets)
+    return search_cache.facets.get_or_load(
+        key, lambda: _search(index=INDEX_NAME, body=body)["aggregations"]
+    )
+
+def build_suggest_body(prefix):
+    return {
+        "_source": ["name"],
+        "suggest": {
+            "product-suggest": {
+                "prefix": prefix,
+                "completion": {
+                    "field": "suggest",
+                    # С запасом: несколько входов одного товара схлопываются в format_suggestions
+                    "size": SUGGEST_SIZE * 2,
+                    "skip_duplicates": True
+                }
             }
         }
     }
-    return client.search(index=INDEX_NAME, body=body)
+
+def suggest_products(prefix):
+    return _search(index=INDEX_NAME, body=build_suggest_body(prefix))
+
+def build_fuzzy_body(query, fields=SOURCE_FIELDS, fuzziness="AUTO"):
+    multi_match = {"query": query, "fields": ["name^3", "description"]}
+    if fuzziness:
+        multi_match["fuzziness"] = fuzziness
+    return {"query": {"multi_match": multi_match}, "_source": list(fields)}
+
+def fuzzy_search(query, fields=SOURCE_FIELDS, fuzziness="AUTO"):
+    return _search(index=INDEX_NAME, body=build_fuzzy_body(query, fields, fuzziness))
+
+def format_fuzzy(results, query, corrected, fuzzy):
+    data = format_hits(results)
+    data["corrected_query"] = corrected if corrected != query else None
+    data["fuzzy"] = fuzzy
+    return data
+
+def next_cursor(results, page_size):
+    hits = results["hits"]["hits"]
+    if len(hits) < page_size or not hits[-1].get("sort"):
+        return None
+    # OpenSearch может вернуть обновлённый pit_id - следующий запрос должен использовать его
+    return encode_cursor(hits[-1]["sort"], results.get("pit_id"))
+
+def format_search(results, page_size=DEFAULT_PAGE_SIZE, aggregations=None):
+    return {
+        "hits": [hit["_source"] for hit in results["hits"]["hits"]],
+        "total": results["hits"]["total"]["value"],
+        "aggregations": aggregations or {},
+        "next_cursor": next_cursor(results, min(page_size, MAX_PAGE_SIZE))
+    }
+
+def format_hits(results):
+    return {"hits": [hit["_source"] for hit in results["hits"]["hits"]]}
+
+def json_response(data, engine):
+    # Ответ уже собран из dict/list/str/float: orjson сериализует его напрямую, без jsonable_encoder
+    with metrics.phase("serialization"):
+        return ORJSONResponse(data, headers={"X-Search-Engine": engine})
+
+def format_suggestions(results):
+    names = []
+    for option in results["suggest"]["product-suggest"][0]["options"]:
+        name = option["_source"]["name"]
+        if name not in names:
+            names.append(name)
+    return {"suggestions": names[:SUGGEST_SIZE]}
 
@@ -0,0 +1,115 @@
+import argparse
+import threading
+import time
+from datetime import timedelta
+
+from sqlalchemy import func
+
+from config import (
+    OUTBOX_BATCH_SIZE, OUTBOX_POLL_INTERVAL, OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_BACKOFF,
+    LOCAL_INDEX_ENABLED, SPELLING_ENABLED, FACET_INDEX_ENABLED, SUGGEST_BACKEND
+)
+from database import SessionLocal, Product, SearchOutbox
+import facet_index
+import local_index
+import opensearch_client as os_client
+import prefix_index
+import search_cache
+import spelling
+
+
+def _claim_batch(db, batch_size):
+    # SKIP LOCKED: несколько воркеров разбирают очередь, не блокируя друг друга
+    return (
+        db.query(SearchOutbox)
+        .filter(SearchOutbox.available_at <= func.now(), SearchOutbox.attempts < OUTBOX_MAX_ATTEMPTS)
+        .order_by(SearchOutbox.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+
+
+def _load_products(db, product_ids):
+    return db.query(Product).filter(Product.id.in_(product_ids)).all()
+
+
+def drain_batch(db, batch_size=OUTBOX_BATCH_SIZE):
+    rows = _claim_batch(db, batch_size)
+    if not rows:
+        db.rollback()
+        return 0
+
+    # Повторные записи одного товара схлопываются: индексация по _id идемпотентна
+    products = _load_products(db, {row.product_id for row in rows})
+    try:
+        # Кэши ниже сбрасываются только после refresh: иначе поиск в ближайшую секунду
+        # не увидит новый товар и закэширует выдачу без него на SEARCH_CACHE_TTL
+        _, errors = os_client.bulk_index_products(products, refresh="wait_for")
+    except Exception as e:
+        errors = [{"id": product.id, "error": str(e)} for product in products]
+    failed = {int(error["id"]): str(error["error"]) for error in errors}
+
+    for row in rows:
+        if row.product_id in failed:
+            row.attempts += 1
+            row.last_error = failed[row.product_id]
+            # Время повтора считает БД: _claim_batch сравнивает available_at с её now(), а не с часами приложения
+            row.available_at = func.now() + timedelta(seconds=OUTBOX_RETRY_BACKOFF * 2 ** row.attempts)
+        else:
+            db.delete(row)
+    db.commit()
+
+    for product in products:
+        if product.id not in failed:
+            search_cache.results.invalidate_product(product)
+            search_cache.facets.invalidate_product(product)
+            # Индексы в памяти меняются вместе с OpenSearch, а не раньше него
+            if SUGGEST_BACKEND == "trie":
+                prefix_index.index.add(product.id, product.name, product.popularity)
+            if LOCAL_INDEX_ENABLED:
+                local_index.index.add(product)
+            if SPELLING_ENABLED:
+                spelling.index.add(product)
+            if FACET_INDEX_ENABLED:
+                facet_index.index.add(product)
+    return len(rows)
+
+
+def run(stop_event, batch_size=OUTBOX_BATCH_SIZE, poll_interval=OUTBOX_POLL_INTERVAL):
+    while not stop_event.is_set():
+        db = SessionLocal()
+        try:
+            processed = drain_batch(db, batch_size)
+        except Exception as e:
+            print(f"Outbox: ошибка обработки пачки: {e}")
+            processed = 0
+        finally:
+            db.close()
+        # Полная пачка - в очереди, скорее всего, есть ещё записи, забираем сразу
+        if processed < batch_size:
+            stop_event.wait(poll_interval)
+
+
+def start(batch_size=OUTBOX_BATCH_SIZE, poll_interval=OUTBOX_POLL_INTERVAL):
+    stop_event = threading.Event()
+    thread = threading.Thread(target=run, args=(stop_event, batch_size, poll_interval), daemon=True)
+    thread.start()
+
+    def stop():
+        stop_event.set()
+        thread.join()
+    return stop
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Фоновая индексация товаров из search_outbox")
+    parser.add_argument("--batch-size", type=int, default=OUTBOX_BATCH_SIZE)
+    parser.add_argument("--poll-interval", type=float, default=OUTBOX_POLL_INTERVAL)
+    args = parser.parse_args()
+
+    stop_event = threading.Event()
+    try:
+        run(stop_event, args.batch_size, args.poll_interval)
+    except KeyboardInterrupt:
+        stop_event.set()
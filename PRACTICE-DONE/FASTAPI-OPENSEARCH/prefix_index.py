@@ -0,0 +1,143 @@
+import threading
+
+from sqlalchemy import select
+
+from config import SUGGEST_SIZE
+from database import SessionLocal, Product
+
+TOP_K = 10
+
+
+def suggest_inputs(name):
+    # "Samsung Galaxy S24" -> ["Samsung Galaxy S24", "Galaxy S24", "S24"]:
+    # автодополнение срабатывает с начала любого слова, как match_phrase_prefix
+    words = name.split()
+    return [" ".join(words[i:]) for i in range(len(words))]
+
+
+class _Node:
+    __slots__ = ("children", "items", "top")
+
+    def __init__(self):
+        self.children = {}  # первый символ ребра -> (метка ребра, узел)
+        self.items = {}  # product_id -> (weight, name) для ключей, заканчивающихся в узле
+        self.top = []  # лучшие TOP_K (weight, product_id, name) во всём поддереве
+
+
+def _merge_top(entries):
+    best = {}
+    for weight, product_id, name in entries:
+        if product_id not in best or best[product_id][0] < weight:
+            best[product_id] = (weight, product_id, name)
+    return sorted(best.values(), key=lambda e: (-e[0], e[2]))[:TOP_K]
+
+
+# Сжатое префиксное дерево (radix trie) по словам названий товаров.
+# В каждом узле хранится готовый топ поддерева, поэтому подсказка - это спуск по префиксу
+class PrefixIndex:
+    def __init__(self):
+        self.root = _Node()
+        self.products = {}  # product_id -> (name, weight)
+        self.ready = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.products)
+
+    def _path(self, key, create):
+        node, path, i = self.root, [self.root], 0
+        while i < len(key):
+            edge = node.children.get(key[i])
+            if edge is None:
+                if not create:
+                    return None
+                child = _Node()
+                node.children[key[i]] = (key[i:], child)
+                path.append(child)
+                return path
+            label, child = edge
+            common = 0
+            while common < len(label) and i + common < len(key) and label[common] == key[i + common]:
+                common += 1
+            if common < len(label):
+                if not create:
+                    # Префикс закончился посреди ребра - весь поддерево под ним подходит
+                    if i + common == len(key):
+                        path.append(child)
+                        return path
+                    return None
+                middle = _Node()
+                middle.children[label[common]] = (label[common:], child)
+                middle.top = list(child.top)
+                node.children[key[i]] = (label[:common], middle)
+                child = middle
+            node = child
+            path.append(node)
+            i += common
+        return path
+
+    def _insert(self, key, product_id, name, weight):
+        path = self._path(key, create=True)
+        path[-1].items[product_id] = (weight, name)
+        entry = (weight, product_id, name)
+        for node in path:
+            node.top = _merge_top(node.top + [entry])
+
+    def _delete(self, key, product_id):
+        path = self._path(key, create=False)
+        if path is None or product_id not in path[-1].items:
+            return
+        del path[-1].items[product_id]
+        # Топ пересчитывается снизу вверх только вдоль затронутого пути
+        for node in reversed(path):
+            entries = [(w, pid, n) for pid, (w, n) in node.items.items()]
+            for _, child in node.children.values():
+                entries += child.top
+            node.top = _merge_top(entries)
+
+    def add(self, product_id, name, weight):
+        weight = max(0, weight or 0)
+        with self._lock:
+            old = self.products.get(product_id)
+            if old == (name, weight):
+                return
+            if old is not None:
+                for key in suggest_inputs(old[0].lower()):
+                    self._delete(key, product_id)
+            self.products[product_id] = (name, weight)
+            for key in suggest_inputs(name.lower()):
+                self._insert(key, product_id, name, weight)
+
+    def suggest(self, prefix, limit=SUGGEST_SIZE):
+        prefix = " ".join(prefix.lower().split())
+        if not prefix:
+            return []
+        path = self._path(prefix, create=False)
+        if path is None:
+            return []
+        names = []
+        for _, _, name in path[-1].top:
+            if name not in names:
+                names.append(name)
+        return names[:limit]
+
+    def build(self, chunk_size=1000):
+        db = SessionLocal()
+        try:
+            stmt = select(Product.id, Product.name, Product.popularity).execution_options(yield_per=chunk_size)
+            for chunk in db.execute(stmt).partitions():
+                for row in chunk:
+                    self.add(row.id, row.name, row.popularity)
+        finally:
+            db.close()
+        self.ready = True
+
+
+index = PrefixIndex()
+
+
+def start_build():
+    # Построение в фоне: пока индекс не готов, /suggest обслуживает OpenSearch
+    thread = threading.Thread(target=index.build, daemon=True)
+    thread.start()
+    return thread
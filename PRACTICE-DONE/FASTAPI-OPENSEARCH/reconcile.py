@@ -0,0 +1,156 @@
+import argparse
+import time
+
+from sqlalchemy import text
+
+from database import SessionLocal, Product, CONTENT_HASH_SQL
+import opensearch_client as os_client
+
+FANOUT = 16
+LEAF_SIZE = 256
+
+PG_BOUNDS_SQL = text("SELECT min(id), max(id) FROM products")
+PG_SUMMARY_SQL = text(
+    f"SELECT (id - :first_id) / :step AS bucket, count(*), sum({CONTENT_HASH_SQL}) "
+    "FROM products WHERE id BETWEEN :first_id AND :last_id GROUP BY bucket"
+)
+PG_HASHES_SQL = text(f"SELECT id, {CONTENT_HASH_SQL} FROM products WHERE id BETWEEN :first_id AND :last_id")
+
+
+# Каждая сторона умеет: границы id, (count, sum hash) по соседним диапазонам одной ширины
+# за один запрос, и точные hash по id внутри небольшого диапазона
+class PostgresSide:
+    def __init__(self, db):
+        self.db = db
+        self.queries = 0
+
+    def bounds(self):
+        self.queries += 1
+        return tuple(self.db.execute(PG_BOUNDS_SQL).one())
+
+    def summaries(self, first_id, step, count):
+        self.queries += 1
+        rows = self.db.execute(PG_SUMMARY_SQL, {
+            "first_id": first_id, "step": step, "last_id": first_id + step * count - 1
+        })
+        return {bucket: (total, int(hash_sum)) for bucket, total, hash_sum in rows}
+
+    def hashes(self, first_id, last_id):
+        self.queries += 1
+        return dict(self.db.execute(PG_HASHES_SQL, {"first_id": first_id, "last_id": last_id}).all())
+
+
+class OpenSearchSide:
+    def __init__(self, client=None, index=os_client.INDEX_NAME):
+        self.client = client or os_client.client
+        self.index = index
+        self.queries = 0
+
+    def bounds(self):
+        self.queries += 1
+        aggs = self.client.search(index=self.index, body={
+            "size": 0, "aggs": {"min_id": {"min": {"field": "id"}}, "max_id": {"max": {"field": "id"}}}
+        })["aggregations"]
+        if aggs["min_id"]["value"] is None:
+            return None, None
+        return int(aggs["min_id"]["value"]), int(aggs["max_id"]["value"])
+
+    def summaries(self, first_id, step, count):
+        self.queries += 1
+        ranges = [{"key": str(i), "from": first_id + i * step, "to": first_id + (i + 1) * step} for i in range(count)]
+        response = self.client.search(index=self.index, body={
+            "size": 0,
+            "aggs": {"buckets": {
+                "range": {"field": "id", "ranges": ranges, "keyed": True},
+                "aggs": {"hash": {"sum": {"field": "content_hash"}}}
+            }}
+        })
+        return {
+            int(key): (bucket["doc_count"], round(bucket["hash"]["value"]))
+            for key, bucket in response["aggregations"]["buckets"]["buckets"].items()
+            if bucket["doc_count"]
+        }
+
+    def hashes(self, first_id, last_id):
+        self.queries += 1
+        response = self.client.search(index=self.index, body={
+            "size": last_id - first_id + 1,
+            "_source": ["content_hash"],
+            "query": {"range": {"id": {"gte": first_id, "lte": last_id}}}
+        })
+        return {int(hit["_id"]): hit["_source"].get("content_hash") for hit in response["hits"]["hits"]}
+
+
+def find_drift(source, target, fanout=FANOUT, leaf_size=LEAF_SIZE):
+    # Бисекция по диапазонам id: совпавший диапазон (число документов и сумма hash)
+    # больше не проверяется, расходящийся делится на fanout частей до leaf_size
+    bounds = [b for b in (source.bounds(), target.bounds()) if b[0] is not None]
+    if not bounds:
+        return [], []
+    stale, extra = [], []
+    pending = [(min(b[0] for b in bounds), max(b[1] for b in bounds))]
+    while pending:
+        first_id, last_id = pending.pop()
+        if last_id - first_id + 1 <= leaf_size:
+            expected = source.hashes(first_id, last_id)
+            actual = target.hashes(first_id, last_id)
+            stale += sorted(i for i, value in expected.items() if actual.get(i) != value)
+            extra += sorted(set(actual) - set(expected))
+            continue
+        step = -(-(last_id - first_id + 1) // fanout)
+        count = -(-(last_id - first_id + 1) // step)
+        expected = source.summaries(first_id, step, count)
+        actual = target.summaries(first_id, step, count)
+        for bucket in range(count):
+            if expected.get(bucket, (0, 0)) != actual.get(bucket, (0, 0)):
+                start = first_id + bucket * step
+                pending.append((start, min(start + step - 1, last_id)))
+    return stale, extra
+
+
+def repair(db, stale, extra):
+    indexed = 0
+    for start in range(0, len(stale), 1000):
+        products = db.query(Product).filter(Product.id.in_(stale[start:start + 1000])).all()
+        indexed += os_client.bulk_index_products(products)[0]
+    deleted = os_client.bulk_delete_products(extra)
+    return indexed, deleted
+
+
+def reconcile(fanout=FANOUT, leaf_size=LEAF_SIZE, dry_run=False, verbose=True):
+    start = time.time()
+    db = SessionLocal()
+    try:
+        source, target = PostgresSide(db), OpenSearchSide()
+        stale, extra = find_drift(source, target, fanout, leaf_size)
+        stats = {
+            "stale": len(stale),
+            "extra": len(extra),
+            "queries": {"postgres": source.queries, "opensearch": target.queries},
+            "indexed": 0,
+            "deleted": 0
+        }
+        if not dry_run:
+            stats["indexed"], stats["deleted"] = repair(db, stale, extra)
+    finally:
+        db.close()
+    stats["time_s"] = round(time.time() - start, 2)
+    if verbose:
+        print(f"Расхождений: {stats['stale']} устаревших/отсутствующих, {stats['extra']} лишних "
+              f"(запросов: Postgres {source.queries}, OpenSearch {target.queries})")
+        if stale or extra:
+            print(f"id: {(stale + extra)[:20]}{' ...' if len(stale) + len(extra) > 20 else ''}")
+        if not dry_run:
+            print(f"Переиндексировано: {stats['indexed']}, удалено: {stats['deleted']}")
+        print(f"Время: {stats['time_s']}s")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сверка товаров Postgres и OpenSearch по диапазонам id")
+    parser.add_argument("--fanout", type=int, default=FANOUT, help="на сколько частей делится расходящийся диапазон")
+    parser.add_argument("--leaf-size", type=int, default=LEAF_SIZE, help="ширина диапазона для сверки по id")
+    parser.add_argument("--dry-run", action="store_true", help="только найти расхождения, не исправлять")
+    args = parser.parse_args()
+
+    reconcile(fanout=args.fanout, leaf_size=args.leaf_size, dry_run=args.dry_run)
@@ -0,0 +1,195 @@
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from sqlalchemy import select, func
+
+from database import SessionLocal, Product
+import opensearch_client as os_client
+
+CHUNK_SIZE = 1000
+CONCURRENCY = 4
+SLICES = 4
+# На время заливки новой версии: без периодического refresh и без реплик
+BULK_LOAD_SETTINGS = {"index": {"refresh_interval": "-1", "number_of_replicas": 0}}
+
+
+def stream_products(db, chunk_size=CHUNK_SIZE, first_id=None, last_id=None):
+    # yield_per включает server-side cursor: строки приходят из Postgres пачками,
+    # вся таблица в память не загружается
+    stmt = select(
+        Product.id,
+        Product.name,
+        Product.description,
+        Product.price,
+        Product.category,
+        Product.popularity
+    ).order_by(Product.id).execution_options(yield_per=chunk_size)
+    if first_id is not None:
+        stmt = stmt.where(Product.id >= first_id)
+    if last_id is not None:
+        stmt = stmt.where(Product.id <= last_id)
+    for chunk in db.execute(stmt).partitions():
+        yield chunk
+
+
+def _index_chunk(number, chunk, index):
+    start = time.time()
+    try:
+        indexed, errors = os_client.bulk_index_products(chunk, index=index)
+    except Exception as e:
+        # Упала вся пачка - ошибка на каждый товар, чтобы счётчик был точным, а id можно было переиндексировать
+        indexed, errors = 0, [{"id": product.id, "error": str(e)} for product in chunk]
+    return {
+        "chunk": number,
+        "first_id": chunk[0].id,
+        "last_id": chunk[-1].id,
+        "indexed": indexed,
+        "errors": errors,
+        "time_ms": round((time.time() - start) * 1000, 2)
+    }
+
+
+def reindex(chunk_size=CHUNK_SIZE, concurrency=CONCURRENCY, index=os_client.INDEX_NAME, verbose=True):
+    db = SessionLocal()
+    stats = {"indexed": 0, "failed": 0, "chunks": 0, "failed_chunks": []}
+    start = time.time()
+
+    def collect(future):
+        result = future.result()
+        stats["chunks"] += 1
+        stats["indexed"] += result["indexed"]
+        stats["failed"] += len(result["errors"])
+        if result["errors"]:
+            stats["failed_chunks"].append(result)
+            if verbose:
+                print(f"Пачка {result['chunk']} (id {result['first_id']}..{result['last_id']}): "
+                      f"ошибок {len(result['errors'])}, первая: {result['errors'][0]['error']}")
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            in_flight = set()
+            for number, chunk in enumerate(stream_products(db, chunk_size), start=1):
+                # Не читаем из БД больше, чем успеваем отправить: в полёте не более 2*concurrency пачек
+                if len(in_flight) >= concurrency * 2:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future)
+                in_flight.add(executor.submit(_index_chunk, number, chunk, index))
+            for future in in_flight:
+                collect(future)
+    finally:
+        db.close()
+
+    elapsed = time.time() - start
+    stats["time_s"] = round(elapsed, 2)
+    stats["docs_per_sec"] = round(stats["indexed"] / elapsed, 2) if elapsed else 0
+    if verbose:
+        print(f"Проиндексировано: {stats['indexed']}, ошибок: {stats['failed']} "
+              f"в {len(stats['failed_chunks'])} пачках из {stats['chunks']}")
+        print(f"Время: {stats['time_s']}s, {stats['docs_per_sec']} docs/sec")
+    return stats
+
+
+def id_slices(db, slices):
+    # Диапазоны id одинаковой ширины; каждый срез читается своим соединением параллельно
+    first_id, last_id = db.execute(select(func.min(Product.id), func.max(Product.id))).one()
+    if first_id is None:
+        return [], 0
+    step = -(-(last_id - first_id + 1) // slices)
+    return [(start, min(start + step - 1, last_id)) for start in range(first_id, last_id + 1, step)], last_id
+
+
+def copy_range(first_id, last_id, index, chunk_size=CHUNK_SIZE):
+    db = SessionLocal()
+    stats = {"first_id": first_id, "last_id": last_id, "max_id": None, "indexed": 0, "errors": []}
+    try:
+        for number, chunk in enumerate(stream_products(db, chunk_size, first_id, last_id), start=1):
+            result = _index_chunk(number, chunk, index)
+            stats["indexed"] += result["indexed"]
+            stats["errors"] += result["errors"]
+            stats["max_id"] = chunk[-1].id
+    finally:
+        db.close()
+    return stats
+
+
+def rebuild(slices=SLICES, chunk_size=CHUNK_SIZE, keep_old=False, verbose=True):
+    # Новая версия индекса строится рядом с рабочей; поиск всё это время идёт по старой
+    log = print if verbose else lambda *args: None
+    start = time.time()
+    new_index = os_client.create_versioned_index(os_client.next_index_version(), BULK_LOAD_SETTINGS)
+    live = os_client.alias_indices() or [os_client.INDEX_NAME]
+    replicas = None
+    if os_client.client.indices.exists(index=live[0]):
+        settings = os_client.client.indices.get_settings(index=live[0])
+        replicas = next(iter(settings.values()))["settings"]["index"].get("number_of_replicas")
+    log(f"Строится {new_index}, рабочая версия: {', '.join(live)}")
+
+    db = SessionLocal()
+    try:
+        ranges, last_id = id_slices(db, slices)
+        stats = {"index": new_index, "indexed": 0, "failed": 0, "slices": []}
+        with ThreadPoolExecutor(max_workers=max(1, len(ranges))) as executor:
+            for result in executor.map(lambda r: copy_range(r[0], r[1], new_index, chunk_size), ranges):
+                stats["slices"].append({**result, "errors": len(result["errors"])})
+                stats["indexed"] += result["indexed"]
+                stats["failed"] += len(result["errors"])
+                log(f"Срез id {result['first_id']}..{result['last_id']}: {result['indexed']} документов, "
+                    f"ошибок {len(result['errors'])}")
+
+        # Товары, добавленные во время заливки
+        caught_up = copy_range(last_id + 1, None, new_index, chunk_size)
+        stats["indexed"] += caught_up["indexed"]
+        stats["failed"] += len(caught_up["errors"])
+        last_id = caught_up["max_id"] or last_id
+
+        os_client.client.indices.put_settings(
+            index=new_index, body={"index": {"refresh_interval": None, "number_of_replicas": replicas}}
+        )
+        os_client.client.indices.refresh(index=new_index)
+        os_client.client.cluster.health(index=new_index, wait_for_status="yellow", timeout="60s")
+
+        expected = db.execute(select(func.count(Product.id)).where(Product.id <= last_id)).scalar()
+    finally:
+        db.close()
+    actual = os_client.client.count(index=new_index)["count"]
+    stats.update({"expected": expected, "actual": actual, "time_s": round(time.time() - start, 2)})
+
+    if stats["failed"] or actual < expected:
+        os_client.client.indices.delete(index=new_index)
+        stats["swapped"] = False
+        log(f"Проверка не пройдена: в Postgres {expected}, в {new_index} {actual}, ошибок {stats['failed']}. "
+            f"{new_index} удалён, алиас не переключён")
+        return stats
+
+    old = os_client.swap_alias(new_index)
+    stats["swapped"] = True
+    # Товары, проиндексированные outbox_worker в старую версию между проверкой и переключением
+    copy_range(last_id + 1, None, os_client.INDEX_NAME, chunk_size)
+    if not keep_old:
+        for index in old:
+            if os_client.client.indices.exists(index=index):
+                os_client.client.indices.delete(index=index)
+    log(f"Алиас {os_client.INDEX_NAME} -> {new_index}: {actual} документов за {stats['time_s']}s"
+        + (f", удалены: {', '.join(old)}" if old and not keep_old else ""))
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Потоковая переиндексация товаров в OpenSearch")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="товаров в одном bulk-запросе")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="параллельных bulk-запросов")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="построить новую версию индекса и переключить на неё алиас")
+    parser.add_argument("--slices", type=int, default=SLICES, help="параллельных срезов при --rebuild")
+    parser.add_argument("--keep-old", action="store_true", help="не удалять старую версию после переключения")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        if not rebuild(slices=args.slices, chunk_size=args.chunk_size, keep_old=args.keep_old)["swapped"]:
+            sys.exit(1)
+    else:
+        os_client.create_index()
+        reindex(chunk_size=args.chunk_size, concurrency=args.concurrency)
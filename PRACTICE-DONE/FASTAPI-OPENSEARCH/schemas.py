@@ -1,4 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+from config import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, MAX_BATCH_SIZE
 
 class ProductCreate(BaseModel):
     name: str
@@ -17,3 +19,15 @@ class ProductResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+class SearchSpec(BaseModel):
+    # Те же параметры, что у GET /search (первая страница)
+    q: str | None = None
+    category: str | None = None
+    min_price: float | None = None
+    max_price: float | None = None
+    page_size: int = Field(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+    fields: str | None = None
+
+class SearchBatch(BaseModel):
+    searches: list[SearchSpec] = Field(min_length=1, max_length=MAX_BATCH_SIZE)
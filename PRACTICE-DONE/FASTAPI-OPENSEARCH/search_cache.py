@@ -0,0 +1,161 @@
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from config import SEARCH_CACHE_MAX_ENTRIES, SEARCH_CACHE_MAX_BYTES, SEARCH_CACHE_TTL
+
+
+def make_key(query, category=None, min_price=None, max_price=None, *extra):
+    # Ключ: (q, category, min_price, max_price, ...). Первые четыре позиции
+    # использует invalidate_product, дополнительные параметры идут в хвост
+    q = " ".join(query.lower().split()) if query else None
+    category = category.strip() if category else None
+    min_price = float(min_price) if min_price else None
+    max_price = float(max_price) if max_price else None
+    return (q or None, category or None, min_price, max_price) + extra
+
+
+# LRU-кэш с TTL, ограничением по числу записей и байтам.
+# Одновременные промахи по одному ключу ждут единственную загрузку (single-flight).
+# Кэш живёт в памяти процесса: invalidate не доходит до других воркеров uvicorn,
+# там устаревшая выдача живёт до истечения ttl (см. SEARCH_CACHE_TTL в config.py)
+class SearchCache:
+    def __init__(self, max_entries=SEARCH_CACHE_MAX_ENTRIES, max_bytes=SEARCH_CACHE_MAX_BYTES, ttl=SEARCH_CACHE_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._inflight = {}
+        self._async_inflight = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "invalidations": 0}
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        self.counters["hits"] += 1
+        return entry
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _store(self, key, value, generation):
+        # Пока шла загрузка, кэш мог быть инвалидирован - такой результат не сохраняем
+        if generation != self._generation:
+            return
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl, size, value)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.counters["evictions"] += 1
+
+    def get_or_load(self, key, loader):
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                return entry[2]
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                self.counters["misses"] += 1
+                future = self._inflight[key] = Future()
+                generation = self._generation
+            else:
+                self.counters["coalesced"] += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            value = loader()
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._inflight.pop(key, None)
+            self._store(key, value, generation)
+        future.set_result(value)
+        return value
+
+    async def aget_or_load(self, key, loader):
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                return entry[2]
+            future = self._async_inflight.get(key)
+            leader = future is None
+            if leader:
+                self.counters["misses"] += 1
+                future = self._async_inflight[key] = asyncio.get_running_loop().create_future()
+                # Исключение забирают ожидающие; без них future не должен ругаться при сборке мусора
+                future.add_done_callback(lambda f: f.cancelled() or f.exception())
+                generation = self._generation
+            else:
+                self.counters["coalesced"] += 1
+
+        if not leader:
+            return await asyncio.shield(future)
+
+        try:
+            value = await loader()
+        except BaseException as e:
+            with self._lock:
+                self._async_inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._async_inflight.pop(key, None)
+            self._store(key, value, generation)
+        future.set_result(value)
+        return value
+
+    def invalidate(self, predicate=None):
+        with self._lock:
+            self._generation += 1
+            keys = [key for key in self._entries if predicate is None or predicate(key)]
+            for key in keys:
+                self._remove(key)
+            self.counters["invalidations"] += len(keys)
+
+    def invalidate_product(self, product):
+        # Текст запроса не проверяем: товар может попасть в любую выдачу с подходящими фильтрами
+        def affected(key):
+            _, category, min_price, max_price = key[:4]
+            return (
+                (category is None or category == product.category)
+                and (min_price is None or product.price >= min_price)
+                and (max_price is None or product.price <= max_price)
+            )
+        self.invalidate(affected)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"] + self.counters["coalesced"]
+            return {
+                **self.counters,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else 0.0
+            }
+
+
+results = SearchCache()
+facets = SearchCache()
@@ -0,0 +1,153 @@
+import threading
+
+from sqlalchemy import select
+
+from config import SPELLING_ENABLED, SPELLING_MAX_EDIT_DISTANCE
+from database import SessionLocal, Product
+from local_index import tokenize
+
+# SymSpell считает удаления только по первым PREFIX_LENGTH символам: словарь удалений
+# меньше в разы, а опечатки в длинных словах всё равно находятся по префиксу
+PREFIX_LENGTH = 7
+# Короче MIN_TERM_LENGTH и числа не исправляем: "s9", "14", "pro" слишком легко "исправить" в другое
+MIN_TERM_LENGTH = 4
+# Исправление уверенное, если лучший кандидат встречается хотя бы вдвое чаще второго с тем же расстоянием
+CONFIDENCE_RATIO = 2
+
+
+def _deletes(term, max_distance):
+    term = term[:PREFIX_LENGTH]
+    result = {term}
+    frontier = {term}
+    for _ in range(max_distance):
+        frontier = {word[:i] + word[i + 1:] for word in frontier for i in range(len(word))} - result
+        result |= frontier
+    return result
+
+
+def edit_distance(a, b, max_distance):
+    # Расстояние Дамерау-Левенштейна (с перестановкой соседних символов); None, если больше max_distance
+    if abs(len(a) - len(b)) > max_distance:
+        return None
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > max_distance:
+            return None
+        previous2, previous = previous, current
+    return previous[-1] if previous[-1] <= max_distance else None
+
+
+# Словарь symmetric delete по словам названий и описаний товаров: частота слова - число товаров с ним
+class SpellIndex:
+    def __init__(self, max_distance=SPELLING_MAX_EDIT_DISTANCE):
+        self.max_distance = max_distance
+        self.frequencies = {}  # слово -> число товаров
+        self.deletes = {}  # удаление -> множество слов словаря
+        self.products = {}  # product_id -> frozenset слов, для обновления товара
+        self.ready = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.frequencies)
+
+    def _add_term(self, term):
+        count = self.frequencies.get(term, 0)
+        self.frequencies[term] = count + 1
+        if count == 0:
+            for variant in _deletes(term, self.max_distance):
+                self.deletes.setdefault(variant, set()).add(term)
+
+    def _remove_term(self, term):
+        count = self.frequencies[term] - 1
+        if count:
+            self.frequencies[term] = count
+            return
+        del self.frequencies[term]
+        for variant in _deletes(term, self.max_distance):
+            terms = self.deletes[variant]
+            terms.discard(term)
+            if not terms:
+                del self.deletes[variant]
+
+    def add(self, product):
+        terms = frozenset(tokenize(product.name) + tokenize(product.description))
+        with self._lock:
+            old = self.products.get(product.id, frozenset())
+            for term in old - terms:
+                self._remove_term(term)
+            for term in terms - old:
+                self._add_term(term)
+            self.products[product.id] = terms
+
+    def _allowed_distance(self, term):
+        return 1 if len(term) <= 5 else self.max_distance
+
+    def correct(self, term):
+        # (исправление, уверенно ли). Известное слово - само себе исправление
+        if term in self.frequencies or len(term) < MIN_TERM_LENGTH or term.isdigit():
+            return term, True
+        max_distance = self._allowed_distance(term)
+        candidates = {}
+        with self._lock:
+            for variant in _deletes(term, max_distance):
+                for word in self.deletes.get(variant, ()):
+                    if word not in candidates:
+                        candidates[word] = self.frequencies[word]
+        scored = []
+        for word, frequency in candidates.items():
+            distance = edit_distance(term, word, max_distance)
+            if distance is not None:
+                scored.append((distance, -frequency, word))
+        if not scored:
+            return term, False
+        scored.sort()
+        distance, frequency, word = scored[0]
+        rivals = [-f for d, f, _ in scored[1:] if d == distance]
+        if rivals and -frequency < CONFIDENCE_RATIO * max(rivals):
+            return word, False
+        return word, True
+
+    def correct_query(self, query):
+        # Исправленный запрос и признак, что все слова исправлены уверенно
+        terms = tokenize(query)
+        if not terms:
+            return query, False
+        corrected, confident = [], True
+        for term in terms:
+            word, sure = self.correct(term)
+            corrected.append(word)
+            confident = confident and sure
+        return " ".join(corrected), confident
+
+    def build(self, chunk_size=1000):
+        db = SessionLocal()
+        try:
+            stmt = select(Product.id, Product.name, Product.description).execution_options(yield_per=chunk_size)
+            for chunk in db.execute(stmt).partitions():
+                for row in chunk:
+                    self.add(row)
+        finally:
+            db.close()
+        self.ready = True
+
+
+index = SpellIndex()
+
+
+def correct_query(query):
+    # Пока словарь строится, запрос уходит как есть в fuzzy
+    if SPELLING_ENABLED and index.ready:
+        return index.correct_query(query)
+    return query, False
+
+
+def start_build():
+    thread = threading.Thread(target=index.build, daemon=True)
+    thread.start()
+    return thread
@@ -12,32 +12,27 @@ def mock_db():
         mock.return_value = db
         yield db
 
+def suggest_response(*names):
+    options = [{"text": name, "_source": {"name": name}} for name in names]
+    return {"suggest": {"product-suggest": [{"options": options}]}}
+
 @patch('opensearch_client.suggest_products')
 def test_suggest_success(mock_suggest):
-    mock_suggest.return_value = {
-        "hits": {
-            "hits": [
-                {"_source": {"name": "iPhone 15 Pro"}},
-                {"_source": {"name": "iPhone 14"}}
-            ]
-        }
-    }
+    mock_suggest.return_value = suggest_response("iPhone 15 Pro", "iPhone 14")
     response = client.get("/suggest?q=iph")
     assert response.status_code == 200
     assert response.json() == {"suggestions": ["iPhone 15 Pro", "iPhone 14"]}
 
 @patch('opensearch_client.suggest_products')
 def test_suggest_empty(mock_suggest):
-    mock_suggest.return_value = {"hits": {"hits": []}}
+    mock_suggest.return_value = suggest_response()
     response = client.get("/suggest?q=xyz")
     assert response.status_code == 200
     assert response.json() == {"suggestions": []}
 
 @patch('opensearch_client.suggest_products')
 def test_suggest_single_result(mock_suggest):
-    mock_suggest.return_value = {
-        "hits": {"hits": [{"_source": {"name": "MacBook Pro 14"}}]}
-    }
+    mock_suggest.return_value = suggest_response("MacBook Pro 14")
     response = client.get("/suggest?q=mac")
     assert response.status_code == 200
     assert response.json() == {"suggestions": ["MacBook Pro 14"]}
@@ -45,15 +40,9 @@ def test_suggest_single_result(mock_suggest):
 
 @patch('opensearch_client.suggest_products')
 def test_suggest_multiple_results(mock_suggest):
-    mock_suggest.return_value = {
-        "hits": {
-            "hits": [
-                {"_source": {"name": "Samsung Galaxy S24"}},
-                {"_source": {"name": "Samsung Galaxy Watch6"}},
-                {"_source": {"name": "Samsung Galaxy Tab S9"}}
-            ]
-        }
-    }
+    mock_suggest.return_value = suggest_response(
+        "Samsung Galaxy S24", "Samsung Galaxy Watch6", "Samsung Galaxy Tab S9"
+    )
     response = client.get("/suggest?q=samsung")
     assert response.status_code == 200
     suggestions = response.json()["suggestions"]
@@ -83,14 +72,21 @@ def test_search_with_filters(mock_search):
     }
     response = client.get("/search?category=Смартфоны&min_price=50000&max_price=150000")
     assert response.status_code == 200
-    mock_search.assert_called_once_with(None, "Смартфоны", 50000.0, 150000.0)
+    mock_search.assert_called_once_with(
+        None, "Смартфоны", 50000.0, 150000.0, cursor=None, page_size=20, use_pit=False,
+        fields=("id", "name", "description", "price", "category", "popularity")
+    )
 
 @patch('opensearch_client.index_product')
 def test_create_product(mock_index, mock_db):
+    from database import get_db, Product, SearchOutbox
     mock_db_instance = MagicMock()
-    mock_db.return_value.__enter__.return_value = mock_db_instance
+    added = []
+    mock_db_instance.add.side_effect = added.append
+    mock_db_instance.flush.side_effect = lambda: setattr(added[0], "id", 1)
     
-    with patch('main.get_db', return_value=iter([mock_db_instance])):
+    app.dependency_overrides[get_db] = lambda: mock_db_instance
+    try:
         product_data = {
             "name": "Test Product",
             "description": "Test Description",
@@ -99,8 +95,15 @@ def test_create_product(mock_index, mock_db):
             "popularity": 50
         }
         response = client.post("/products", json=product_data)
-        assert response.status_code == 200
-        assert mock_index.called
+    finally:
+        app.dependency_overrides.clear()
+    assert response.status_code == 200
+    assert response.json()["id"] == 1
+    # Товар и запись outbox уходят одним коммитом, OpenSearch в запросе не вызывается
+    assert isinstance(added[0], Product)
+    assert isinstance(added[1], SearchOutbox) and added[1].product_id == 1
+    mock_db_instance.commit.assert_called_once()
+    assert not mock_index.called
 
 def test_get_product_not_found(mock_db):
     mock_db_instance = MagicMock()
@@ -110,3 +113,703 @@ def test_get_product_not_found(mock_db):
         response = client.get("/products/999")
         assert response.status_code == 404
         assert response.json()["detail"] == "Product not found"
+
+@patch('opensearch_client.client')
+def test_bulk_index_products_reports_failed_ids(mock_client):
+    from types import SimpleNamespace
+    import opensearch_client as os_client
+    products = [
+        SimpleNamespace(id=1, name="iPhone", description="Смартфон", price=1000.0, category="Смартфоны", popularity=10),
+        SimpleNamespace(id=2, name="iPad", description="Планшет", price=2000.0, category="Планшеты", popularity=5)
+    ]
+    mock_client.bulk.return_value = {
+        "errors": True,
+        "items": [
+            {"index": {"_id": "1", "status": 201}},
+            {"index": {"_id": "2", "status": 400, "error": {"type": "mapper_parsing_exception"}}}
+        ]
+    }
+    indexed, errors = os_client.bulk_index_products(products)
+    assert indexed == 1
+    assert errors == [{"id": "2", "error": {"type": "mapper_parsing_exception"}}]
+    body = mock_client.bulk.call_args.kwargs["body"]
+    assert len(body) == 4
+    assert body[0] == {"index": {"_index": "products", "_id": 1}}
+    assert "refresh" not in mock_client.bulk.call_args.kwargs
+    os_client.bulk_index_products(products, refresh="wait_for")
+    assert mock_client.bulk.call_args.kwargs["refresh"] == "wait_for"
+
+def test_async_search_uses_shared_async_client():
+    from unittest.mock import AsyncMock
+    from fastapi import FastAPI
+    import async_search
+    async_app = FastAPI()
+    async_app.include_router(async_search.router)
+    async_app.state.async_os = MagicMock()
+    async_app.state.async_os.search = AsyncMock(return_value={
+        "hits": {"hits": [{"_source": {"id": 1, "name": "iPhone"}}], "total": {"value": 1}},
+        "aggregations": {}
+    })
+    response = TestClient(async_app).get("/search?q=iphone-async&category=Смартфоны")
+    assert response.status_code == 200
+    assert response.json()["total"] == 1
+    assert response.json()["aggregations"] == {}
+    body = async_app.state.async_os.search.call_args.kwargs["body"]
+    assert body["query"]["bool"]["filter"] == [{"term": {"category": "Смартфоны"}}]
+
+def test_search_cache_coalesces_concurrent_misses():
+    import threading
+    from search_cache import SearchCache, make_key
+    cache = SearchCache(max_entries=10, max_bytes=10000, ttl=60)
+    release = threading.Event()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        release.wait(5)
+        return {"hits": {"hits": [], "total": {"value": 0}}}
+
+    key = make_key("  iPhone ", "Смартфоны", None, None)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load(key, loader))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    import time
+    deadline = time.monotonic() + 5
+    while cache.counters["coalesced"] < 4 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    coalesced = cache.counters["coalesced"]
+    release.set()
+    for t in threads:
+        t.join(5)
+
+    assert coalesced == 4
+    assert len(calls) == 1
+    assert len(results) == 5
+    assert cache.get_or_load(make_key("iphone", "Смартфоны"), loader) is results[0]
+    assert cache.stats()["hits"] == 1
+
+def test_search_cache_lru_eviction_and_product_invalidation():
+    from types import SimpleNamespace
+    from search_cache import SearchCache, make_key
+    cache = SearchCache(max_entries=2, max_bytes=10000, ttl=60)
+    cache.get_or_load(make_key("a", "Смартфоны"), lambda: {"v": 1})
+    cache.get_or_load(make_key("b", "Ноутбуки"), lambda: {"v": 2})
+    cache.get_or_load(make_key("c", None, 1000, 5000), lambda: {"v": 3})
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["entries"] == 2
+
+    cache.invalidate_product(SimpleNamespace(category="Ноутбуки", price=100000))
+    assert cache.stats()["entries"] == 1
+    assert cache.get_or_load(make_key("c", None, 1000, 5000), lambda: {"v": 4}) == {"v": 3}
+
+@patch('opensearch_client.bulk_index_products')
+def test_outbox_drain_batch_retries_failed_products(mock_bulk):
+    from types import SimpleNamespace
+    import outbox_worker
+    rows = [
+        SimpleNamespace(product_id=1, attempts=0, last_error=None, available_at=None),
+        SimpleNamespace(product_id=1, attempts=0, last_error=None, available_at=None),
+        SimpleNamespace(product_id=2, attempts=0, last_error=None, available_at=None)
+    ]
+    products = [
+        SimpleNamespace(id=1, name="Outbox A", description="", category="Test", price=10.0, popularity=1),
+        SimpleNamespace(id=2, name="Outbox B", description="", category="Test", price=20.0, popularity=1)
+    ]
+    mock_bulk.return_value = (1, [{"id": "2", "error": "timeout"}])
+    db = MagicMock()
+    with patch('outbox_worker._claim_batch', return_value=rows), \
+         patch('outbox_worker._load_products', return_value=products):
+        assert outbox_worker.drain_batch(db, batch_size=10) == 3
+    mock_bulk.assert_called_once_with(products, refresh="wait_for")
+    assert db.delete.call_count == 2
+    assert rows[2].attempts == 1 and rows[2].last_error == "timeout"
+    assert "now()" in str(rows[2].available_at.compile())
+    db.commit.assert_called_once()
+
+@patch('opensearch_client.client')
+def test_search_cursor_pagination_with_pit(mock_client):
+    import opensearch_client as os_client
+    mock_client.create_pit.return_value = {"pit_id": "pit-1"}
+    mock_client.search.return_value = {
+        "pit_id": "pit-2",
+        "hits": {
+            "hits": [
+                {"_source": {"id": 1}, "sort": [2.5, 1]},
+                {"_source": {"id": 2}, "sort": [1.5, 2]}
+            ],
+            "total": {"value": 5}
+        }
+    }
+    response = client.get("/search?q=iphone&page_size=2&pit=true")
+    assert response.status_code == 200
+    cursor = response.json()["next_cursor"]
+    assert os_client.decode_cursor(cursor) == {"sa": [1.5, 2], "pit": "pit-2"}
+    body = mock_client.search.call_args.kwargs["body"]
+    assert body["pit"]["id"] == "pit-1"
+    assert body["sort"] == [{"_score": "desc"}, {"id": "asc"}]
+
+    mock_client.search.return_value = {"hits": {"hits": [{"_source": {"id": 3}, "sort": [1.0, 3]}], "total": {"value": 5}}}
+    response = client.get(f"/search?q=iphone&page_size=2&cursor={cursor}")
+    assert response.json()["next_cursor"] is None
+    body = mock_client.search.call_args.kwargs["body"]
+    assert body["search_after"] == [1.5, 2]
+    assert body["pit"]["id"] == "pit-2"
+    mock_client.delete_pit.assert_called_once_with(body={"pit_id": ["pit-2"]})
+
+def test_search_rejects_invalid_cursor():
+    response = client.get("/search?q=iphone&cursor=not-a-cursor")
+    assert response.status_code == 400
+
+    import base64
+    import json
+    for state in ({"sa": [1.5]}, {"sa": [1.5, "2"]}, {"sa": [True, 2]}, {"sa": [1.5, 2], "pit": 7}, ["sa"]):
+        cursor = base64.urlsafe_b64encode(json.dumps(state).encode()).decode()
+        assert client.get(f"/search?q=iphone&cursor={cursor}").status_code == 400
+
+@patch('opensearch_client.client')
+def test_search_facets_are_opt_in_and_cached_separately(mock_client):
+    hits_response = {"hits": {"hits": [], "total": {"value": 0}}}
+    facets_response = {"hits": {"hits": []}, "aggregations": {"price_ranges": {"buckets": []}}}
+    mock_client.search.side_effect = lambda index, body, **kwargs: facets_response if body["size"] == 0 else hits_response
+
+    response = client.get("/search?q=facets-test")
+    assert response.json()["aggregations"] == {}
+    assert mock_client.search.call_count == 1
+
+    response = client.get("/search?q=facets-test&page_size=5&facets=price&price_buckets=500,100")
+    data = response.json()
+    assert data["aggregations"] == {"price_ranges": {"buckets": []}}
+    assert set(data["timings"]) == {"hits_ms", "aggs_ms"}
+    facets_body = mock_client.search.call_args_list[-1].kwargs["body"]
+    assert "categories" not in facets_body["aggs"]
+    assert facets_body["aggs"]["price_ranges"]["range"]["ranges"] == [
+        {"to": 100.0}, {"from": 100.0, "to": 500.0}, {"from": 500.0}
+    ]
+
+    # Другая страница выдачи - те же фасеты из кэша
+    calls = mock_client.search.call_count
+    client.get("/search?q=facets-test&page_size=7&facets=price&price_buckets=100,500")
+    assert mock_client.search.call_count == calls + 1
+
+def test_search_rejects_unknown_facet():
+    response = client.get("/search?q=iphone&facets=brand")
+    assert response.status_code == 400
+
+@patch('opensearch_client.client')
+def test_suggest_uses_weighted_completion_suggester(mock_client):
+    mock_client.search.return_value = suggest_response("Samsung Galaxy S24", "Samsung Galaxy S24", "Galaxy Tab")
+    response = client.get("/suggest?q=gal")
+    assert response.json() == {"suggestions": ["Samsung Galaxy S24", "Galaxy Tab"]}
+    body = mock_client.search.call_args.kwargs["body"]
+    assert body["suggest"]["product-suggest"]["completion"]["field"] == "suggest"
+
+def test_prefix_index_ranks_by_popularity_and_updates():
+    from prefix_index import PrefixIndex
+    index = PrefixIndex()
+    index.add(1, "Samsung Galaxy S24", 95)
+    index.add(2, "Samsung Galaxy Watch6", 75)
+    index.add(3, "Sony WH-1000XM5", 88)
+    index.add(4, "Galaxy Tab S9", 70)
+    assert index.suggest("s") == ["Samsung Galaxy S24", "Sony WH-1000XM5", "Samsung Galaxy Watch6", "Galaxy Tab S9"]
+    assert index.suggest("GALAXY") == ["Samsung Galaxy S24", "Samsung Galaxy Watch6", "Galaxy Tab S9"]
+    assert index.suggest("samsung galaxy w") == ["Samsung Galaxy Watch6"]
+    assert index.suggest("xyz") == []
+
+    index.add(2, "Samsung Galaxy Watch7", 100)
+    assert index.suggest("samsung") == ["Samsung Galaxy Watch7", "Samsung Galaxy S24"]
+    assert index.suggest("watch6") == []
+
+def test_local_index_bm25_ranking_and_filters():
+    from types import SimpleNamespace
+    from local_index import LocalIndex
+    index = LocalIndex()
+    products = [
+        (1, "Смартфон Samsung Galaxy", "Флагманский смартфон", 90000.0, "Смартфоны"),
+        (2, "Чехол для смартфона", "Подходит для Samsung Galaxy", 1500.0, "Аксессуары"),
+        (3, "Ноутбук ASUS", "Игровой ноутбук", 120000.0, "Ноутбуки"),
+    ]
+    for id, name, description, price, category in products:
+        index.add(SimpleNamespace(id=id, name=name, description=description, price=price,
+                                  category=category, popularity=0))
+    hits = index.search("samsung galaxy")["hits"]["hits"]
+    assert [hit["_source"]["id"] for hit in hits] == [1, 2]
+    assert index.search("samsung", max_price=5000)["hits"]["total"]["value"] == 1
+    assert index.search(None, category="Ноутбуки")["hits"]["hits"][0]["_id"] == "3"
+
+    first = index.search("samsung", page_size=1)["hits"]["hits"]
+    rest = index.search("samsung", page_size=1, search_after=first[0]["sort"])["hits"]["hits"]
+    assert [first[0]["_id"], rest[0]["_id"]] == ["1", "2"]
+
+    facets = index.facets("samsung", facets=["categories"])
+    assert facets["categories"]["buckets"] == [{"key": "Аксессуары", "doc_count": 1}, {"key": "Смартфоны", "doc_count": 1}]
+
+@patch('opensearch_client.client')
+def test_search_falls_back_to_local_index_when_circuit_opens(mock_client):
+    from types import SimpleNamespace
+    from opensearchpy import ConnectionError as OpenSearchConnectionError
+    import local_index
+    import opensearch_client
+    mock_client.search.side_effect = OpenSearchConnectionError("N/A", "connection refused", None)
+    with patch.object(opensearch_client, "breaker", opensearch_client.CircuitBreaker(failure_threshold=2)), \
+            patch.object(local_index, "index", local_index.LocalIndex()):
+        local_index.index.add(SimpleNamespace(id=7, name="Резервный Наушники", description="", price=5000.0,
+                                              category="Аудио", popularity=0))
+        assert client.get("/search?q=резервный").status_code == 503
+
+        local_index.index.ready = True
+        response = client.get("/search?q=резервный наушники")
+        assert response.status_code == 200
+        assert response.headers["X-Search-Engine"] == "local"
+        assert response.json()["hits"][0]["id"] == 7
+        assert opensearch_client.breaker.state == "open"
+
+        # Пока автомат разомкнут, OpenSearch не опрашивается
+        calls = mock_client.search.call_count
+        client.get("/search?q=резервный наушники 2")
+        assert mock_client.search.call_count == calls
+        assert client.get("/search/health").json()["opensearch"] == "open"
+
+def test_direct_search_orm_uses_search_vector_index():
+    from database import get_db, engine
+    mock_db_instance = MagicMock()
+    mock_db_instance.execute.return_value = [(1, "iPhone 15 Pro", "Смартфон Apple", 119990.0, "Смартфоны")]
+    app.dependency_overrides[get_db] = lambda: mock_db_instance
+    try:
+        response = client.get("/direct-search-orm?q=iphone -pro&limit=5")
+    finally:
+        app.dependency_overrides.clear()
+    assert response.status_code == 200
+    assert response.json()["hits"][0]["name"] == "iPhone 15 Pro"
+    # time_ms - фазы запроса из metrics, а не отдельный замер в обработчике
+    assert "serialization;dur=" in response.headers["Server-Timing"]
+    assert response.json()["time_ms"] >= 0
+    compiled = mock_db_instance.execute.call_args.args[0].compile(engine)
+    assert "products.search_vector @@ websearch_to_tsquery" in str(compiled)
+    assert "ORDER BY ts_rank_cd" in str(compiled)
+    assert compiled.params["param_1"] == 5
+
+@patch('opensearch_client.client')
+def test_swap_alias_is_atomic_for_versioned_and_legacy_indices(mock_client):
+    import opensearch_client
+    mock_client.indices.exists_alias.return_value = True
+    mock_client.indices.get_alias.return_value = {"products_v1": {"aliases": {"products": {}}}}
+    assert opensearch_client.swap_alias("products_v2") == ["products_v1"]
+    mock_client.indices.update_aliases.assert_called_once_with(body={"actions": [
+        {"add": {"index": "products_v2", "alias": "products"}},
+        {"remove": {"index": "products_v1", "alias": "products"}}
+    ]})
+
+    # products - конкретный индекс старой схемы
+    mock_client.reset_mock()
+    mock_client.indices.exists_alias.return_value = False
+    mock_client.indices.exists.return_value = True
+    assert opensearch_client.swap_alias("products_v1") == []
+    mock_client.indices.update_aliases.assert_called_once_with(body={"actions": [
+        {"add": {"index": "products_v1", "alias": "products"}},
+        {"remove_index": {"index": "products"}}
+    ]})
+
+    mock_client.indices.get.return_value = {"products_v1": {}, "products_v7": {}, "products_v2_old": {}}
+    assert opensearch_client.next_index_version() == 8
+
+def test_hybrid_fusion_ranks_documents_found_by_both_engines_first():
+    from hybrid import fuse
+    hits = fuse({
+        "opensearch": [{"id": 1, "name": "A"}, {"id": 2, "name": "B"}, {"id": 3, "name": "C"}],
+        "postgres": [{"id": 3, "name": "C"}, {"id": 4, "name": "D"}],
+    }, limit=4, k=60)
+    assert [hit["id"] for hit in hits] == [3, 1, 2, 4]
+    assert hits[0]["ranks"] == {"opensearch": 3, "postgres": 1}
+
+@patch('hybrid.postgres_hits')
+@patch('hybrid.opensearch_hits')
+def test_hybrid_search_returns_partial_results_after_deadline(mock_opensearch, mock_postgres):
+    import time
+    mock_opensearch.return_value = [{"id": 1, "name": "iPhone 15 Pro"}]
+    mock_postgres.side_effect = lambda q, limit, deadline: time.sleep(0.5) or []
+    with patch('hybrid.HYBRID_DEADLINE', 0.05):
+        response = client.get("/hybrid-search?q=iphone")
+    data = response.json()
+    assert response.status_code == 200
+    assert data["engines"] == {"opensearch": "ok", "postgres": "timeout"}
+    assert data["partial"] is True
+    assert [hit["id"] for hit in data["hits"]] == [1]
+    assert data["time_ms"] < 400
+
+    mock_opensearch.side_effect = RuntimeError("down")
+    mock_postgres.side_effect = RuntimeError("down")
+    assert client.get("/hybrid-search?q=iphone").status_code == 503
+
+@patch('opensearch_client.client')
+def test_search_batch_runs_single_msearch_and_keeps_order(mock_client):
+    mock_client.msearch.return_value = {"responses": [
+        {"hits": {"hits": [{"_source": {"id": 1, "name": "iPhone 15 Pro"}, "sort": [2.0, 1]}], "total": {"value": 1}}},
+        {"error": {"type": "search_phase_execution_exception", "reason": "all shards failed"}, "status": 400},
+    ]}
+    response = client.post("/search/batch", json={"searches": [
+        {"q": "iphone", "page_size": 1},
+        {"category": "Ноутбуки", "min_price": 100000},
+    ]})
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert results[0]["hits"] == [{"id": 1, "name": "iPhone 15 Pro"}]
+    assert results[0]["next_cursor"] is not None
+    assert results[1] == {"error": "all shards failed", "status": 400}
+    mock_client.msearch.assert_called_once()
+    body = mock_client.msearch.call_args.kwargs["body"]
+    assert body[0] == {"index": "products"} and body[1]["size"] == 1
+    assert body[3]["query"]["bool"]["filter"][0] == {"term": {"category": "Ноутбуки"}}
+
+def test_search_batch_rejects_oversized_batch():
+    from config import MAX_BATCH_SIZE
+    response = client.post("/search/batch", json={"searches": [{"q": "x"}] * (MAX_BATCH_SIZE + 1)})
+    assert response.status_code == 422
+    assert client.post("/search/batch", json={"searches": []}).status_code == 422
+
+class DictSide:
+    # Хранилище id -> hash с интерфейсом сторон reconcile.py
+    def __init__(self, docs):
+        self.docs = docs
+        self.queries = 0
+
+    def bounds(self):
+        return (min(self.docs), max(self.docs)) if self.docs else (None, None)
+
+    def summaries(self, first_id, step, count):
+        self.queries += 1
+        result = {}
+        for id, value in self.docs.items():
+            bucket = (id - first_id) // step
+            if 0 <= bucket < count:
+                total, hash_sum = result.get(bucket, (0, 0))
+                result[bucket] = (total + 1, hash_sum + value)
+        return result
+
+    def hashes(self, first_id, last_id):
+        self.queries += 1
+        return {id: value for id, value in self.docs.items() if first_id <= id <= last_id}
+
+def test_reconcile_bisects_only_mismatching_ranges():
+    from types import SimpleNamespace
+    from database import content_hash
+    from reconcile import find_drift
+    products = {
+        id: content_hash(SimpleNamespace(id=id, name=f"Товар {id}", description=None, price=id * 1.5,
+                                         category="Test", popularity=id % 100))
+        for id in range(1, 100_001)
+    }
+    indexed = dict(products)
+    del indexed[4242]  # не проиндексирован
+    indexed[77_777] += 1  # устаревшая версия документа
+    indexed[100_500] = 1  # удалён из Postgres
+    source, target = DictSide(products), DictSide(indexed)
+    stale, extra = find_drift(source, target, fanout=16, leaf_size=256)
+    assert sorted(stale) == [4242, 77_777]
+    assert extra == [100_500]
+    # 100k документов сверяются за десятки агрегаций вместо полного чтения
+    assert source.queries < 60
+
+def test_generated_catalog_is_deterministic_and_zipfian():
+    from collections import Counter
+    from generate_catalog import generate_products, generate_queries, CATEGORY_NAMES
+    products = generate_products(7, 1, 5000)
+    # Один и тот же товар независимо от того, какой пачкой он сгенерирован
+    assert generate_products(7, 2500, 3) == products[2499:2502]
+    assert generate_products(8, 1, 1) != products[:1]
+    categories = Counter(p.category for p in products)
+    assert categories.most_common(1)[0][0] == CATEGORY_NAMES[0]
+    assert categories[CATEGORY_NAMES[0]] > 3 * categories[CATEGORY_NAMES[-1]]
+    assert Counter(p.popularity for p in products).most_common(1)[0][0] == 1
+
+    queries, typos = generate_queries(7, 500, 5000, typo_rate=0.2)
+    assert queries == generate_queries(7, 500, 5000, typo_rate=0.2)[0]
+    assert 50 < typos < 150
+
+@patch('opensearch_client.client')
+def test_search_fields_are_pushed_down_as_source_includes(mock_client):
+    mock_client.search.return_value = {
+        "hits": {"hits": [{"_source": {"id": 5, "price": 4990.0}, "sort": [1.0, 5]}], "total": {"value": 1}}
+    }
+    response = client.get("/search?q=проекция полей&fields=price")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.json()["hits"] == [{"id": 5, "price": 4990.0}]
+    assert mock_client.search.call_args.kwargs["body"]["_source"] == ["id", "price"]
+
+    # Без fields служебные поля (suggest, content_hash) не запрашиваются
+    client.get("/search?q=проекция полей")
+    assert "suggest" not in mock_client.search.call_args.kwargs["body"]["_source"]
+    assert mock_client.search.call_count == 2
+
+    response = client.get("/search?q=проекция полей&fields=price,secret")
+    assert response.status_code == 400
+
+@patch('opensearch_client.client')
+def test_server_timing_header_and_prometheus_metrics(mock_client):
+    mock_client.search.return_value = {"hits": {"hits": [], "total": {"value": 0}}}
+    response = client.get("/search?q=метрики фаз")
+    timing = response.headers["Server-Timing"]
+    assert "opensearch;dur=" in timing and "serialization;dur=" in timing and "total;dur=" in timing
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = response.text
+    assert 'search_request_duration_seconds_count{endpoint="/search",backend="opensearch"}' in body
+    assert 'search_phase_duration_seconds_bucket{endpoint="/search",backend="opensearch",phase="opensearch",le="+Inf"}' in body
+    assert 'sqlalchemy_pool_checked_out{engine="sync"} 0' in body
+
+def test_spell_index_corrects_typos_by_frequency():
+    from types import SimpleNamespace
+    from spelling import SpellIndex
+    index = SpellIndex(max_distance=2)
+    names = ["Смартфон Samsung Galaxy", "Смартфон Xiaomi", "Наушники Sony", "Samsung Galaxy Watch"]
+    for id, name in enumerate(names, start=1):
+        index.add(SimpleNamespace(id=id, name=name, description=""))
+    assert index.correct_query("самртфон samsumg") == ("смартфон samsung", True)
+    assert index.correct_query("наушнеки sony s9") == ("наушники sony s9", True)
+    assert index.correct("qwertyuiop") == ("qwertyuiop", False)
+
+    # Два кандидата с одинаковым расстоянием и частотой - исправление неуверенное
+    index.add(SimpleNamespace(id=5, name="Galaxa", description=""))
+    index.add(SimpleNamespace(id=4, name="Watch", description=""))
+    assert index.correct("galaxo") == ("galaxa", False)
+
+    # Переименованный товар убирает старые слова из словаря
+    index.add(SimpleNamespace(id=5, name="Планшет", description=""))
+    assert "galaxa" not in index.frequencies
+    assert index.correct("galaxo") == ("galaxy", True)
+
+@patch('opensearch_client.client')
+def test_fuzzy_search_sends_exact_query_when_correction_is_confident(mock_client):
+    from types import SimpleNamespace
+    import spelling
+    mock_client.search.return_value = {
+        "hits": {"hits": [{"_source": {"id": 1, "name": "Наушники Sony"}}], "total": {"value": 1}}
+    }
+    with patch.object(spelling, "index", spelling.SpellIndex()), patch.object(spelling, "SPELLING_ENABLED", True):
+        spelling.index.add(SimpleNamespace(id=1, name="Наушники Sony", description="Беспроводные"))
+        spelling.index.ready = True
+        data = client.get("/fuzzy-search?q=наушнеки беспроводнные").json()
+        assert data["corrected_query"] == "наушники беспроводные"
+        assert data["fuzzy"] is False
+        multi_match = mock_client.search.call_args.kwargs["body"]["query"]["multi_match"]
+        assert multi_match["query"] == "наушники беспроводные"
+        assert "fuzziness" not in multi_match
+
+        data = client.get("/fuzzy-search?q=неизвестноеслово").json()
+        assert data["corrected_query"] is None
+        assert data["fuzzy"] is True
+        assert mock_client.search.call_args.kwargs["body"]["query"]["multi_match"]["fuzziness"] == "AUTO"
+
+@patch('opensearch_client.client')
+def test_search_export_streams_ndjson_pages_from_pit(mock_client):
+    import json
+    import export
+    mock_client.create_pit.return_value = {"pit_id": "pit-export"}
+    mock_client.search.side_effect = [
+        {"hits": {"hits": [{"_source": {"id": i}, "sort": [1.0, i]} for i in (1, 2)]}, "pit_id": "pit-export-2"},
+        {"hits": {"hits": [{"_source": {"id": 3}, "sort": [1.0, 3]}]}}
+    ]
+    chunks = list(export.opensearch_rows("pit-export", "выгрузка", limit=5, chunk_size=2))
+    assert [json.loads(line) for chunk in chunks for line in chunk.splitlines()] == [{"id": 1}, {"id": 2}, {"id": 3}]
+    second = mock_client.search.call_args_list[1].kwargs["body"]
+    assert second["search_after"] == [1.0, 2] and second["pit"]["id"] == "pit-export-2"
+    assert second["size"] == 2
+    mock_client.delete_pit.assert_called_once_with(body={"pit_id": ["pit-export-2"]})
+
+    mock_client.search.side_effect = None
+    mock_client.search.return_value = {"hits": {"hits": [{"_source": {"id": 9}, "sort": [1.0, 9]}]}}
+    response = client.get("/search/export?q=выгрузка&fields=id&limit=1")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert response.text == '{"id":9}\n'
+    assert mock_client.search.call_args.kwargs["body"]["size"] == 1
+    assert client.get("/search/export?q=выгрузка&limit=0").status_code == 422
+
+@patch('export.SessionLocal')
+def test_postgres_export_streams_unranked_rows(mock_session):
+    from database import engine
+    import export
+    db = mock_session.return_value
+    db.execute.return_value.partitions.return_value = [[(1, "A", "", 1.0, "X"), (2, "B", "", 2.0, "X")], [(3, "C", "", 3.0, "X")]]
+    chunks = list(export.postgres_rows("выгрузка", 10, chunk_size=2))
+    assert len(chunks) == 2 and chunks[1].count(b"\n") == 1
+    stmt = db.execute.call_args.args[0]
+    assert stmt.get_execution_options()["yield_per"] == 2
+    compiled = str(stmt.compile(engine))
+    assert "ORDER BY products.id" in compiled and "ts_rank_cd" not in compiled
+    db.close.assert_called_once()
+
+def test_facet_index_matches_local_index_for_filter_only_queries():
+    from types import SimpleNamespace
+    from facet_index import FacetIndex
+    from local_index import LocalIndex
+    facets, local = FacetIndex(), LocalIndex()
+    products = [
+        (1, 90000.0, "Смартфоны"), (2, 1500.0, "Аксессуары"), (3, 1000.0, "Аксессуары"),
+        (4, 5000.0, "Аксессуары"), (5, 120000.0, "Ноутбуки"), (6, 999.0, "Смартфоны")
+    ]
+    for id, price, category in products:
+        product = SimpleNamespace(id=id, name=f"Товар {id}", description="", price=price,
+                                  category=category, popularity=0)
+        facets.add(product)
+        local.add(product)
+    for filters in [{}, {"category": "Аксессуары"}, {"category": "Ноутбуки"}]:
+        assert facets.facets(**filters) == local.facets(None, **filters)
+    # Цена на границе попадает в верхний бакет, как в range-агрегации
+    assert [b["doc_count"] for b in facets.facets(category="Аксессуары")["price_ranges"]["buckets"]] == [0, 2, 1]
+    # Диапазоны, которые не совпадают с бакетами гистограммы, считает OpenSearch
+    assert facets.facets(min_price=1000, max_price=5000) is None
+    assert facets.facets(price_buckets=(1000.0,)) is None
+    assert facets.facets(price_buckets=(1000.0,), facets=["categories"]) == local.facets(None, facets=["categories"])
+
+    # Смена категории и цены переносит товар, опустевшая категория исчезает
+    facets.add(SimpleNamespace(id=5, price=2000.0, category="Аксессуары"))
+    assert [b["key"] for b in facets.facets(facets=["categories"])["categories"]["buckets"]] == ["Аксессуары", "Смартфоны"]
+    assert facets.facets(category="Аксессуары", facets=["categories"])["categories"]["buckets"][0]["doc_count"] == 4
+
+@patch('opensearch_client.client')
+def test_search_without_query_takes_facets_from_memory(mock_client):
+    from types import SimpleNamespace
+    import facet_index
+    mock_client.search.return_value = {"hits": {"hits": [], "total": {"value": 0}}}
+    with patch.object(facet_index, "index", facet_index.FacetIndex()):
+        facet_index.index.add(SimpleNamespace(id=1, price=777.0, category="Фасеты в памяти"))
+        facet_index.index.ready = True
+        data = client.get("/search?category=Фасеты в памяти&facets=categories,price").json()
+    assert data["aggregations"]["categories"]["buckets"] == [{"key": "Фасеты в памяти", "doc_count": 1}]
+    assert data["aggregations"]["price_ranges"]["buckets"][0]["doc_count"] == 1
+    # В OpenSearch ушёл только запрос хитов
+    assert mock_client.search.call_count == 1
+    assert "aggs" not in mock_client.search.call_args.kwargs["body"]
+
+    # С фильтром по цене фасеты считает агрегация OpenSearch
+    mock_client.search.return_value = {"hits": {"hits": [], "total": {"value": 0}}, "aggregations": {"price_ranges": {}}}
+    with patch.object(facet_index, "index", facet_index.FacetIndex()):
+        facet_index.index.ready = True
+        data = client.get("/search?min_price=500&facets=price").json()
+    assert data["aggregations"] == {"price_ranges": {}}
+    assert "aggs" in mock_client.search.call_args.kwargs["body"]
+
+@patch('opensearch_client.bulk_index_products', side_effect=ConnectionError("bulk failed"))
+def test_reindex_chunk_failure_reports_every_product(mock_bulk):
+    from types import SimpleNamespace
+    from reindex import _index_chunk
+    chunk = [SimpleNamespace(id=i) for i in (5, 6, 7)]
+    result = _index_chunk(1, chunk, "products")
+    assert result["indexed"] == 0
+    assert [error["id"] for error in result["errors"]] == [5, 6, 7]
+
+@patch('opensearch_client.client')
+def test_opensearch_4xx_maps_to_client_error_and_reindex_hint(mock_client):
+    from opensearchpy.exceptions import RequestError
+    import opensearch_client
+    mock_client.search.side_effect = RequestError(400, "search_phase_execution_exception", {})
+    mock_client.indices.get_mapping.return_value = {"products_v1": {"mappings": {"properties": {
+        "id": {"type": "integer"}, "name": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
+        "description": {"type": "text"}, "price": {"type": "float"}, "category": {"type": "keyword"},
+        "popularity": {"type": "integer"}
+    }}}}
+    with patch.object(opensearch_client, "stale_mapping_fields", []):
+        response = client.get("/search?q=четырёхсотая ошибка")
+        assert response.status_code == 400
+        assert "search_phase_execution_exception" in response.json()["detail"]
+        assert opensearch_client.breaker.state == "closed"
+
+        assert opensearch_client.check_mapping() == ["content_hash", "name.suggest", "suggest"]
+        response = client.get("/search?q=четырёхсотая ошибка 2")
+        assert response.status_code == 409
+        assert "reindex required" in response.json()["detail"]
+
+@patch('opensearch_client.search_products')
+def test_search_simple_keeps_opensearch_request_errors(mock_search):
+    import opensearch_client
+    mock_search.side_effect = opensearch_client.OpenSearchRequestError(400, "parsing_exception")
+    with patch.object(opensearch_client, "stale_mapping_fields", []):
+        response = client.get("/search-simple?q=bad")
+    assert response.status_code == 400
+    assert "parsing_exception" in response.json()["detail"]
+
+@patch('hybrid.SessionLocal')
+def test_hybrid_postgres_hits_are_ranked_and_bounded_by_deadline(mock_session):
+    import hybrid
+    db = mock_session.return_value
+    db.execute.side_effect = [None, [(1, "A", "", 10.0, "X")]]
+    assert [hit["id"] for hit in hybrid.postgres_hits("ранг", 5, deadline=0.3)] == [1]
+    timeout_call, query_call = db.execute.call_args_list
+    assert timeout_call.args[1] == {"timeout": "300"}
+    assert "ts_rank_cd" in str(query_call.args[0])
+    db.close.assert_called_once()
+
+@patch('hybrid.postgres_hits')
+@patch('hybrid.opensearch_hits')
+def test_hybrid_search_times_out_fast_when_pool_is_full(mock_opensearch, mock_postgres):
+    import threading
+    import time
+    with patch('hybrid._slots', threading.BoundedSemaphore(1)):
+        import hybrid
+        hybrid._slots.acquire()
+        start = time.perf_counter()
+        response = client.get("/hybrid-search?q=переполненный пул")
+        assert time.perf_counter() - start < 0.2
+        hybrid._slots.release()
+    assert response.status_code == 503
+    assert response.json()["detail"] == {"opensearch": "timeout", "postgres": "timeout"}
+    mock_opensearch.assert_not_called()
+
+@patch('opensearch_client.client')
+def test_drop_index_removes_every_version_behind_alias(mock_client):
+    import opensearch_client
+    mock_client.indices.exists_alias.return_value = True
+    mock_client.indices.get_alias.return_value = {"products_v2": {}, "products_v1": {}}
+    assert opensearch_client.drop_index() == ["products_v1", "products_v2"]
+    assert [c.kwargs["index"] for c in mock_client.indices.delete.call_args_list] == ["products_v1", "products_v2"]
+
+def test_opensearch_pool_totals_are_counters_and_omitted_without_client():
+    from queue import LifoQueue
+    from types import SimpleNamespace
+    import metrics
+    pool = SimpleNamespace(pool=LifoQueue(maxsize=2), num_connections=3, num_requests=40)
+    connection = SimpleNamespace(host="http://localhost:9200", pool=pool)
+    opensearch = SimpleNamespace(transport=SimpleNamespace(connection_pool=SimpleNamespace(connections=[connection])))
+    body = metrics.expose({}, opensearch)
+    assert "# TYPE opensearch_pool_requests_total counter" in body
+    assert 'opensearch_pool_connections_created_total{host="http://localhost:9200"} 3' in body
+    assert "# TYPE opensearch_pool_in_use gauge" in body
+    assert "opensearch_pool" not in metrics.expose({}, None)
+
+@patch('opensearch_client.bulk_index_products')
+def test_in_memory_indexes_follow_outbox_not_create_product(mock_bulk):
+    from types import SimpleNamespace
+    import facet_index
+    import outbox_worker
+    rows = [SimpleNamespace(product_id=i, attempts=0, last_error=None, available_at=None) for i in (1, 2)]
+    products = [SimpleNamespace(id=i, name=f"Outbox {i}", description="", category="Фасеты outbox", price=10.0 * i,
+                                popularity=1) for i in (1, 2)]
+    mock_bulk.return_value = (1, [{"id": "2", "error": "timeout"}])
+    with patch.object(facet_index, "index", facet_index.FacetIndex()), \
+            patch.object(outbox_worker, "FACET_INDEX_ENABLED", True), \
+            patch('outbox_worker._claim_batch', return_value=rows), \
+            patch('outbox_worker._load_products', return_value=products):
+        outbox_worker.drain_batch(MagicMock(), batch_size=10)
+        # Товар, не попавший в OpenSearch, не учитывается и в фасетах
+        assert set(facet_index.index.docs) == {1}
+
+@patch('opensearch_client.bulk_index_products', return_value=(1, []))
+def test_outbox_updates_prefix_trie_only_for_trie_backend(mock_bulk):
+    from types import SimpleNamespace
+    import outbox_worker
+    import prefix_index
+    rows = [SimpleNamespace(product_id=1, attempts=0, last_error=None, available_at=None)]
+    products = [SimpleNamespace(id=1, name="Trie", description="", category="Test", price=1.0, popularity=1)]
+    trie = MagicMock()
+    with patch.object(prefix_index, "index", trie), \
+            patch('outbox_worker._claim_batch', return_value=rows), \
+            patch('outbox_worker._load_products', return_value=products):
+        outbox_worker.drain_batch(MagicMock(), batch_size=10)
+        trie.add.assert_not_called()
+        with patch.object(outbox_worker, "SUGGEST_BACKEND", "trie"):
+            outbox_worker.drain_batch(MagicMock(), batch_size=10)
+        trie.add.assert_called_once_with(1, "Trie", 1)
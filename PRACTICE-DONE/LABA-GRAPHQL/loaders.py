@@ -0,0 +1,98 @@
+"""
+DataLoader'ы для связей между GraphQL типами
+
+Этот файл содержит:
+- batch-функции: одна SQL-выборка `= ANY(:ids)` на все ключи, накопленные за тик event loop
+- create_loaders: новый набор DataLoader'ов на каждый GraphQL запрос
+- get_context: context_getter для GraphQLRouter
+
+Без DataLoader запрос
+    messages { author { username } comments { author { username } } }
+выполняет по одному SELECT на каждое сообщение и каждый комментарий (проблема N+1).
+С DataLoader число обращений к БД не зависит от числа сообщений:
+одна выборка на каждый уровень вложенности.
+"""
+
+from collections import defaultdict
+
+from sqlalchemy import text
+from strawberry.dataloader import DataLoader
+
+from database import AsyncSessionLocal
+from models_graphql import UserType, CommentType
+
+# ============================================================================
+# Batch-функции
+# ============================================================================
+
+async def load_users(ids: list[int]) -> list[UserType | None]:
+    """
+    Загрузить пользователей по списку ID одним запросом
+
+    Возвращает список той же длины и в том же порядке, что и ids
+    (None для несуществующих пользователей) - этого требует DataLoader.
+    """
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            text("SELECT * FROM users WHERE id = ANY(:ids)"),
+            {"ids": list(ids)}
+        )
+        users = {row["id"]: UserType(**row) for row in result.mappings()}
+    return [users.get(user_id) for user_id in ids]
+
+
+async def _load_comments_by(column: str, ids: list[int], extra_filter: str = "") -> list[list[CommentType]]:
+    # Общая часть загрузки комментариев, сгруппированных по message_id или parent_comment_id
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            text(f"""
+                SELECT * FROM comments
+                WHERE {column} = ANY(:ids) {extra_filter}
+                ORDER BY created_at, id
+            """),
+            {"ids": list(ids)}
+        )
+        groups = defaultdict(list)
+        for row in result.mappings():
+            groups[row[column]].append(CommentType(**row))
+    return [groups.get(key, []) for key in ids]
+
+
+async def load_comments_by_message(message_ids: list[int]) -> list[list[CommentType]]:
+    """
+    Загрузить комментарии верхнего уровня для списка сообщений одним запросом
+
+    Ответы на комментарии не входят в список - они доступны через CommentType.replies.
+    """
+    return await _load_comments_by("message_id", message_ids, "AND parent_comment_id IS NULL")
+
+
+async def load_replies(parent_ids: list[int]) -> list[list[CommentType]]:
+    """
+    Загрузить ответы для списка комментариев одним запросом
+    """
+    return await _load_comments_by("parent_comment_id", parent_ids)
+
+# ============================================================================
+# Контекст GraphQL запроса
+# ============================================================================
+
+def create_loaders() -> dict[str, DataLoader]:
+    """
+    Создать DataLoader'ы для одного GraphQL запроса
+
+    Кэш DataLoader живёт столько же, сколько запрос: данные не протухают
+    между запросами и не видны другим пользователям.
+    """
+    return {
+        "user_by_id": DataLoader(load_fn=load_users),
+        "comments_by_message_id": DataLoader(load_fn=load_comments_by_message),
+        "replies_by_parent_id": DataLoader(load_fn=load_replies),
+    }
+
+
+async def get_context() -> dict:
+    """
+    context_getter для GraphQLRouter: резолверы получают loaders через info.context["loaders"]
+    """
+    return {"loaders": create_loaders()}
@@ -1,11 +1,15 @@
 from fastapi import FastAPI
 from strawberry.fastapi import GraphQLRouter
 from models_graphql import schema
+from loaders import get_context
+import persisted_queries
+import projection
 
 # Создаем GraphQL роутер с включенным GraphQL IDE (Playground)
 graphql_app = GraphQLRouter(
     schema,
     graphql_ide="graphiql",  # Включает GraphQL Playground для тестирования
+    context_getter=get_context,  # Новые DataLoader'ы на каждый запрос
 )
 
 # Создаем приложение FastAPI
@@ -18,6 +22,9 @@ app = FastAPI(
 # Подключаем GraphQL эндпоинт
 app.include_router(graphql_app, prefix="/graphql")
 
+# Automatic Persisted Queries: клиент может прислать вместо текста запроса его sha256
+app.add_middleware(persisted_queries.PersistedQueriesMiddleware, path="/graphql")
+
 # Health check
 @app.get("/")
 async def root():
@@ -29,6 +36,16 @@ async def root():
         "redoc": "/redoc",
     }
 
+# Сколько колонок читают резолверы по сравнению с SELECT *
+@app.get("/projection-stats")
+async def projection_stats():
+    return projection.snapshot()
+
+# Попадания в кэш разбора/валидации документов и в хранилище APQ
+@app.get("/graphql-cache-stats")
+async def graphql_cache_stats():
+    return persisted_queries.stats()
+
 # Информация об API
 @app.get("/info")
 async def info():
@@ -11,16 +11,21 @@
 import json
 from database import AsyncSessionLocal
 from sqlalchemy import text
-from models_graphql import MessageType
+from models_graphql import MessageType, MessageConnection, MessageEdge, PageInfo
+from pagination import page_size, encode_cursor, decode_message_cursor
+from projection import from_row, select_list
 
 # ============================================================================
 # Read (чтение данных)
 # ============================================================================
 
-async def get_all_messages() -> list[MessageType]:
+async def get_all_messages(columns: list[str] | None = None) -> list[MessageType]:
     """
     Получить все сообщения из БД
     
+    Параметры:
+    - columns: list[str] | None - колонки для SELECT (по выбранным полям запроса); None - все
+    
     Возвращает:
     - list[MessageType]: список всех сообщений, отсортированных по дате создания (новые первыми)
     
@@ -69,18 +74,73 @@ async def get_all_messages() -> list[MessageType]:
     """
     async with AsyncSessionLocal() as session:
         result = await session.execute(
-            text("SELECT * FROM messages ORDER BY created_at DESC")
+            text(f"SELECT {select_list(columns)} FROM messages ORDER BY created_at DESC")
         )
         rows = result.mappings().all()
-        return [MessageType(**row) for row in rows]
+        return [from_row(MessageType, "messages", row) for row in rows]
 
 
-async def get_message_by_id(message_id: int) -> MessageType | None:
+async def get_messages_page(
+    first: int = 20,
+    after: str | None = None,
+    columns: list[str] | None = None
+) -> MessageConnection:
+    """
+    Получить страницу сообщений (новые первыми) по курсору
+    
+    Параметры:
+    - first: int - размер страницы (1..100)
+    - after: str | None - курсор последнего сообщения предыдущей страницы
+    - columns: list[str] | None - колонки для SELECT; должны включать created_at и id (ключ курсора)
+    
+    Возвращает:
+    - MessageConnection: сообщения страницы и pageInfo
+    
+    Примечание:
+    - Keyset-пагинация: WHERE (created_at, id) < (курсор), без OFFSET -
+      любая страница читается по индексу ix_messages_created_at_id
+      (migrations/001_messages_keyset_index.sql) за одинаковое время
+    - Запрашивается first + 1 строка: лишняя строка означает, что есть следующая страница
+    """
+    limit = page_size(first)
+    params = {"limit": limit + 1}
+    where = ""
+    if after:
+        params["created_at"], params["id"] = decode_message_cursor(after)
+        where = "WHERE (created_at, id) < (:created_at, :id)"
+    
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            text(f"""
+                SELECT {select_list(columns)} FROM messages
+                {where}
+                ORDER BY created_at DESC, id DESC
+                LIMIT :limit
+            """),
+            params
+        )
+        rows = result.mappings().all()
+    
+    edges = [
+        MessageEdge(node=from_row(MessageType, "messages", row), cursor=encode_cursor(row["created_at"], row["id"]))
+        for row in rows[:limit]
+    ]
+    return MessageConnection(
+        edges=edges,
+        page_info=PageInfo(
+            has_next_page=len(rows) > limit,
+            end_cursor=edges[-1].cursor if edges else None
+        )
+    )
+
+
+async def get_message_by_id(message_id: int, columns: list[str] | None = None) -> MessageType | None:
     """
     Получить сообщение по ID
     
     Параметры:
     - message_id: int - уникальный идентификатор сообщения
+    - columns: list[str] | None - колонки для SELECT (по выбранным полям запроса); None - все
     
     Возвращает:
     - MessageType если сообщение найдено
@@ -136,11 +196,11 @@ async def get_message_by_id(message_id: int) -> MessageType | None:
     """
     async with AsyncSessionLocal() as session:
         result = await session.execute(
-            text("SELECT * FROM messages WHERE id = :id"),
+            text(f"SELECT {select_list(columns)} FROM messages WHERE id = :id"),
             {"id": message_id}
         )
         row = result.mappings().first()
-        return MessageType(**row) if row else None
+        return from_row(MessageType, "messages", row) if row else None
 
 # ============================================================================
 # Create (создание данных)
@@ -0,0 +1,6 @@
+-- Составной индекс для keyset-пагинации messagesConnection:
+--   WHERE (created_at, id) < (:created_at, :id) ORDER BY created_at DESC, id DESC LIMIT :limit
+-- Страница читается из индекса с позиции курсора, без сортировки и без OFFSET.
+-- usersConnection идёт по первичному ключу users(id) и отдельного индекса не требует.
+-- CONCURRENTLY не блокирует запись в messages, но не выполняется внутри транзакции.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_created_at_id ON messages (created_at DESC, id DESC);
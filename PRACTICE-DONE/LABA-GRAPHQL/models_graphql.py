@@ -13,6 +13,9 @@ from __future__ import annotations  # Отложенные аннотации т
 import strawberry
 from typing import Any
 from datetime import datetime
+from strawberry.types import Info  # Доступ к контексту запроса (DataLoader'ы) в резолверах полей
+import persisted_queries  # Кэш разбора/валидации документов
+import query_cost  # Ограничение глубины и стоимости операций
 from database import AsyncSessionLocal  # Асинхронная сессия для работы с БД
 from sqlalchemy import text  # Для выполнения SQL запросов
 
@@ -59,11 +62,24 @@ class MessageType:
     created_at: datetime  # Дата и время создания сообщения
     updated_at: datetime  # Дата и время последнего обновления
     
-    # Связи с другими типами (разрешаются в резолверах)
-    author: UserType | None = None  # Объект автора сообщения (загружается отдельным запросом)
-    comments: list[CommentType] = strawberry.field(
-        default_factory=list  # Список комментариев к сообщению (по умолчанию пустой)
-    )
+    # Связи с другими типами (разрешаются через DataLoader'ы из loaders.py)
+    @strawberry.field
+    async def author(self, info: Info) -> UserType | None:
+        """
+        Автор сообщения
+
+        Авторы всех сообщений в ответе загружаются одним запросом users.id = ANY(:ids)
+        """
+        return await info.context["loaders"]["user_by_id"].load(self.author_id)
+
+    @strawberry.field
+    async def comments(self, info: Info) -> list[CommentType]:
+        """
+        Комментарии верхнего уровня к сообщению (ответы - в CommentType.replies)
+
+        Комментарии всех сообщений в ответе загружаются одним запросом
+        """
+        return await info.context["loaders"]["comments_by_message_id"].load(self.id)
 
 @strawberry.type
 class CommentType:
@@ -85,12 +101,60 @@ class CommentType:
     updated_at: datetime  # Дата и время последнего обновления
     
     # Связи с другими типами (разрешаются в резолверах)
-    author: UserType | None = None  # Объект автора комментария
     message: MessageType | None = None  # Объект сообщения, к которому относится комментарий
     parent_comment: CommentType | None = None  # Родительский комментарий (если это ответ)
-    replies: list[CommentType] = strawberry.field(
-        default_factory=list  # Список ответов на этот комментарий
-    )
+
+    @strawberry.field
+    async def author(self, info: Info) -> UserType | None:
+        """
+        Автор комментария (через тот же DataLoader, что и MessageType.author)
+        """
+        return await info.context["loaders"]["user_by_id"].load(self.author_id)
+
+    @strawberry.field
+    async def replies(self, info: Info) -> list[CommentType]:
+        """
+        Ответы на комментарий: ответы всех комментариев одного уровня - одним запросом
+        """
+        return await info.context["loaders"]["replies_by_parent_id"].load(self.id)
+
+# ============================================================================
+# Connection Types (постраничная выдача в стиле Relay)
+# ============================================================================
+
+@strawberry.type
+class PageInfo:
+    """
+    Информация о странице connection
+    """
+    has_next_page: bool  # Есть ли строки после последней на странице
+    end_cursor: str | None = None  # Курсор последней строки: передаётся в after для следующей страницы
+
+@strawberry.type
+class MessageEdge:
+    node: MessageType  # Сообщение
+    cursor: str  # Курсор этого сообщения (created_at, id)
+
+@strawberry.type
+class MessageConnection:
+    """
+    Страница сообщений: edges + pageInfo
+    """
+    edges: list[MessageEdge]
+    page_info: PageInfo
+
+@strawberry.type
+class UserEdge:
+    node: UserType  # Пользователь
+    cursor: str  # Курсор этого пользователя (id)
+
+@strawberry.type
+class UserConnection:
+    """
+    Страница пользователей: edges + pageInfo
+    """
+    edges: list[UserEdge]
+    page_info: PageInfo
 
 # ============================================================================
 # GraphQL Input Types (типы для входных данных в мутациях)
@@ -150,7 +214,7 @@ class Query:
         return "Hello, GraphQL!"
     
     @strawberry.field
-    async def messages(self) -> list[MessageType]:
+    async def messages(self, info: Info) -> list[MessageType]:
         """
         Резолвер для получения всех сообщений канала
         
@@ -168,10 +232,45 @@ class Query:
         Возвращает: список объектов MessageType
         """
         from message_resolvers import get_all_messages
-        return await get_all_messages()
+        from projection import columns
+        # SELECT только колонок выбранных полей: JSONB и content не читаются, если не запрошены
+        return await get_all_messages(columns(info, "messages"))
     
     @strawberry.field
-    async def message(self, id: int) -> MessageType | None:
+    async def messages_connection(
+        self,
+        info: Info,
+        first: int = 20,
+        after: str | None = None
+    ) -> MessageConnection:
+        """
+        Постраничная выдача сообщений (новые первыми) по курсору
+        
+        Параметры:
+        - first: int - размер страницы (1..100)
+        - after: str | None - endCursor предыдущей страницы
+        
+        Пример запроса:
+        query {
+          messagesConnection(first: 10) {
+            edges {
+              cursor
+              node { id title createdAt }
+            }
+            pageInfo { hasNextPage endCursor }
+          }
+        }
+        
+        Следующая страница: messagesConnection(first: 10, after: "<endCursor>")
+        """
+        from message_resolvers import get_messages_page
+        from projection import columns
+        return await get_messages_page(
+            first, after, columns(info, "messages", ("edges", "node"), required=("created_at", "id"))
+        )
+    
+    @strawberry.field
+    async def message(self, info: Info, id: int) -> MessageType | None:
         """
         Резолвер для получения одного сообщения по ID
         
@@ -197,10 +296,11 @@ class Query:
         - None если сообщение с указанным ID не существует
         """
         from message_resolvers import get_message_by_id
-        return await get_message_by_id(id)
+        from projection import columns
+        return await get_message_by_id(id, columns(info, "messages"))
     
     @strawberry.field
-    async def users(self) -> list[UserType]:
+    async def users(self, info: Info) -> list[UserType]:
         """
         Резолвер для получения всех пользователей
         
@@ -216,10 +316,32 @@ class Query:
         Возвращает: список объектов UserType
         """
         from user_resolvers import get_all_users
-        return await get_all_users()
+        from projection import columns
+        return await get_all_users(columns(info, "users"))
+    
+    @strawberry.field
+    async def users_connection(self, info: Info, first: int = 20, after: str | None = None) -> UserConnection:
+        """
+        Постраничная выдача пользователей (по возрастанию ID) по курсору
+        
+        Параметры:
+        - first: int - размер страницы (1..100)
+        - after: str | None - endCursor предыдущей страницы
+        
+        Пример запроса:
+        query {
+          usersConnection(first: 5) {
+            edges { node { id username } }
+            pageInfo { hasNextPage endCursor }
+          }
+        }
+        """
+        from user_resolvers import get_users_page
+        from projection import columns
+        return await get_users_page(first, after, columns(info, "users", ("edges", "node")))
     
     @strawberry.field
-    async def user(self, id: int) -> UserType | None:
+    async def user(self, info: Info, id: int) -> UserType | None:
         """
         Резолвер для получения одного пользователя по ID
         
@@ -240,7 +362,8 @@ class Query:
         - None если пользователь с указанным ID не существует
         """
         from user_resolvers import get_user_by_id
-        return await get_user_by_id(id)
+        from projection import columns
+        return await get_user_by_id(id, columns(info, "users"))
 
 # ============================================================================
 # Mutation (мутации для изменения данных)
@@ -457,5 +580,10 @@ class Mutation:
 # Создаем финальную GraphQL схему, объединяя Query и Mutation
 # query=Query - все запросы для чтения данных
 # mutation=Mutation - все мутации для изменения данных
+# extensions - кэш разбора/валидации (persisted_queries.py), ограничение глубины и стоимости (query_cost.py)
 # Схема используется в main.py для создания GraphQL роутера
-schema = strawberry.Schema(query=Query, mutation=Mutation)
+schema = strawberry.Schema(
+    query=Query,
+    mutation=Mutation,
+    extensions=[*persisted_queries.extensions, *query_cost.extensions]
+)
@@ -0,0 +1,56 @@
+"""
+Курсоры для keyset-пагинации (Relay connections)
+
+Курсор - непрозрачная для клиента строка base64 с ключом последней строки страницы:
+- сообщения: (created_at, id)
+- пользователи: (id,)
+
+Следующая страница выбирается условием WHERE (created_at, id) < (:created_at, :id)
+по составному индексу, а не через OFFSET: стоимость не растёт с номером страницы.
+"""
+
+import base64
+import json
+from datetime import datetime
+
+DEFAULT_PAGE_SIZE = 20  # Размер страницы, если first не передан
+MAX_PAGE_SIZE = 100  # Верхняя граница first: защита от выгрузки всей таблицы одним запросом
+
+
+def page_size(first: int) -> int:
+    """
+    Проверить аргумент first и вернуть размер страницы
+    """
+    if first < 1 or first > MAX_PAGE_SIZE:
+        raise ValueError(f"first must be between 1 and {MAX_PAGE_SIZE}")
+    return first
+
+
+def encode_cursor(*values) -> str:
+    """
+    Закодировать ключ строки в курсор; datetime сохраняется в ISO формате
+    """
+    key = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_message_cursor(cursor: str) -> tuple[datetime, int]:
+    """
+    Курсор сообщения -> (created_at, id)
+    """
+    try:
+        created_at, message_id = json.loads(base64.urlsafe_b64decode(cursor))
+        return datetime.fromisoformat(created_at), int(message_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+def decode_user_cursor(cursor: str) -> int:
+    """
+    Курсор пользователя -> id
+    """
+    try:
+        (user_id,) = json.loads(base64.urlsafe_b64decode(cursor))
+        return int(user_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
@@ -0,0 +1,222 @@
+"""
+Кэш разобранных документов и Automatic Persisted Queries (APQ)
+
+Этот файл содержит:
+- extensions: ParserCache и ValidationCache strawberry. Разобранный и проверенный
+  документ переиспользуется для повторяющегося текста запроса (LRU по хешу запроса)
+- QueryStore: LRU sha256 -> текст запроса
+- PersistedQueriesMiddleware: ASGI middleware с протоколом APQ (как у Apollo) перед /graphql
+- stats: попадания в кэши (эндпоинт /graphql-cache-stats)
+
+Протокол APQ:
+1. Клиент отправляет только хеш:
+   {"extensions": {"persistedQuery": {"version": 1, "sha256Hash": "<sha256 текста>"}}, "variables": {...}}
+2. Если хеш неизвестен, сервер отвечает ошибкой PersistedQueryNotFound
+3. Клиент повторяет запрос с полным текстом query и тем же хешем - сервер его запоминает
+Дальше клиент шлёт только хеш: тело запроса - несколько десятков байт вместо полного текста.
+"""
+
+import hashlib
+import json
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode
+
+from strawberry.extensions import ParserCache, ValidationCache
+
+DOCUMENT_CACHE_SIZE = 256  # Разобранных/проверенных документов (клиенты шлют ~40 разных операций)
+PERSISTED_QUERIES_SIZE = 1000  # Запомненных текстов запросов APQ
+PERSISTED_QUERIES_MAX_BYTES = 8 * 1024 * 1024  # Суммарный размер запомненных текстов
+PERSISTED_QUERY_MAX_BYTES = 64 * 1024  # Текст длиннее выполняется, но не запоминается
+
+parser_cache = ParserCache(maxsize=DOCUMENT_CACHE_SIZE)
+validation_cache = ValidationCache(maxsize=DOCUMENT_CACHE_SIZE)
+extensions = [parser_cache, validation_cache]
+
+# ============================================================================
+# Хранилище запросов APQ
+# ============================================================================
+
+class QueryStore:
+    """
+    LRU: sha256 текста запроса -> текст запроса
+
+    Ограничен и числом записей, и суммарным размером текстов в байтах:
+    несколько очень длинных запросов не займут неограниченную память.
+    """
+
+    def __init__(self, maxsize: int = PERSISTED_QUERIES_SIZE, max_bytes: int = PERSISTED_QUERIES_MAX_BYTES):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.queries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sha256: str) -> str | None:
+        query = self.queries.get(sha256)
+        if query is None:
+            self.misses += 1
+            return None
+        self.queries.move_to_end(sha256)
+        self.hits += 1
+        return query
+
+    def put(self, sha256: str, query: str):
+        old = self.queries.pop(sha256, None)
+        if old is not None:
+            self.bytes -= len(old.encode())
+        self.queries[sha256] = query
+        self.bytes += len(query.encode())
+        while len(self.queries) > self.maxsize or self.bytes > self.max_bytes:
+            _, evicted = self.queries.popitem(last=False)
+            self.bytes -= len(evicted.encode())
+
+
+store = QueryStore()
+
+
+def _error(message: str, code: str) -> dict:
+    return {"errors": [{"message": message, "extensions": {"code": code}}]}
+
+
+def resolve(payload: dict) -> tuple[dict, dict | None]:
+    """
+    Применить APQ к телу GraphQL запроса
+
+    Возвращает (тело с текстом query, None) или (None, ответ с ошибкой).
+    Запросы без extensions.persistedQuery проходят без изменений.
+    """
+    extensions = payload.get("extensions") or {}
+    persisted = extensions.get("persistedQuery") if isinstance(extensions, dict) else None
+    if not isinstance(persisted, dict):
+        return payload, None
+    if persisted.get("version") != 1:
+        return None, _error("Unsupported persisted query version", "PERSISTED_QUERY_NOT_SUPPORTED")
+    sha256 = persisted.get("sha256Hash")
+    query = payload.get("query")
+    if query is not None and not isinstance(query, str):
+        return None, _error("query must be a string", "INVALID_PERSISTED_QUERY")
+    if query:
+        encoded = query.encode()
+        if hashlib.sha256(encoded).hexdigest() != sha256:
+            return None, _error("provided sha does not match query", "INVALID_PERSISTED_QUERY")
+        if len(encoded) <= PERSISTED_QUERY_MAX_BYTES:
+            store.put(sha256, query)
+        return payload, None
+    query = store.get(sha256) if isinstance(sha256, str) else None
+    if query is None:
+        return None, _error("PersistedQueryNotFound", "PERSISTED_QUERY_NOT_FOUND")
+    return {**payload, "query": query}, None
+
+# ============================================================================
+# ASGI middleware
+# ============================================================================
+
+class PersistedQueriesMiddleware:
+    """
+    Подставляет текст запроса по хешу до того, как запрос дойдёт до GraphQLRouter
+
+    POST: JSON тело; GET: параметры query/extensions (extensions - JSON строка).
+    Остальные запросы (другие пути, multipart) передаются без изменений.
+    """
+
+    def __init__(self, app, path: str = "/graphql"):
+        self.app = app
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].rstrip("/") != self.path:
+            return await self.app(scope, receive, send)
+        if scope["method"] == "GET":
+            return await self._get(scope, receive, send)
+        headers = dict(scope["headers"])
+        if scope["method"] != "POST" or not headers.get(b"content-type", b"").startswith(b"application/json"):
+            return await self.app(scope, receive, send)
+        return await self._post(scope, receive, send)
+
+    async def _get(self, scope, receive, send):
+        params = dict(parse_qsl(scope["query_string"].decode()))
+        if "extensions" not in params:
+            return await self.app(scope, receive, send)
+        try:
+            payload = {**params, "extensions": json.loads(params["extensions"])}
+        except ValueError:
+            return await self.app(scope, receive, send)
+        payload, error = resolve(payload)
+        if error is not None:
+            return await self._respond(send, error)
+        params["query"] = payload["query"]
+        scope = {**scope, "query_string": urlencode(params).encode()}
+        return await self.app(scope, receive, send)
+
+    async def _post(self, scope, receive, send):
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        body = b"".join(chunks)
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            payload = None
+        if isinstance(payload, dict):
+            payload, error = resolve(payload)
+            if error is not None:
+                return await self._respond(send, error)
+            body = json.dumps(payload).encode()
+            headers = [(k, v) for k, v in scope["headers"] if k != b"content-length"]
+            scope = {**scope, "headers": headers + [(b"content-length", str(len(body)).encode())]}
+
+        sent = False
+
+        async def replay():
+            nonlocal sent
+            if sent:
+                return await receive()
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        return await self.app(scope, replay, send)
+
+    @staticmethod
+    async def _respond(send, data: dict):
+        # Как Apollo Server: ошибки APQ возвращаются с кодом 200, чтобы клиент повторил запрос с текстом
+        body = json.dumps(data).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+# ============================================================================
+# Статистика
+# ============================================================================
+
+def _rate(hits: int, misses: int) -> float:
+    total = hits + misses
+    return round(hits / total, 3) if total else 0.0
+
+
+def stats() -> dict:
+    """
+    Попадания в кэш разбора, кэш валидации и хранилище APQ
+    """
+    result = {}
+    for name, cached in (
+        ("parser", parser_cache.cached_parse_document),
+        ("validation", validation_cache.cached_validate_document),
+    ):
+        info = cached.cache_info()
+        result[name] = {
+            "hits": info.hits, "misses": info.misses, "size": info.currsize,
+            "maxsize": info.maxsize, "hit_rate": _rate(info.hits, info.misses)
+        }
+    result["persisted_queries"] = {
+        "hits": store.hits, "misses": store.misses, "size": len(store.queries),
+        "maxsize": store.maxsize, "bytes": store.bytes, "max_bytes": store.max_bytes,
+        "hit_rate": _rate(store.hits, store.misses)
+    }
+    return result
@@ -0,0 +1,127 @@
+"""
+Проекция колонок по выбранным в GraphQL запросе полям
+
+Этот файл содержит:
+- COLUMNS: колонки таблиц, соответствующие полям GraphQL типов
+- columns: список колонок для SELECT по info.selected_fields
+- select_list: список колонок для подстановки в SELECT
+- from_row: создание GraphQL типа из неполной строки
+- stats: счётчики выбранных и полных наборов колонок (эндпоинт /projection-stats)
+
+Запрос `messages { id title }` читает только id и title: JSONB (metadata, stats)
+и длинный content не передаются из Postgres и не декодируются.
+"""
+
+import re
+import threading
+
+from strawberry.types.nodes import FragmentSpread, InlineFragment
+
+# Колонки таблиц в порядке полей GraphQL типов (UserType, MessageType, CommentType)
+COLUMNS = {
+    "users": ("id", "username", "profile"),
+    "messages": ("id", "author_id", "title", "content", "metadata", "stats", "created_at", "updated_at"),
+    "comments": (
+        "id", "message_id", "author_id", "parent_comment_id", "content",
+        "metadata", "reactions", "created_at", "updated_at"
+    ),
+}
+
+# Поля-связи, которым нужны колонки для загрузки связанных объектов
+RELATION_COLUMNS = {
+    "author": ("author_id",),  # user_by_id.load(author_id)
+    "comments": ("id",),  # comments_by_message_id.load(id)
+    "replies": ("id",),  # replies_by_parent_id.load(id)
+}
+
+_CAMEL_RE = re.compile(r"(?<!^)(?=[A-Z])")
+
+# ============================================================================
+# Выбор колонок
+# ============================================================================
+
+def _fields(selections):
+    # Поля выборки с раскрытыми фрагментами (...on MessageType, ...MessageFields)
+    for selection in selections:
+        if isinstance(selection, (FragmentSpread, InlineFragment)):
+            yield from _fields(selection.selections)
+        else:
+            yield selection
+
+
+def _child(selections, name):
+    # Вложенная выборка поля name (например edges -> node в connection)
+    return [
+        child
+        for field in _fields(selections) if field.name == name
+        for child in field.selections
+    ]
+
+
+def columns(info, table: str, path: tuple[str, ...] = (), required: tuple[str, ...] = ("id",)) -> list[str]:
+    """
+    Колонки таблицы table, нужные для полей, выбранных в запросе
+
+    Параметры:
+    - info: strawberry Info резолвера
+    - table: ключ COLUMNS
+    - path: путь от поля резолвера до объектов таблицы, например ("edges", "node")
+    - required: колонки, нужные самому резолверу (ключ курсора, id)
+
+    Имена полей GraphQL (camelCase) переводятся в имена колонок (snake_case).
+    Порядок колонок - как в COLUMNS, чтобы одинаковые выборки давали одинаковый SQL.
+    """
+    selections = [child for field in info.selected_fields for child in field.selections]
+    for name in path:
+        selections = _child(selections, name)
+    needed = set(required)
+    for field in _fields(selections):
+        name = _CAMEL_RE.sub("_", field.name).lower()
+        needed.add(name)
+        needed.update(RELATION_COLUMNS.get(name, ()))
+    projected = [column for column in COLUMNS[table] if column in needed]
+    record(table, len(projected))
+    return projected
+
+
+def select_list(columns: list[str] | None) -> str:
+    """
+    Список колонок для SELECT: columns из columns() (только имена из COLUMNS); None - все колонки
+    """
+    return ", ".join(columns) if columns else "*"
+
+
+def from_row(cls, table: str, row):
+    """
+    Создать GraphQL тип из строки, в которой есть только выбранные колонки
+
+    Невыбранные колонки заполняются None: клиент их не запрашивал,
+    поэтому strawberry их не сериализует.
+    """
+    return cls(**{column: row.get(column) for column in COLUMNS[table]})
+
+# ============================================================================
+# Метрика: выбранные колонки против SELECT *
+# ============================================================================
+
+stats = {}  # table -> {"queries", "projected_columns", "full_columns"}
+_lock = threading.Lock()
+
+
+def record(table: str, projected: int):
+    with _lock:
+        table_stats = stats.setdefault(table, {"queries": 0, "projected_columns": 0, "full_columns": 0})
+        table_stats["queries"] += 1
+        table_stats["projected_columns"] += projected
+        table_stats["full_columns"] += len(COLUMNS[table])
+
+
+def snapshot() -> dict:
+    """
+    Счётчики по таблицам и доля прочитанных колонок (1.0 - то же, что SELECT *)
+    """
+    with _lock:
+        return {
+            table: {**values, "ratio": round(values["projected_columns"] / values["full_columns"], 3)}
+            for table, values in stats.items()
+        }
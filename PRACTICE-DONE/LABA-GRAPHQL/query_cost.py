@@ -0,0 +1,209 @@
+"""
+Статическая оценка стоимости GraphQL операций
+
+Этот файл содержит:
+- QueryCostLimiter: расширение схемы, которое до выполнения считает стоимость операции,
+  отклоняет операции дороже MAX_COST и пишет стоимость каждой операции в лог
+- extensions: расширения для strawberry.Schema (стоимость + ограничение глубины)
+
+CommentType рекурсивен (replies, parentComment), а MessageType.comments вкладывает CommentType,
+поэтому один запрос может породить неограниченную работу БД. Стоимость считается по AST запроса
+в единицах "обращение к БД":
+
+    cost(поле из БД) = число выборок * вес + строк загружено / ROWS_PER_COST
+
+- поля Query/Mutation: одна выборка на каждый родительский объект (у корня он один)
+- BATCHED_FIELDS (связи через DataLoader, loaders.py): одна выборка на уровень вложенности,
+  сколько бы строк ни было у родителя - N+1 не возникает и в стоимости не учитывается
+- строк загружено: число родительских объектов * множитель; множитель - аргумент first
+  (или его значение по умолчанию из схемы), для списков без first - LIST_SIZES
+- остальные поля (скаляры, edges/node, pageInfo) обращений к БД не делают: вес 0, FIELD_COSTS переопределяет
+
+Поэтому messages { author comments { author } } стоит 26 (четыре выборки), а
+messages { comments { replies { replies { id } } } } - больше MAX_COST из-за числа загружаемых строк.
+"""
+
+import logging
+import math
+from collections import OrderedDict
+
+from graphql import GraphQLError, ValidationRule, get_named_type, get_nullable_type, is_list_type, is_leaf_type
+from graphql.language import FieldNode, FragmentSpreadNode, InlineFragmentNode, IntValueNode
+from strawberry.extensions import AddValidationRules, QueryDepthLimiter
+
+from pagination import MAX_PAGE_SIZE
+
+logger = logging.getLogger(__name__)
+
+MAX_COST = 1000  # Максимальная стоимость одной операции
+MAX_DEPTH = 10  # Максимальная глубина вложенности полей
+DEFAULT_LIST_SIZE = 10  # Ожидаемое число элементов списка без аргумента first
+ROWS_PER_COST = 100  # Загрузка стольких строк стоит как одно обращение к БД
+COST_CACHE_SIZE = 256  # Документов с запомненной стоимостью (как DOCUMENT_CACHE_SIZE в persisted_queries)
+
+# Веса полей "Тип.поле", если отличаются от правила "выборка из БД - 1, остальное - 0"
+FIELD_COSTS = {}
+
+# Связи, загружаемые DataLoader'ами из loaders.py: одна выборка = ANY(:ids) на уровень вложенности
+BATCHED_FIELDS = {
+    "MessageType.author",
+    "MessageType.comments",
+    "CommentType.author",
+    "CommentType.replies",
+}
+
+# Ожидаемый размер списков без аргумента first
+LIST_SIZES = {
+    "Query.messages": 100,  # Все сообщения канала без пагинации
+    "Query.users": 100,  # Все пользователи без пагинации
+    "MessageConnection.edges": 1,  # Размер страницы уже учтён аргументом first у connection
+    "UserConnection.edges": 1,
+}
+
+# ============================================================================
+# Подсчёт стоимости
+# ============================================================================
+
+def _first(node, field_def):
+    # Значение аргумента first: литерал, значение по умолчанию или худший случай для переменной.
+    # Литерал приводится к 1..MAX_PAGE_SIZE: first: 0 или first: -5 не должны обнулять
+    # (или делать отрицательной) стоимость вложенных полей - такой запрос всё равно отклонит резолвер
+    for argument in node.arguments or ():
+        if argument.name.value == "first":
+            if isinstance(argument.value, IntValueNode):
+                return min(max(int(argument.value.value), 1), MAX_PAGE_SIZE)
+            return MAX_PAGE_SIZE
+    arg_def = field_def.args.get("first")
+    if arg_def is not None and isinstance(arg_def.default_value, int):
+        return arg_def.default_value
+    return None
+
+
+def _selection_cost(context, parent_type, selection_set, rows, fragments_seen):
+    # rows - ожидаемое число объектов parent_type, для которых выполняется выборка
+    if selection_set is None:
+        return 0
+    cost = 0
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            cost += _field_cost(context, parent_type, selection, rows, fragments_seen)
+        elif isinstance(selection, InlineFragmentNode):
+            fragment_type = (
+                context.schema.get_type(selection.type_condition.name.value)
+                if selection.type_condition else parent_type
+            )
+            cost += _selection_cost(context, fragment_type, selection.selection_set, rows, fragments_seen)
+        elif isinstance(selection, FragmentSpreadNode):
+            name = selection.name.value
+            fragment = context.get_fragment(name)
+            # Циклы фрагментов отклонит стандартная валидация; здесь просто не зацикливаемся
+            if fragment is None or name in fragments_seen:
+                continue
+            fragment_type = context.schema.get_type(fragment.type_condition.name.value)
+            cost += _selection_cost(context, fragment_type, fragment.selection_set, rows, fragments_seen | {name})
+    return cost
+
+
+def _field_cost(context, parent_type, node, rows, fragments_seen):
+    name = node.name.value
+    fields = getattr(parent_type, "fields", None)
+    if name.startswith("__") or not fields or name not in fields:
+        # Интроспекция и неизвестные поля (их отклонит стандартная валидация)
+        return 0
+    field_def = fields[name]
+    key = f"{parent_type.name}.{name}"
+    field_type = get_nullable_type(field_def.type)
+    named_type = get_named_type(field_type)
+    if is_leaf_type(named_type):
+        return rows * FIELD_COSTS.get(key, 0)
+
+    multiplier = _first(node, field_def)
+    if multiplier is None:
+        multiplier = LIST_SIZES.get(key, DEFAULT_LIST_SIZE) if is_list_type(field_type) else 1
+    loaded = rows * multiplier
+    schema = context.schema
+    if key in BATCHED_FIELDS or parent_type in (schema.query_type, schema.mutation_type):
+        round_trips = 1 if key in BATCHED_FIELDS else rows
+        cost = round_trips * FIELD_COSTS.get(key, 1) + math.ceil(loaded / ROWS_PER_COST)
+    else:
+        cost = rows * FIELD_COSTS.get(key, 0)
+    return cost + _selection_cost(context, named_type, node.selection_set, loaded, fragments_seen)
+
+
+def operation_cost(context, operation) -> int:
+    """
+    Стоимость операции (query/mutation) по её AST
+    """
+    root_type = context.schema.get_root_type(operation.operation)
+    return _selection_cost(context, root_type, operation.selection_set, 1, frozenset())
+
+# ============================================================================
+# Расширение схемы
+# ============================================================================
+
+# Стоимость операций по документу: ValidationCache не запускает правила валидации
+# для уже проверенного документа, поэтому стоимость запоминается при первой проверке
+# и пишется в лог из QueryCostLimiter на каждой операции
+_costs = OrderedDict()  # DocumentNode -> {имя операции или None: (тип операции, имя, стоимость)}
+
+
+def _remember_cost(document, name, value):
+    _costs.setdefault(document, {})[name] = value
+    _costs.move_to_end(document)
+    if len(_costs) > COST_CACHE_SIZE:
+        _costs.popitem(last=False)
+
+
+def cached_cost(document, operation_name=None):
+    """
+    Запомненная стоимость операции документа: (тип операции, имя, стоимость) или None
+
+    Без operation_name - единственная операция документа (как при выполнении).
+    """
+    costs = _costs.get(document)
+    if not costs:
+        return None
+    if operation_name is None:
+        return next(iter(costs.values())) if len(costs) == 1 else None
+    return costs.get(operation_name)
+
+
+def create_cost_validator(max_cost: int):
+    class CostValidator(ValidationRule):
+        def enter_operation_definition(self, node, *_args):
+            cost = operation_cost(self.context, node)
+            name = node.name.value if node.name else "anonymous"
+            _remember_cost(self.context.document, node.name.value if node.name else None,
+                           (node.operation.value, name, cost))
+            if cost > max_cost:
+                self.report_error(GraphQLError(
+                    f"Operation '{name}' has cost {cost}, which exceeds the maximum allowed cost {max_cost}",
+                    node
+                ))
+
+    return CostValidator
+
+
+class QueryCostLimiter(AddValidationRules):
+    """
+    Отклоняет операции со стоимостью больше max_cost на этапе валидации, до обращения к БД
+    """
+
+    def __init__(self, max_cost: int = MAX_COST):
+        super().__init__([create_cost_validator(max_cost)])
+
+    def on_operation(self):
+        yield from super().on_operation()
+        execution_context = self.execution_context
+        if execution_context.graphql_document is None:
+            return  # Ошибка разбора: стоимость не считалась
+        cost = cached_cost(execution_context.graphql_document, execution_context.operation_name)
+        if cost is not None:
+            # Стоимость каждой операции (и из кэша валидации) - для планирования мощности и подбора MAX_COST
+            logger.info("GraphQL %s %s: cost %s", *cost)
+
+
+extensions = [
+    QueryDepthLimiter(max_depth=MAX_DEPTH),
+    QueryCostLimiter(max_cost=MAX_COST),
+]
@@ -0,0 +1,377 @@
+import asyncio
+import hashlib
+import json
+import logging
+import re
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytest
+from graphql import ValidationRule, parse, validate
+
+import loaders
+import message_resolvers
+import pagination
+import persisted_queries
+import projection
+import query_cost
+import user_resolvers
+from models_graphql import schema
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def mappings(self):
+        return self
+
+    def all(self):
+        return self.rows
+
+    def first(self):
+        return self.rows[0] if self.rows else None
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class FakeSession:
+    """
+    AsyncSessionLocal без Postgres: записывает SQL и отвечает строками из respond(sql, params)
+    """
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.statements = []
+
+    def __call__(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_args):
+        return False
+
+    async def execute(self, statement, params=None):
+        sql = " ".join(str(statement).split())
+        self.statements.append((sql, params))
+        return FakeResult(self.respond(sql, params or {}))
+
+
+def dataset(messages=3, comments_per_message=2):
+    start = datetime(2026, 1, 1)
+    users = [{"id": i, "username": f"user{i}", "profile": {}} for i in range(1, 7)]
+    rows = {"users": users, "messages": [], "comments": []}
+    for m in range(1, messages + 1):
+        rows["messages"].append({
+            "id": m, "author_id": users[m % 3]["id"], "title": f"title {m}", "content": "text",
+            "metadata": {}, "stats": {}, "created_at": start + timedelta(minutes=m), "updated_at": start
+        })
+        for c in range(comments_per_message):
+            rows["comments"].append({
+                "id": m * 100 + c, "message_id": m, "author_id": users[3 + c % 3]["id"], "parent_comment_id": None,
+                "content": "comment", "metadata": {}, "reactions": {}, "created_at": start, "updated_at": start
+            })
+            rows["comments"].append({
+                "id": m * 100 + 50 + c, "message_id": m, "author_id": users[0]["id"],
+                "parent_comment_id": m * 100 + c, "content": "reply", "metadata": {}, "reactions": {},
+                "created_at": start, "updated_at": start
+            })
+    return rows
+
+
+def responder(rows):
+    # Ровно те выборки, которые делают резолверы и DataLoader'ы
+    def respond(sql, params):
+        table = re.search(r"FROM (\w+)", sql).group(1)
+        result = list(rows[table])
+        key = re.search(r"WHERE (\w+) = ANY", sql)
+        if key:
+            result = [row for row in result if row[key.group(1)] in params["ids"]]
+        if "parent_comment_id IS NULL" in sql:
+            result = [row for row in result if row["parent_comment_id"] is None]
+        if "(created_at, id) <" in sql:
+            cursor = (params["created_at"], params["id"])
+            result = [row for row in result if (row["created_at"], row["id"]) < cursor]
+        if "WHERE id > :id" in sql:
+            result = [row for row in result if row["id"] > params["id"]]
+        if "ORDER BY created_at DESC" in sql:
+            result.sort(key=lambda row: (row["created_at"], row["id"]), reverse=True)
+        if "WHERE id = :id" in sql:
+            result = [row for row in result if row["id"] == params["id"]]
+        if "LIMIT :limit" in sql:
+            result = result[:params["limit"]]
+        return result
+
+    return respond
+
+
+@pytest.fixture
+def db():
+    session = FakeSession(responder(dataset()))
+    with patch.object(loaders, "AsyncSessionLocal", session), \
+            patch.object(message_resolvers, "AsyncSessionLocal", session), \
+            patch.object(user_resolvers, "AsyncSessionLocal", session):
+        yield session
+
+
+def execute(query, **kwargs):
+    return asyncio.run(schema.execute(query, context_value={"loaders": loaders.create_loaders()}, **kwargs))
+
+
+def cost(query):
+    costs = []
+
+    class Capture(ValidationRule):
+        def enter_operation_definition(self, node, *_args):
+            costs.append(query_cost.operation_cost(self.context, node))
+
+    validate(schema._schema, parse(query), [Capture])
+    return costs[0]
+
+# ============================================================================
+# Стоимость операций
+# ============================================================================
+
+def test_cost_non_positive_first_is_clamped():
+    page = "{ messagesConnection(first: %s) { edges { node { comments { id } } } } }"
+    assert cost(page % 0) == cost(page % 1)
+    assert cost(page % -5) == cost(page % 1)
+    assert cost(page % 1) > 0
+    assert cost(page % 1000) == cost(page % query_cost.MAX_PAGE_SIZE)
+
+
+def test_batched_relations_charged_once_per_level(db):
+    query = "{ messages { id author { username } comments { id author { username } } } }"
+    # messages, user_by_id, comments_by_message_id, user_by_id: 4 выборки + 100 и 1000 загруженных строк
+    assert cost(query) == 26
+    assert execute(query).errors is None
+
+
+def test_nested_replies_rejected_by_cost_before_database(db):
+    result = execute("{ messages { comments { replies { replies { id } } } } }")
+    assert result.data is None
+    assert "exceeds the maximum allowed cost" in result.errors[0].message
+    assert db.statements == []
+
+
+def test_cost_counts_fragments():
+    inline = "{ messages { comments { replies { replies { id } } } } }"
+    fragment = """
+        { messages { ...Thread } }
+        fragment Thread on MessageType { comments { replies { replies { id } } } }
+    """
+    assert cost(fragment) == cost(inline) > query_cost.MAX_COST
+
+
+def test_depth_limit(db):
+    nested = "replies { " * query_cost.MAX_DEPTH + "id" + " }" * query_cost.MAX_DEPTH
+    result = execute("{ messagesConnection(first: 1) { edges { node { comments { %s } } } } }" % nested)
+    assert result.data is None
+    assert any("exceeds maximum operation depth" in error.message for error in result.errors)
+    assert db.statements == []
+
+
+def test_cost_logged_for_every_operation_with_validation_cache(db, caplog):
+    query = """
+        query CostLogged { messagesConnection(first: 3) { edges { node { id } } } }
+        query Other { users { id } }
+    """
+    caplog.set_level(logging.INFO, logger="query_cost")
+    for _ in range(3):
+        result = execute(query, operation_name="CostLogged")
+        assert result.errors is None
+    logged = [record.getMessage() for record in caplog.records if record.name == "query_cost"]
+    # Вторая и третья операции проходят через ValidationCache без запуска правил валидации
+    assert logged == ["GraphQL query CostLogged: cost 2"] * 3
+
+# ============================================================================
+# DataLoader'ы
+# ============================================================================
+
+@pytest.mark.parametrize("messages", [1, 5, 50])
+def test_loaders_fixed_round_trips(messages):
+    # Авторы комментариев (user4..user6) не совпадают с авторами сообщений:
+    # второй уровень user_by_id не обслуживается из кэша DataLoader
+    session = FakeSession(responder(dataset(messages=messages)))
+    with patch.object(loaders, "AsyncSessionLocal", session), \
+            patch.object(message_resolvers, "AsyncSessionLocal", session):
+        result = execute("{ messages { id author { username } comments { id author { username } } } }")
+    assert result.errors is None
+    assert len(result.data["messages"]) == messages
+    assert result.data["messages"][-1]["comments"][0]["author"]["username"] == "user4"
+    # messages + авторы сообщений + комментарии + авторы комментариев (второй уровень user_by_id)
+    assert len(session.statements) == 4
+    assert sum("= ANY(:ids)" in sql for sql, _ in session.statements) == 3
+
+
+def test_replies_batched_per_level(db):
+    result = execute("{ message(id: 1) { comments { replies { replies { id } } } } }")
+    assert result.errors is None
+    assert [sql.split(" WHERE ")[-1].split(" =")[0] for sql, _ in db.statements[1:]] == [
+        "message_id", "parent_comment_id", "parent_comment_id"
+    ]
+
+
+def test_loaders_return_results_in_key_order(db):
+    users = asyncio.run(loaders.load_users([3, 42, 1]))
+    assert [user and user.id for user in users] == [3, None, 1]
+    comments = asyncio.run(loaders.load_comments_by_message([2, 42]))
+    assert [[comment.id for comment in group] for group in comments] == [[200, 201], []]
+
+# ============================================================================
+# Keyset-пагинация
+# ============================================================================
+
+def test_cursor_round_trip():
+    created_at = datetime(2026, 1, 15, 10, 30)
+    assert pagination.decode_message_cursor(pagination.encode_cursor(created_at, 7)) == (created_at, 7)
+    assert pagination.decode_user_cursor(pagination.encode_cursor(7)) == 7
+    for cursor in ("not-base64!", pagination.encode_cursor(7), pagination.encode_cursor("x", "y")):
+        with pytest.raises(ValueError):
+            pagination.decode_message_cursor(cursor)
+
+
+def test_messages_connection_pages(db):
+    query = """
+        query Page($after: String) {
+          messagesConnection(first: 2, after: $after) {
+            edges { cursor node { id } }
+            pageInfo { hasNextPage endCursor }
+          }
+        }
+    """
+    first = execute(query).data["messagesConnection"]
+    assert [edge["node"]["id"] for edge in first["edges"]] == [3, 2]
+    assert first["pageInfo"] == {"hasNextPage": True, "endCursor": first["edges"][-1]["cursor"]}
+
+    second = execute(query, variable_values={"after": first["pageInfo"]["endCursor"]}).data["messagesConnection"]
+    assert [edge["node"]["id"] for edge in second["edges"]] == [1]
+    assert second["pageInfo"]["hasNextPage"] is False
+    sql, params = db.statements[-1]
+    assert "WHERE (created_at, id) < (:created_at, :id)" in sql and "OFFSET" not in sql
+    assert (params["created_at"], params["id"], params["limit"]) == (datetime(2026, 1, 1, 0, 2), 2, 3)
+
+
+def test_connection_rejects_bad_arguments(db):
+    result = execute('{ messagesConnection(first: 1, after: "garbage") { edges { cursor } } }')
+    assert result.errors[0].message == "Invalid cursor"
+    result = execute("{ usersConnection(first: 101) { edges { cursor } } }")
+    assert "first must be between 1" in result.errors[0].message
+    assert db.statements == []
+
+
+def test_users_connection_pages(db):
+    query = "{ usersConnection(first: 2, after: %s) { edges { node { id } } pageInfo { hasNextPage } } }"
+    page = execute(query % '"%s"' % pagination.encode_cursor(1)).data["usersConnection"]
+    assert [edge["node"]["id"] for edge in page["edges"]] == [2, 3]
+    assert page["pageInfo"]["hasNextPage"] is True
+    assert "WHERE id > :id ORDER BY id" in db.statements[-1][0]
+
+# ============================================================================
+# Проекция колонок
+# ============================================================================
+
+def test_projection_selects_only_requested_columns(db):
+    result = execute("{ messages { id title author { username } } }")
+    assert result.errors is None
+    assert db.statements[0][0].startswith("SELECT id, author_id, title FROM messages")
+
+
+def test_projection_connection_keeps_cursor_columns(db):
+    execute("""
+        { messagesConnection(first: 1) { edges { node { ...Fields } } } }
+        fragment Fields on MessageType { updatedAt }
+    """)
+    assert db.statements[0][0].startswith("SELECT id, created_at, updated_at FROM messages")
+
+
+def test_projection_stats(db):
+    with patch.object(projection, "stats", {}):
+        execute("{ users { id } }")
+        assert projection.snapshot() == {"users": {"queries": 1, "projected_columns": 1, "full_columns": 3, "ratio": 0.333}}
+
+# ============================================================================
+# Automatic Persisted Queries
+# ============================================================================
+
+@pytest.fixture
+def client(db):
+    from fastapi.testclient import TestClient
+    from main import app
+    with patch.object(persisted_queries, "store", persisted_queries.QueryStore()):
+        yield TestClient(app)
+
+
+def test_persisted_query_miss_register_hit(client):
+    query = "{ users { id username } }"
+    sha256 = hashlib.sha256(query.encode()).hexdigest()
+    extensions = {"persistedQuery": {"version": 1, "sha256Hash": sha256}}
+
+    miss = client.post("/graphql", json={"extensions": extensions})
+    assert miss.status_code == 200
+    assert miss.json()["errors"][0]["extensions"]["code"] == "PERSISTED_QUERY_NOT_FOUND"
+
+    registered = client.post("/graphql", json={"query": query, "extensions": extensions})
+    assert registered.json()["data"]["users"][0] == {"id": 1, "username": "user1"}
+
+    hit = client.post("/graphql", json={"extensions": extensions})
+    assert hit.json() == registered.json()
+    get = client.get("/graphql", params={"extensions": json.dumps(extensions)})
+    assert get.json() == registered.json()
+
+    stats = client.get("/graphql-cache-stats").json()
+    assert stats["persisted_queries"] == {
+        "hits": 2, "misses": 1, "size": 1, "maxsize": 1000, "bytes": len(query),
+        "max_bytes": persisted_queries.PERSISTED_QUERIES_MAX_BYTES, "hit_rate": 0.667
+    }
+    assert stats["parser"]["hits"] >= 2
+
+
+def test_persisted_query_hash_mismatch(client):
+    response = client.post("/graphql", json={
+        "query": "{ users { id } }",
+        "extensions": {"persistedQuery": {"version": 1, "sha256Hash": "0" * 64}},
+    })
+    assert response.json()["errors"][0]["extensions"]["code"] == "INVALID_PERSISTED_QUERY"
+    assert persisted_queries.store.queries == {}
+
+
+def test_query_store_evicts_least_recently_used():
+    store = persisted_queries.QueryStore(maxsize=2)
+    store.put("a", "{ a }")
+    store.put("b", "{ b }")
+    store.get("a")
+    store.put("c", "{ c }")
+    assert list(store.queries) == ["a", "c"]
+
+
+def test_persisted_query_rejects_non_string_query(client):
+    for query in (42, {"query": "{ users { id } }"}):
+        response = client.post("/graphql", json={
+            "query": query,
+            "extensions": {"persistedQuery": {"version": 1, "sha256Hash": "0" * 64}},
+        })
+        assert response.status_code == 200
+        assert response.json()["errors"][0]["extensions"]["code"] == "INVALID_PERSISTED_QUERY"
+
+
+def test_persisted_query_too_large_is_executed_but_not_stored(client):
+    query = "{ users { id } }" + " " * persisted_queries.PERSISTED_QUERY_MAX_BYTES
+    sha256 = hashlib.sha256(query.encode()).hexdigest()
+    response = client.post("/graphql", json={
+        "query": query, "extensions": {"persistedQuery": {"version": 1, "sha256Hash": sha256}}
+    })
+    assert response.json()["data"]["users"][0] == {"id": 1}
+    assert persisted_queries.store.queries == {}
+
+
+def test_query_store_bounded_by_bytes():
+    store = persisted_queries.QueryStore(maxsize=10, max_bytes=10)
+    store.put("a", "{ a }")
+    store.put("b", "{ bb }")
+    assert list(store.queries) == ["b"] and store.bytes == 6
+    store.put("b", "{ b }")
+    assert store.bytes == 5
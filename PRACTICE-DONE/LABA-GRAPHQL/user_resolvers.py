@@ -11,16 +11,21 @@
 import json
 from database import AsyncSessionLocal
 from sqlalchemy import text
-from models_graphql import UserType
+from models_graphql import UserType, UserConnection, UserEdge, PageInfo
+from pagination import page_size, encode_cursor, decode_user_cursor
+from projection import from_row, select_list
 
 # ============================================================================
 # Read (чтение данных)
 # ============================================================================
 
-async def get_all_users() -> list[UserType]:
+async def get_all_users(columns: list[str] | None = None) -> list[UserType]:
     """
     Получить всех пользователей из БД
     
+    Параметры:
+    - columns: list[str] | None - колонки для SELECT (по выбранным полям запроса); None - все
+    
     Возвращает:
     - list[UserType]: список всех пользователей, отсортированных по ID
     
@@ -56,18 +61,66 @@ async def get_all_users() -> list[UserType]:
     """
     async with AsyncSessionLocal() as session:
         result = await session.execute(
-            text("SELECT * FROM users ORDER BY id")
+            text(f"SELECT {select_list(columns)} FROM users ORDER BY id")
         )
         rows = result.mappings().all()
-        return [UserType(**row) for row in rows]
+        return [from_row(UserType, "users", row) for row in rows]
 
 
-async def get_user_by_id(user_id: int) -> UserType | None:
+async def get_users_page(
+    first: int = 20,
+    after: str | None = None,
+    columns: list[str] | None = None
+) -> UserConnection:
+    """
+    Получить страницу пользователей (по возрастанию ID) по курсору
+    
+    Параметры:
+    - first: int - размер страницы (1..100)
+    - after: str | None - курсор последнего пользователя предыдущей страницы
+    - columns: list[str] | None - колонки для SELECT; должны включать id (ключ курсора)
+    
+    Возвращает:
+    - UserConnection: пользователи страницы и pageInfo
+    
+    Примечание:
+    - Keyset-пагинация по первичному ключу: WHERE id > (курсор), без OFFSET
+    - Запрашивается first + 1 строка: лишняя строка означает, что есть следующая страница
+    """
+    limit = page_size(first)
+    params = {"limit": limit + 1}
+    where = ""
+    if after:
+        params["id"] = decode_user_cursor(after)
+        where = "WHERE id > :id"
+    
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            text(f"SELECT {select_list(columns)} FROM users {where} ORDER BY id LIMIT :limit"),
+            params
+        )
+        rows = result.mappings().all()
+    
+    edges = [
+        UserEdge(node=from_row(UserType, "users", row), cursor=encode_cursor(row["id"]))
+        for row in rows[:limit]
+    ]
+    return UserConnection(
+        edges=edges,
+        page_info=PageInfo(
+            has_next_page=len(rows) > limit,
+            end_cursor=edges[-1].cursor if edges else None
+        )
+    )
+
+
+async def get_user_by_id(user_id: int, columns: list[str] | None = None) -> UserType | None:
     """
     Получить пользователя по ID
     
     Параметры:
     - user_id: int - уникальный идентификатор пользователя
+    - columns: list[str] | None - колонки для SELECT (по выбранным полям запроса); None - все
     
     Возвращает:
     - UserType если пользователь найден
@@ -112,11 +165,11 @@ async def get_user_by_id(user_id: int) -> UserType | None:
     """
     async with AsyncSessionLocal() as session:
         result = await session.execute(
-            text("SELECT * FROM users WHERE id = :id"),
+            text(f"SELECT {select_list(columns)} FROM users WHERE id = :id"),
             {"id": user_id}
         )
         row = result.mappings().first()
-        return UserType(**row) if row else None
+        return from_row(UserType, "users", row) if row else None
 
 # ============================================================================
 # Create (создание данных)